@@ -0,0 +1,243 @@
+"""AI辅助分类：分块并发请求 + 按提示词持久缓存
+
+未分类的提示词先查本地缓存（ai_cache.sqlite3），只有未命中的部分才会
+按 ai_chunk_size 分块，通过复用的 AsyncOpenAI 客户端并发请求，
+并发数由 ai_concurrency 限制。每块要求模型返回 {"提示词": "分类"} 形式的
+JSON 对象，分类必须是 config["categories"] 中的名称，不符合的条目会被丢弃。
+"""
+
+import asyncio
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+
+import instrument
+import main as core
+
+CACHE_FILE = "ai_cache.sqlite3"
+DEFAULT_CHUNK_SIZE = 40
+DEFAULT_CONCURRENCY = 4
+
+# 用户消息中的固定标记，本地模拟服务（ai_stub_server.py）据此解析请求
+CATEGORIES_HEADER = "可选分类："
+TAGS_HEADER = "提示词列表："
+
+_cache_lock = threading.Lock()
+_cache_conn = None
+
+# {(api_key, base_url): (事件循环, 客户端)}
+_clients = {}
+
+
+def normalize_tag(tag):
+    """缓存键：去掉权重括号，统一为小写空格形式"""
+    tag = core.extract_core_word(tag).lower().replace("_", " ")
+    return re.sub(r"\s+", " ", tag).strip()
+
+
+def _cache():
+    global _cache_conn
+    if _cache_conn is None:
+        _cache_conn = sqlite3.connect(CACHE_FILE, check_same_thread=False)
+        _cache_conn.execute(
+            "CREATE TABLE IF NOT EXISTS tag_cache ("
+            "tag TEXT PRIMARY KEY, category TEXT NOT NULL, "
+            "model TEXT, updated REAL)"
+        )
+    return _cache_conn
+
+
+def cache_get_many(keys):
+    found = {}
+    keys = list(keys)
+    with _cache_lock:
+        conn = _cache()
+        for i in range(0, len(keys), 500):
+            batch = keys[i : i + 500]
+            rows = conn.execute(
+                "SELECT tag, category FROM tag_cache WHERE tag IN "
+                f"({','.join('?' * len(batch))})",
+                batch,
+            )
+            found.update(rows)
+    return found
+
+
+def cache_put_many(answers, model):
+    now = time.time()
+    with _cache_lock:
+        conn = _cache()
+        conn.executemany(
+            "INSERT OR REPLACE INTO tag_cache VALUES (?, ?, ?, ?)",
+            [(tag, category, model, now) for tag, category in answers.items()],
+        )
+        conn.commit()
+
+
+def get_client(api_key, base_url):
+    """按 (api_key, base_url) 复用客户端；客户端绑定事件循环，换循环时重建"""
+    import openai
+
+    loop = asyncio.get_running_loop()
+    cached = _clients.get((api_key, base_url))
+    if cached and cached[0] is loop:
+        return cached[1]
+    client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url)
+    _clients[(api_key, base_url)] = (loop, client)
+    return client
+
+
+def build_user_message(tags, category_names):
+    return (
+        f"{CATEGORIES_HEADER}{'、'.join(category_names)}\n"
+        "请对下列提示词逐个分类，只输出一个 JSON 对象，键为提示词原文，"
+        "值为上面列出的分类名之一；无法判断的提示词不要输出。\n"
+        f"{TAGS_HEADER}\n" + "\n".join(tags)
+    )
+
+
+def parse_answer(content):
+    """从模型输出中解析 JSON 对象，允许外层包裹 ``` 代码块或说明文字"""
+    start, end = content.find("{"), content.rfind("}")
+    if start < 0 or end < start:
+        return {}
+    try:
+        data = json.loads(content[start : end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {str(tag): category for tag, category in data.items()}
+
+
+def validate_answer(answer, requested, category_names):
+    """
+    校验模型返回的映射：提示词必须是本次请求的，分类必须是已配置的分类名。
+    返回 ({规范化提示词: 分类名}, 被拒绝的条目数)
+    """
+    names = {name.lower(): name for name in category_names}
+    accepted = {}
+    rejected = 0
+    for tag, category in answer.items():
+        key = normalize_tag(tag)
+        name = None
+        if isinstance(category, str):
+            name = names.get(category.strip().lower())
+        if key in requested and name:
+            accepted[key] = name
+        else:
+            rejected += 1
+    return accepted, rejected
+
+
+async def _classify_chunk(
+    client, semaphore, model, system_prompt, tags, categories, json_mode
+):
+    extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+    async with semaphore:
+        response = await client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": build_user_message(tags, categories)},
+            ],
+            stream=False,
+            **extra,
+        )
+    return parse_answer(response.choices[0].message.content or "")
+
+
+async def classify_tags(tags, config, api_key, base_url, system_prompt, model):
+    """
+    返回 ({提示词: 分类}, 统计信息)。
+    统计信息包含缓存命中数、实际请求次数以及因缓存节省的请求次数。
+    """
+    chunk_size = max(1, config.get("ai_chunk_size", DEFAULT_CHUNK_SIZE))
+    concurrency = max(1, config.get("ai_concurrency", DEFAULT_CONCURRENCY))
+    json_mode = config.get("ai_json_mode", True)
+    categories = [category["name"] for category in config["categories"]]
+
+    keys = {}
+    for tag in tags:
+        key = normalize_tag(tag)
+        if key:
+            keys.setdefault(key, tag)
+    # 分类被删除或改名后，旧的缓存结果视为未命中
+    with instrument.stage("ai_cache_lookup"):
+        cached = {
+            key: category
+            for key, category in cache_get_many(keys).items()
+            if category in categories
+        }
+    missing = [key for key in keys if key not in cached]
+
+    chunks = [
+        missing[i : i + chunk_size] for i in range(0, len(missing), chunk_size)
+    ]
+    fresh = {}
+    errors = []
+    rejected = 0
+    if chunks:
+        client = get_client(api_key, base_url)
+        semaphore = asyncio.Semaphore(concurrency)
+        with instrument.stage("ai_requests"):
+            results = await asyncio.gather(
+                *(
+                    _classify_chunk(
+                        client,
+                        semaphore,
+                        model,
+                        system_prompt,
+                        chunk,
+                        categories,
+                        json_mode,
+                    )
+                    for chunk in chunks
+                ),
+                return_exceptions=True,
+            )
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, Exception):
+                errors.append(result)
+                continue
+            accepted, chunk_rejected = validate_answer(result, set(chunk), categories)
+            fresh.update(accepted)
+            rejected += chunk_rejected
+        if fresh:
+            cache_put_many(fresh, model)
+
+    answers = {}
+    for key, tag in keys.items():
+        category = cached.get(key) or fresh.get(key)
+        if category:
+            answers[tag] = category
+
+    instrument.count("tags", len(keys))
+    instrument.count("cache_hits", len(cached))
+    instrument.count("api_calls", len(chunks))
+    stats = {
+        "tags": len(keys),
+        "cache_hits": len(cached),
+        "hit_rate": len(cached) / len(keys) if keys else 0.0,
+        "api_calls": len(chunks),
+        "api_calls_saved": math.ceil(len(keys) / chunk_size) - len(chunks),
+        "rejected": rejected,
+        "errors": [str(error) for error in errors],
+    }
+    return answers, stats
+
+
+def format_report(stats):
+    report = (
+        f"共 {stats['tags']} 个提示词，缓存命中 {stats['cache_hits']} 个"
+        f"（命中率 {stats['hit_rate']:.0%}），"
+        f"API 请求 {stats['api_calls']} 次，节省 {stats['api_calls_saved']} 次"
+    )
+    if stats["rejected"]:
+        report += f"，丢弃 {stats['rejected']} 个不合法的分类结果"
+    if stats["errors"]:
+        report += f"，失败 {len(stats['errors'])} 次：{stats['errors'][0]}"
+    return report
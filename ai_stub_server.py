@@ -0,0 +1,137 @@
+"""本地 OpenAI 兼容模拟服务，用于在不联网、不消耗额度的情况下调试AI分类
+
+用法：
+    python ai_stub_server.py [--port 8765] [--delay 0.2] [--malformed]
+然后在“AI分类设置”中填写 Base URL：http://127.0.0.1:8765/v1，API Key 任意。
+
+对 /chat/completions 请求，按提示词的 crc32 在“可选分类”中确定性地选一个分类，
+按 ai_classify 约定返回 {"提示词": "分类"} 形式的 JSON 对象。
+加上 --malformed 时，每次回复用代码块包裹，并额外带上 MALFORMED_PER_REPLY 个
+不合法的条目（未请求的提示词、不存在的分类），用于检查 ai_classify 的校验。
+python benchmark.py ai 会在后台启动本服务，自动检查分块、缓存和校验。
+"""
+
+import argparse
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ai_classify import CATEGORIES_HEADER, TAGS_HEADER
+
+UNKNOWN_TAG = "stub unrequested tag"
+UNKNOWN_CATEGORY = "stub unknown category"
+MALFORMED_PER_REPLY = 2
+
+
+def stub_answer(content, malformed=False):
+    categories = ["未分类"]
+    tags = []
+    in_tags = False
+    for line in content.splitlines():
+        if line.startswith(CATEGORIES_HEADER):
+            categories = line[len(CATEGORIES_HEADER) :].split("、")
+        elif line.startswith(TAGS_HEADER):
+            in_tags = True
+        elif in_tags and line.strip():
+            tags.append(line.strip())
+    answer = {
+        tag: categories[zlib.crc32(tag.encode("utf-8")) % len(categories)]
+        for tag in tags
+    }
+    if not malformed:
+        return json.dumps(answer, ensure_ascii=False)
+    # 一个未请求的提示词，以及第一个提示词改为不存在的分类
+    answer[UNKNOWN_TAG] = categories[0]
+    if tags:
+        answer[tags[0]] = UNKNOWN_CATEGORY
+    return f"```json\n{json.dumps(answer, ensure_ascii=False)}\n```"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+    malformed = False
+    request_count = 0
+    _count_lock = threading.Lock()
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with StubHandler._count_lock:
+            StubHandler.request_count += 1
+        if self.delay:
+            time.sleep(self.delay)
+
+        user_messages = [m for m in body["messages"] if m["role"] == "user"]
+        content = stub_answer(
+            user_messages[-1]["content"] if user_messages else "", self.malformed
+        )
+        payload = json.dumps(
+            {
+                "id": f"stub-{StubHandler.request_count}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "total_tokens": 0,
+                },
+            },
+            ensure_ascii=False,
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(port=0, delay=0.0, malformed=False):
+    """在后台线程启动模拟服务，返回 (server, base_url)"""
+    handler = type(
+        "Handler", (StubHandler,), {"delay": delay, "malformed": malformed}
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容模拟服务")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.0, help="每次请求的模拟延迟")
+    parser.add_argument(
+        "--malformed", action="store_true", help="回复中夹带不合法的条目"
+    )
+    args = parser.parse_args(argv)
+
+    handler = type(
+        "Handler", (StubHandler,), {"delay": args.delay, "malformed": args.malformed}
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), handler)
+    print(f"模拟服务已启动：http://127.0.0.1:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"共处理 {StubHandler.request_count} 次请求")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""分类 HTTP 接口（无界面）
+
+用法：
+    python main.py serve [--host 127.0.0.1] [--port 7861] [--workers 4]
+
+接口：
+    POST /classify  {"prompt": "1girl, sitting"}
+                    → {"categories": {分类名: [提示词, ...], ..., "未分类": [...]}}
+                    {"prompts": ["...", "..."]}
+                    → {"results": [{分类名: [...]}, ...]}（与输入顺序一致）
+    GET  /complete?q=long%20h&k=10
+                    → {"completions": [{"tag": "long hair", "category": "Characters"}]}
+                    加上 &underscore=1 时以下划线形式返回
+    GET  /health    → {"status": "ok"}
+    GET  /stats     → 已处理请求数、提示词数、拒绝数等
+
+--workers 为 1 时在服务进程内分类，所有请求线程共用常驻的词典索引；
+大于 1 时使用进程池，各工作进程 mmap 同一个编译词典（dictionary.bin），
+批量请求拆分到多个进程并行处理。
+同时处理的请求数不超过 --max-inflight，其余请求最多排队 --queue-timeout 秒，
+超时返回 503，避免请求无限堆积。
+压测见 python benchmark.py api。
+"""
+
+import argparse
+import json
+import multiprocessing
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import batch
+import dict_artifact
+import main as core
+
+DEFAULT_PORT = 7861
+MAX_BODY_BYTES = 1 << 20
+MAX_BATCH = 1000
+
+# 工作进程（或 --workers 1 时的服务进程）内是否启用拼写纠错，由 _init_worker 设置
+_use_typo = False
+
+
+def _init_worker(config, use_fuzzy, replace_underscore, artifact_path, use_typo):
+    global _use_typo
+    batch._init_worker(config, use_fuzzy, replace_underscore, artifact_path)
+    if use_typo:
+        core.get_typo_matcher(config, replace_underscore)
+    _use_typo = use_typo
+
+
+def classify_prompts(prompts):
+    use_fuzzy, replace_underscore, config, token_map = batch._worker_options
+    return [
+        core.classify_text(
+            prompt, use_fuzzy, replace_underscore, config, token_map, use_typo=_use_typo
+        )
+        for prompt in prompts
+    ]
+
+
+class ServerBusy(Exception):
+    pass
+
+
+class ClassifyService:
+    def __init__(
+        self,
+        config,
+        workers=1,
+        use_fuzzy=False,
+        use_typo=False,
+        replace_underscore=True,
+        artifact_path=dict_artifact.DEFAULT_PATH,
+        max_inflight=None,
+        queue_timeout=5.0,
+    ):
+        self.workers = max(1, workers)
+        self.queue_timeout = queue_timeout
+        self.max_inflight = max_inflight or self.workers * 4
+        self._slots = threading.BoundedSemaphore(self.max_inflight)
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "prompts": 0, "rejected": 0, "errors": 0}
+        self.started = time.time()
+        self.config = config
+        self._complete_lock = threading.Lock()
+
+        if use_fuzzy:
+            # 同 batch.classify_file：模糊匹配不使用编译词典
+            artifact_path = None
+        if artifact_path:
+            dict_artifact.ensure_artifact(config, artifact_path)
+        else:
+            core.get_token_map(config, replace_underscore)
+            if use_fuzzy:
+                core.get_fuzzy_matcher(config, replace_underscore)
+        initargs = (config, use_fuzzy, replace_underscore, artifact_path, use_typo)
+        if self.workers == 1:
+            _init_worker(*initargs)
+            self.pool = None
+        else:
+            self.pool = multiprocessing.Pool(self.workers, _init_worker, initargs)
+        # 补全索引在服务进程内常驻，启动时建好，避免第一次按键等待
+        core.get_completion_index(config)
+
+    def complete(self, prefix, k, replace_underscore=True):
+        with self._complete_lock:
+            index = core.get_completion_index(self.config)
+        return index.complete(prefix, k, replace_underscore)
+
+    def classify(self, prompts):
+        """返回与 prompts 一一对应的分类结果；超过并发上限且排队超时时抛出 ServerBusy"""
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._stats_lock:
+                self.stats["rejected"] += 1
+            raise ServerBusy
+        try:
+            if self.pool is None or len(prompts) == 1:
+                if self.pool is None:
+                    results = classify_prompts(prompts)
+                else:
+                    results = self.pool.apply(classify_prompts, (prompts,))
+            else:
+                chunk = -(-len(prompts) // self.workers)
+                parts = [prompts[i : i + chunk] for i in range(0, len(prompts), chunk)]
+                results = [
+                    result
+                    for part in self.pool.map(classify_prompts, parts)
+                    for result in part
+                ]
+        finally:
+            self._slots.release()
+        with self._stats_lock:
+            self.stats["requests"] += 1
+            self.stats["prompts"] += len(prompts)
+        return results
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats.update(
+            workers=self.workers,
+            max_inflight=self.max_inflight,
+            uptime_seconds=round(time.time() - self.started, 1),
+        )
+        return stats
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+
+
+class ClassifyHandler(BaseHTTPRequestHandler):
+    # 保持连接，客户端复用 TCP 连接时省去每次握手
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分两次写出，不关闭 Nagle 算法时会与客户端的延迟确认叠加，
+    # 每个请求固定多出约 40ms
+    disable_nagle_algorithm = True
+    service = None
+    verbose = False
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=()):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message, headers=()):
+        self._send_json(status, {"error": message}, headers)
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        path = path.rstrip("/")
+        if path == "/complete":
+            params = urllib.parse.parse_qs(query)
+            try:
+                k = min(int(params.get("k", ["10"])[0]), 100)
+            except ValueError:
+                self._error(400, "k 必须是整数")
+                return
+            underscore = params.get("underscore", ["0"])[0] in ("1", "true")
+            completions = self.service.complete(
+                params.get("q", [""])[0], k, not underscore
+            )
+            self._send_json(
+                200,
+                {
+                    "completions": [
+                        {"tag": tag, "category": category}
+                        for tag, category in completions
+                    ]
+                },
+            )
+        elif path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif path == "/stats":
+            self._send_json(200, self.service.snapshot())
+        else:
+            self._error(404, "未知路径")
+
+    def do_POST(self):
+        if self.path.split("?", 1)[0].rstrip("/") != "/classify":
+            self._error(404, "未知路径")
+            return
+        length = (self.headers.get("Content-Length") or "0").strip()
+        if not (length.isascii() and length.isdigit()):
+            # 长度不合法时无法确定请求体的边界，回复后关闭连接
+            self.close_connection = True
+            self._error(400, "Content-Length 必须是非负整数")
+            return
+        length = int(length)
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self._error(413, f"请求体超过 {MAX_BODY_BYTES} 字节")
+            return
+        try:
+            body = json.loads(self.rfile.read(length) or b"null")
+        except ValueError:
+            self._error(400, "请求体不是合法的 JSON")
+            return
+
+        if not isinstance(body, dict):
+            body = {}
+        single = isinstance(body.get("prompt"), str)
+        prompts = [body["prompt"]] if single else body.get("prompts")
+        if not isinstance(prompts, list) or not all(
+            isinstance(prompt, str) for prompt in prompts
+        ):
+            self._error(400, '需要 {"prompt": 字符串} 或 {"prompts": [字符串, ...]}')
+            return
+        if len(prompts) > MAX_BATCH:
+            self._error(413, f"单次最多 {MAX_BATCH} 条提示词")
+            return
+
+        try:
+            results = self.service.classify(prompts) if prompts else []
+        except ServerBusy:
+            self._error(503, "服务繁忙，请稍后重试", [("Retry-After", "1")])
+            return
+        except Exception as e:
+            with self.service._stats_lock:
+                self.service.stats["errors"] += 1
+            self._error(500, f"分类失败：{e}")
+            return
+        if single:
+            self._send_json(200, {"categories": results[0]})
+        else:
+            self._send_json(200, {"results": results})
+
+
+class ClassifyServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认的 listen 队列只有 5，高并发建连时多余的连接要等 SYN 重传（约 1 秒）
+    request_queue_size = 256
+
+
+def create_server(service, host="127.0.0.1", port=DEFAULT_PORT, verbose=False):
+    handler = type(
+        "BoundClassifyHandler",
+        (ClassifyHandler,),
+        {"service": service, "verbose": verbose},
+    )
+    return ClassifyServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python main.py serve", description="提示词分类 HTTP 接口"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="分类进程数；1 表示在服务进程内分类",
+    )
+    parser.add_argument(
+        "--max-inflight", type=int, help="同时处理的请求数上限，默认 workers × 4"
+    )
+    parser.add_argument(
+        "--queue-timeout", type=float, default=5.0, help="排队超过该秒数返回 503"
+    )
+    parser.add_argument("--fuzzy", action="store_true", help="启用双向模糊匹配")
+    parser.add_argument(
+        "--typo", action="store_true", help="启用拼写纠错（每个工作进程各建一份索引）"
+    )
+    parser.add_argument(
+        "--no-replace-underscore",
+        dest="replace_underscore",
+        action="store_false",
+        help="按下划线类提示词进行字典匹配",
+    )
+    parser.add_argument(
+        "--artifact",
+        default=dict_artifact.DEFAULT_PATH,
+        help="编译词典路径，过期时自动重建；传空字符串则使用进程内词典",
+    )
+    parser.add_argument("--verbose", action="store_true", help="输出每个请求的日志")
+    args = parser.parse_args(argv)
+
+    service = ClassifyService(
+        core.load_config(),
+        workers=args.workers,
+        use_fuzzy=args.fuzzy,
+        use_typo=args.typo,
+        replace_underscore=args.replace_underscore,
+        artifact_path=args.artifact,
+        max_inflight=args.max_inflight,
+        queue_timeout=args.queue_timeout,
+    )
+    server = create_server(service, args.host, args.port, args.verbose)
+    print(
+        f"分类接口已启动：http://{args.host}:{args.port}/classify"
+        f"（{service.workers} 个分类进程，最多 {service.max_inflight} 个并发请求）"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
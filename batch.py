@@ -0,0 +1,275 @@
+"""批量分类（无界面）
+
+用法：
+    python main.py classify --input prompts.txt --out results.jsonl \
+        [--workers 4] [--resume] [--fuzzy] [--stats] [--vector --window 20000]
+
+输入文件每行一条提示词，逐行流式读取；结果按输入顺序逐条写入 JSON Lines：
+    {"line": 行号, "prompt": 原提示词, "categories": {分类名: [提示词, ...], ...}}
+每写完一个窗口会更新检查点文件（<out>.ckpt），使用 --resume 可从上次中断处继续。
+--stats 把本次分类结果计入提示词统计（tag_stats.py），重复运行同一输入会重复计数。
+--vector 在主进程内按窗口用 vector_match 批量精确匹配（需要 NumPy），结果与逐条
+分类相同；窗口越大越快，建议配合 --window 20000 使用。
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+import dict_artifact
+import main as core
+import tag_stats
+import vector_match
+
+# 工作进程内的分类参数，由 _init_worker 设置
+_worker_options = None
+
+
+def _init_worker(config, use_fuzzy, replace_underscore, artifact_path=None):
+    global _worker_options
+    if artifact_path:
+        # 各进程 mmap 同一个编译词典，由操作系统共享页面
+        token_map = dict_artifact.DictionaryArtifact(artifact_path).token_map(
+            replace_underscore
+        )
+    else:
+        # fork 启动时词典索引已由父进程构建并继承，这里只做签名校验；
+        # spawn 启动时在每个工作进程中构建一次
+        token_map = core.get_token_map(config, replace_underscore)
+    if use_fuzzy:
+        core.get_fuzzy_matcher(config, replace_underscore)
+    _worker_options = (use_fuzzy, replace_underscore, config, token_map)
+
+
+def classify_line(item):
+    line_no, text = item
+    text = text.strip()
+    if not text:
+        return line_no, None
+    use_fuzzy, replace_underscore, config, token_map = _worker_options
+    categories = core.classify_text(
+        text, use_fuzzy, replace_underscore, config, token_map
+    )
+    record = {"line": line_no, "prompt": text, "categories": categories}
+    return line_no, json.dumps(record, ensure_ascii=False)
+
+
+def classify_window(matcher, batch_items):
+    """用 VectorMatcher 一次分类整个窗口，返回值与逐行 classify_line 的结果相同"""
+    lines = [(line_no, text.strip()) for line_no, text in batch_items]
+    lines = [(line_no, text) for line_no, text in lines if text]
+    records = {}
+    for (line_no, text), categories in zip(
+        lines, matcher.classify_batch([text for _, text in lines])
+    ):
+        record = {"line": line_no, "prompt": text, "categories": categories}
+        records[line_no] = json.dumps(record, ensure_ascii=False)
+    return [(line_no, records.get(line_no)) for line_no, _ in batch_items]
+
+
+def _checkpoint_path(out_path):
+    return out_path + ".ckpt"
+
+
+def load_checkpoint(input_path, out_path):
+    """返回 (已处理行数, 输出文件有效字节数)，没有可用检查点时返回 (0, 0)"""
+    try:
+        with open(_checkpoint_path(out_path), "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return 0, 0
+    if checkpoint.get("input") != os.path.abspath(input_path):
+        return 0, 0
+    return checkpoint["lines_done"], checkpoint["out_bytes"]
+
+
+def save_checkpoint(input_path, out_path, lines_done, out_bytes):
+    path = _checkpoint_path(out_path)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "input": os.path.abspath(input_path),
+                "lines_done": lines_done,
+                "out_bytes": out_bytes,
+            },
+            f,
+        )
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def _windows(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        window = list(itertools.islice(iterator, size))
+        if not window:
+            return
+        yield window
+
+
+def run_pipeline(items, worker_fn, workers, window, initializer, initargs, on_window):
+    """
+    按窗口把 items 分发给进程池，保持输入顺序把结果交给 on_window。
+    同一时间最多有两个窗口在处理中，内存占用与输入规模无关。
+    """
+    windows = _windows(items, window)
+    if workers <= 1:
+        initializer(*initargs)
+        for batch_items in windows:
+            on_window(batch_items, [worker_fn(item) for item in batch_items])
+        return
+
+    chunksize = max(1, window // (workers * 4))
+    with multiprocessing.Pool(workers, initializer, initargs) as pool:
+        pending = None
+        for batch_items in windows:
+            async_result = pool.map_async(worker_fn, batch_items, chunksize)
+            submitted = (batch_items, async_result)
+            if pending:
+                on_window(pending[0], pending[1].get())
+            pending = submitted
+        if pending:
+            on_window(pending[0], pending[1].get())
+
+
+def classify_file(
+    input_path,
+    out_path,
+    config,
+    use_fuzzy=False,
+    replace_underscore=True,
+    workers=1,
+    window=2000,
+    resume=False,
+    artifact_path=dict_artifact.DEFAULT_PATH,
+    record_stats=False,
+    vector=False,
+):
+    lines_done, out_bytes = (0, 0)
+    if resume and os.path.exists(out_path):
+        lines_done, out_bytes = load_checkpoint(input_path, out_path)
+
+    if use_fuzzy:
+        # 模糊匹配要在每个进程里构建完整的词典索引，mmap 词典省不下内存，
+        # 改为父进程构建后由 fork 出的工作进程共享
+        artifact_path = None
+    matcher = None
+    if vector:
+        matcher = vector_match.VectorMatcher(
+            core.get_token_map(config, replace_underscore),
+            [category["name"] for category in config["categories"]],
+            config.get("extra_networks_category"),
+        )
+    elif artifact_path:
+        dict_artifact.ensure_artifact(config, artifact_path)
+    else:
+        # 父进程先构建好词典索引，fork 出的工作进程直接共享
+        core.get_token_map(config, replace_underscore)
+    if use_fuzzy:
+        core.get_fuzzy_matcher(config, replace_underscore)
+
+    out = open(out_path, "r+b" if lines_done else "wb")
+    out.truncate(out_bytes)
+    out.seek(out_bytes)
+    if lines_done:
+        print(f"从第 {lines_done + 1} 行继续")
+
+    stats = {"lines": lines_done, "prompts": 0, "start": time.perf_counter()}
+
+    def on_window(batch_items, results):
+        for _, record in results:
+            if record is not None:
+                out.write(record.encode("utf-8") + b"\n")
+                stats["prompts"] += 1
+                if record_stats:
+                    tag_stats.record(json.loads(record)["categories"], journal=False)
+        out.flush()
+        os.fsync(out.fileno())
+        stats["lines"] = batch_items[-1][0]
+        save_checkpoint(input_path, out_path, stats["lines"], out.tell())
+        elapsed = time.perf_counter() - stats["start"]
+        print(
+            f"已处理 {stats['lines']} 行，"
+            f"{stats['prompts'] / max(elapsed, 1e-9):.0f} 条/秒"
+        )
+
+    try:
+        with open(input_path, "r", encoding="utf-8") as f:
+            items = itertools.islice(enumerate(f, 1), lines_done, None)
+            if matcher:
+                for batch_items in _windows(items, window):
+                    on_window(batch_items, classify_window(matcher, batch_items))
+            else:
+                run_pipeline(
+                    items,
+                    classify_line,
+                    workers,
+                    window,
+                    _init_worker,
+                    (config, use_fuzzy, replace_underscore, artifact_path),
+                    on_window,
+                )
+    finally:
+        out.close()
+        if record_stats:
+            tag_stats.compact()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python main.py classify", description="批量分类提示词（无界面）"
+    )
+    parser.add_argument("--input", required=True, help="每行一条提示词的文本文件")
+    parser.add_argument("--out", required=True, help="输出的 JSON Lines 文件")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="工作进程数"
+    )
+    parser.add_argument("--window", type=int, default=2000, help="每个检查点的行数")
+    parser.add_argument("--resume", action="store_true", help="从检查点继续")
+    parser.add_argument("--fuzzy", action="store_true", help="启用双向模糊匹配")
+    parser.add_argument(
+        "--no-replace-underscore",
+        dest="replace_underscore",
+        action="store_false",
+        help="按下划线类提示词进行字典匹配",
+    )
+    parser.add_argument(
+        "--artifact",
+        default=dict_artifact.DEFAULT_PATH,
+        help="编译词典路径，过期时自动重建；传空字符串则使用进程内词典",
+    )
+    parser.add_argument(
+        "--stats", action="store_true", help="把分类结果计入提示词统计"
+    )
+    parser.add_argument(
+        "--vector",
+        action="store_true",
+        help="用 NumPy 向量化批量精确匹配（在主进程内运行，--workers 不生效）",
+    )
+    args = parser.parse_args(argv)
+    if args.vector and args.fuzzy:
+        parser.error("--vector 只做精确匹配，不能与 --fuzzy 同时使用")
+    if args.vector and not vector_match.is_available():
+        parser.error("--vector 需要 NumPy（pip install numpy）")
+
+    stats = classify_file(
+        args.input,
+        args.out,
+        core.load_config(),
+        use_fuzzy=args.fuzzy,
+        replace_underscore=args.replace_underscore,
+        workers=args.workers,
+        window=args.window,
+        resume=args.resume,
+        artifact_path=args.artifact,
+        record_stats=args.stats,
+        vector=args.vector,
+    )
+    elapsed = time.perf_counter() - stats["start"]
+    print(f"完成：{stats['prompts']} 条提示词，用时 {elapsed:.1f} 秒")
+    return 0
@@ -0,0 +1,1213 @@
+"""性能基准测试
+
+用法：
+    python benchmark.py fuzzy [--tags 100] [--repeat 3]
+    python benchmark.py startup [--budget-ms 200]
+    python benchmark.py suite [--scales shipped,100000,1000000] [--out 结果.json]
+    python benchmark.py compare 旧结果.json 新结果.json
+    python benchmark.py api [--concurrency 1,4,16,64] [--workers 4] [--url http://...]
+    python benchmark.py semantic [--holdout 0.1]
+    python benchmark.py live [--sizes 30,100,300,1000] [--typo]
+    python benchmark.py concurrency [--savers 16] [--lines 200] [--no-lock]
+    python benchmark.py vector [--prompts 20000] [--tags 30] [--syntax 0.2]
+    python benchmark.py ai [--tags 200] [--chunk 40] [--delay 0.05]
+    python benchmark.py dataset [--captions 5000] [--tags 20]
+    python benchmark.py move [--sizes 100,10000,100000] [--selected 5]
+    python benchmark.py complete [--keys 1000] [--budget-ms 10]
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import extract_store
+import main
+from classify_state import HISTORY_LIMIT, ClassifyState
+from live_classify import LiveSession
+
+
+def legacy_fuzzy_match(raw_part, category_words):
+    """旧版双向模糊匹配：逐分类、逐词做子串判断，命中第一个即返回"""
+    for category_name, words in category_words.items():
+        for word in words:
+            if word in raw_part or raw_part in word:
+                return word, category_name
+    return None
+
+
+def sample_fuzzy_tags(token_map, count, seed=0):
+    """生成模糊匹配用的提示词：带修饰词的词典词、截断的词典词和无关词"""
+    rng = random.Random(seed)
+    words = sorted(word for word in token_map if len(word) >= 5)
+    tags = []
+    for i in range(count):
+        word = rng.choice(words)
+        kind = i % 3
+        if kind == 0:
+            tags.append(f"{rng.choice(['red', 'huge', 'detailed'])} {word}")
+        elif kind == 1:
+            tags.append(word.split(" ")[-1] if " " in word else word[:-1])
+        else:
+            tags.append("".join(rng.choice("qxzjvk") for _ in range(8)))
+    return tags
+
+
+def _timeit(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_fuzzy(args):
+    config = main.load_config()
+    token_map = main.get_token_map(config, args.replace_underscore)
+    all_words = main.get_all_words(config, args.replace_underscore)
+    category_words = {
+        name: all_words[name] for name in main.get_category_priority(config)
+    }
+    tags = sample_fuzzy_tags(token_map, args.tags)
+
+    start = time.perf_counter()
+    main.get_fuzzy_matcher(config, args.replace_underscore)
+    build = time.perf_counter() - start
+    matcher = main.get_fuzzy_matcher(config, args.replace_underscore)
+
+    legacy = _timeit(lambda: [legacy_fuzzy_match(t, category_words) for t in tags], 1)
+    engine = _timeit(lambda: [matcher.match(t) for t in tags], args.repeat)
+    scale = 100 / len(tags)
+
+    print(f"词典规模：{len(token_map)} 个提示词，样本：{len(tags)} 个提示词")
+    print(f"索引构建：{build * 1000:.1f} ms（每个进程仅一次）")
+    print(f"旧版双向子串循环：{legacy * scale * 1000:.1f} ms / 100 tags")
+    print(f"Aho-Corasick + n-gram：{engine * scale * 1000:.2f} ms / 100 tags")
+    print(f"加速比：{legacy / engine:.0f}x")
+
+
+# 分类核心启动时不应导入的重量级依赖
+HEAVY_MODULES = ("gradio", "openai", "torch", "numpy")
+
+
+def measure_import_time(module="main"):
+    """用 python -X importtime 导入 module，返回 [(模块名, 自身us, 累计us)]"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|", 2)
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def bench_startup(args):
+    rows = measure_import_time(args.module)
+    total = next(cum for name, _, cum in rows if name == args.module)
+    heavy = sorted({n for n, _, _ in rows if n.split(".")[0] in HEAVY_MODULES})
+
+    print(f"import {args.module}：{total / 1000:.1f} ms，共导入 {len(rows)} 个模块")
+    print("自身耗时最长的模块：")
+    for name, self_us, cum_us in sorted(rows, key=lambda r: -r[1])[:10]:
+        print(f"  {self_us / 1000:8.2f} ms  (累计 {cum_us / 1000:8.2f} ms)  {name}")
+
+    failed = False
+    if heavy:
+        print(f"启动时导入了重量级依赖：{', '.join(heavy)}")
+        failed = True
+    if total / 1000 > args.budget_ms:
+        print(f"启动耗时超出预算 {args.budget_ms} ms")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+# --- 完整基准套件 ---
+SUITE_PROMPT_SIZES = (10, 100, 1000)
+SUITE_EXTRACT_SIZES = (0, 10_000, 100_000)
+SYLLABLES = (
+    "ka ri to ne mo su ha ru yu ki ta na mi so ra ao shi ro ku me "
+    "lo ve ar te ch ir on al is en or an el um ix"
+).split()
+
+
+def synthetic_tag(rng):
+    words = [
+        "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        for _ in range(rng.randint(1, 3))
+    ]
+    return "_".join(words)
+
+
+def generate_dictionary(root, total, categories=5, seed=0):
+    """在 root 下生成 categories 个分类目录，共 total 个不重复的下划线形式提示词"""
+    rng = random.Random(seed)
+    tags = set()
+    while len(tags) < total:
+        tags.add(synthetic_tag(rng))
+    tags = sorted(tags)
+    rng.shuffle(tags)
+    config = {"categories": []}
+    for i in range(categories):
+        name = f"Cat{i}"
+        path = os.path.join(root, name)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "words.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(tags[i::categories]))
+        config["categories"].append({"name": name, "path": path})
+    return config
+
+
+def generate_prompt(token_map, size, rng, hit_rate=0.7):
+    """生成 size 个提示词的提示，约 hit_rate 比例可在词典中精确匹配"""
+    words = list(token_map)
+    parts = []
+    for _ in range(size):
+        if rng.random() < hit_rate:
+            tag = rng.choice(words)
+            if rng.random() < 0.2:
+                tag = f"({tag}:{rng.choice(['0.8', '1.2', '1.3'])})"
+        else:
+            tag = synthetic_tag(rng).replace("_", " ") + " zq"
+        parts.append(tag)
+    return ", ".join(parts)
+
+
+def _time_per_call(fn, min_time=0.2, max_calls=1000):
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or calls >= max_calls:
+            return elapsed / calls
+
+
+def _suite_scale(scale, args, results):
+    root = None
+    if scale == "shipped":
+        config = main.load_config()
+    else:
+        root = tempfile.mkdtemp(prefix="sdpc_bench_")
+        config = generate_dictionary(root, int(scale))
+    main.clear_dictionary_caches()
+
+    try:
+        for replace_underscore in (False, True):
+            start = time.perf_counter()
+            token_map = main.get_token_map(config, replace_underscore)
+            build = time.perf_counter() - start
+            results.append(
+                {
+                    "case": "index_build",
+                    "scale": scale,
+                    "dictionary_size": len(token_map),
+                    "replace_underscore": replace_underscore,
+                    "seconds": build,
+                }
+            )
+            print(f"[{scale}] 索引构建 下划线替换={replace_underscore}：{build:.3f} s")
+
+            use_fuzzy_modes = [False]
+            if len(token_map) <= args.fuzzy_max_scale:
+                use_fuzzy_modes.append(True)
+            rng = random.Random(1)
+            for use_fuzzy in use_fuzzy_modes:
+                if use_fuzzy:
+                    start = time.perf_counter()
+                    main.get_fuzzy_matcher(config, replace_underscore)
+                    print(f"[{scale}] 模糊索引构建：{time.perf_counter() - start:.3f} s")
+                for size in SUITE_PROMPT_SIZES:
+                    prompt = generate_prompt(token_map, size, rng)
+                    per_call = _time_per_call(
+                        lambda: main.classify_text(
+                            prompt, use_fuzzy, replace_underscore, config
+                        )
+                    )
+                    results.append(
+                        {
+                            "case": "classify",
+                            "scale": scale,
+                            "dictionary_size": len(token_map),
+                            "replace_underscore": replace_underscore,
+                            "fuzzy": use_fuzzy,
+                            "prompt_tags": size,
+                            "seconds_per_prompt": per_call,
+                            "tags_per_second": size / per_call,
+                        }
+                    )
+                    print(
+                        f"[{scale}] {'模糊' if use_fuzzy else '精确'} "
+                        f"下划线替换={replace_underscore} {size} tags："
+                        f"{per_call * 1000:.3f} ms"
+                    )
+    finally:
+        main.clear_dictionary_caches()
+        if root:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def _suite_save(args, results):
+    """保存耗时随 extract 文件增长的变化（首次保存含建立索引）"""
+    cwd = os.getcwd()
+    root = tempfile.mkdtemp(prefix="sdpc_bench_save_")
+    rng = random.Random(2)
+    try:
+        os.chdir(root)
+        for size in SUITE_EXTRACT_SIZES:
+            name = f"bench{size}"
+            with open(f"extract_{name}.txt", "w", encoding="utf-8") as f:
+                for i in range(size):
+                    f.write(f"{synthetic_tag(rng)}, history {i}\n")
+            start = time.perf_counter()
+            main.save_unique(name, f"{synthetic_tag(rng)}, first", False)
+            first = time.perf_counter() - start
+            counter = iter(range(10**9))
+            per_save = _time_per_call(
+                lambda: main.save_unique(name, f"new {next(counter)}, tag", False),
+                max_calls=200,
+            )
+            results.append(
+                {
+                    "case": "save",
+                    "extract_lines": size,
+                    "first_save_seconds": first,
+                    "seconds_per_save": per_save,
+                }
+            )
+            print(
+                f"[save] extract {size} 行：首次 {first * 1000:.1f} ms，"
+                f"之后每次 {per_save * 1000:.2f} ms"
+            )
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def bench_suite(args):
+    results = []
+    for scale in args.scales.split(","):
+        _suite_scale(scale.strip(), args, results)
+    if not args.skip_save:
+        _suite_save(args, results)
+
+    out = args.out or os.path.join(
+        "bench_results", time.strftime("bench_%Y%m%d_%H%M%S.json")
+    )
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(
+            {"environment": _environment(), "results": results},
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    print(f"结果已写入：{out}")
+
+
+def _start_api_server(port, workers):
+    """在子进程中启动分类接口，等待 /health 可用后返回进程对象"""
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "main.py",
+            "serve",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    deadline = time.perf_counter() + 120
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("分类接口启动失败")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/health")
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("等待分类接口启动超时")
+
+
+def _api_load(host, port, bodies, requests, concurrency):
+    """concurrency 个线程各自保持一个连接，共发送 requests 个请求"""
+    latencies = []
+    errors = []
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def client():
+        connection = http.client.HTTPConnection(host, port, timeout=60)
+        headers = {"Content-Type": "application/json"}
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            start = time.perf_counter()
+            try:
+                body = bodies[i % len(bodies)]
+                connection.request("POST", "/classify", body, headers)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException) as e:
+                status = type(e).__name__
+                connection.close()
+                connection = http.client.HTTPConnection(host, port, timeout=60)
+            elapsed = time.perf_counter() - start
+            with lock:
+                if status == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(status)
+        connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def bench_api(args):
+    config = main.load_config()
+    token_map = main.get_token_map(config, True)
+    rng = random.Random(0)
+    bodies = []
+    for _ in range(200):
+        prompts = [
+            generate_prompt(token_map, args.tags, rng) for _ in range(args.batch)
+        ]
+        payload = {"prompt": prompts[0]} if args.batch == 1 else {"prompts": prompts}
+        bodies.append(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+    process = None
+    if args.url:
+        parsed = urllib.parse.urlparse(args.url)
+        host, port = parsed.hostname, parsed.port or 80
+    else:
+        host, port = "127.0.0.1", args.port
+        process = _start_api_server(port, args.workers)
+    try:
+        _api_load(host, port, bodies, min(args.requests, 50), 1)  # 预热
+        print(
+            f"每个请求 {args.batch} 条提示词、每条 {args.tags} 个提示词"
+            + ("" if args.url else f"，服务端 {args.workers} 个分类进程")
+        )
+        print(f"{'并发':>6} {'请求/秒':>10} {'p50(ms)':>10} {'p99(ms)':>10} {'失败':>6}")
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            latencies, errors, elapsed = _api_load(
+                host, port, bodies, args.requests, concurrency
+            )
+            latencies.sort()
+            print(
+                f"{concurrency:>6} {len(latencies) / elapsed:>10.0f} "
+                f"{_percentile(latencies, 0.5) * 1000:>10.2f} "
+                f"{_percentile(latencies, 0.99) * 1000:>10.2f} {len(errors):>6}"
+            )
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+def _result_key(result):
+    return tuple(
+        (key, value)
+        for key, value in sorted(result.items())
+        if not key.startswith("seconds")
+        and not key.endswith("seconds")
+        and key != "tags_per_second"
+    )
+
+
+def _result_seconds(result):
+    for key in ("seconds_per_prompt", "seconds_per_save", "seconds"):
+        if key in result:
+            return result[key]
+    return None
+
+
+def _typing_edits(base, typed, at_end):
+    """模拟在提示词末尾或中间逐字输入 typed，返回每次按键后的文本"""
+    addition = typed + ", "
+    if at_end:
+        head, tail = base + ", ", ""
+    else:
+        cut = base.index(", ", len(base) // 2) + 2
+        head, tail = base[:cut], base[cut:]
+    return [head + addition[:i] + tail for i in range(1, len(addition) + 1)]
+
+
+def bench_live(args):
+    config = main.load_config()
+    token_map = main.get_token_map(config, args.replace_underscore)
+    words = list(token_map)
+    rng = random.Random(0)
+    typed = "looking at viewer"
+    names = [category["name"] for category in config["categories"]]
+    print(f"每次按键的分类耗时（逐字输入 {typed!r}），单位 µs；更新分类数为发送的分类组件数")
+    print(
+        f"{'提示词数':>8} {'位置':>4} {'整体 p50':>10} {'整体 p99':>10} "
+        f"{'增量 p50':>10} {'增量 p99':>10} {'更新分类数':>10}"
+    )
+    for size in [int(n) for n in args.sizes.split(",")]:
+        base = ", ".join(rng.choice(words) for _ in range(size))
+        for at_end in (True, False):
+            edits = _typing_edits(base, typed, at_end) * args.repeat
+            # 预热：词典索引和纠错引擎只在首次使用时构建
+            main.classify_text(
+                base, False, args.replace_underscore, config, use_typo=args.typo
+            )
+
+            full = []
+            for text in edits:
+                start = time.perf_counter()
+                results = main.classify_text(
+                    text, False, args.replace_underscore, config, use_typo=args.typo
+                )
+                ClassifyState().replace(results)
+                full.append(time.perf_counter() - start)
+
+            session = LiveSession()
+            state = ClassifyState()
+            main.classify_live(
+                session, base, False, args.typo, args.replace_underscore, config
+            )
+            incremental = []
+            updated = 0
+            for text in edits:
+                start = time.perf_counter()
+                results, _ = main.classify_live(
+                    session, text, False, args.typo, args.replace_underscore, config
+                )
+                changed = state.replace(results, coalesce=True)
+                incremental.append(time.perf_counter() - start)
+                updated += len(changed)
+
+            full.sort()
+            incremental.sort()
+            print(
+                f"{size:>8} {'末尾' if at_end else '中间':>4} "
+                f"{_percentile(full, 0.5) * 1e6:>10.0f} "
+                f"{_percentile(full, 0.99) * 1e6:>10.0f} "
+                f"{_percentile(incremental, 0.5) * 1e6:>10.0f} "
+                f"{_percentile(incremental, 0.99) * 1e6:>10.0f} "
+                f"{updated / len(edits):>5.1f}/{len(names) + 1}"
+            )
+
+
+def bench_semantic(args):
+    import semantic_fallback
+
+    if not semantic_fallback.is_available():
+        print("未安装 NumPy，无法测试本地语义分类（pip install numpy）")
+        sys.exit(1)
+    token_map = main.get_token_map(main.load_config(), False)
+    report = semantic_fallback.evaluate(token_map, args.holdout)
+    print(semantic_fallback.format_report(report))
+
+
+def _check_extract(path, expected):
+    """检查 extract 文件与索引：返回问题列表（为空表示一致）"""
+    with open(path, "rb") as f:
+        raw_lines = f.read().split(b"\n")
+    lines = [raw.decode("utf-8", errors="replace").strip() for raw in raw_lines]
+    lines = [line for line in lines if line]
+    problems = []
+    saved = set(lines)
+    if len(lines) != len(saved):
+        problems.append(f"重复行 {len(lines) - len(saved)} 行")
+    if saved - expected:
+        problems.append(f"损坏或交错的行 {len(saved - expected)} 行")
+    if expected - saved:
+        problems.append(f"丢失的行 {len(expected - saved)} 行")
+
+    with open(path + ".idx", "rb") as f:
+        records = list(extract_store.RECORD.iter_unpack(f.read()))
+    digests = [digest for digest, _ in records]
+    if sorted(digests) != sorted(map(extract_store.line_digest, lines)):
+        problems.append("索引与文本不一致")
+    if records and records[-1][1] != os.path.getsize(path):
+        problems.append("索引未覆盖整个文本")
+    return problems
+
+
+def bench_concurrency(args):
+    """多个线程同时保存到同一个 extract 文件，同时读写配置，检查结果是否完整"""
+    cwd = os.getcwd()
+    root = tempfile.mkdtemp(prefix="sdpc_bench_concurrency_")
+    try:
+        os.chdir(root)
+        name = "bench"
+        path = f"extract_{name}.txt"
+        # 每个线程写入自己的行，另有一部分各线程都会保存的重复行
+        batches = [
+            [
+                f"shared {i}, tag" if i % 5 == 0 else f"saver {t} line {i}, tag"
+                for i in range(args.lines)
+            ]
+            for t in range(args.savers)
+        ]
+        expected = {line for batch in batches for line in batch}
+        append = extract_store.append_line
+        if not args.lock:
+            append = extract_store._append_line_locked
+
+        config = main.load_config()
+        errors = []
+        reads = [0]
+        stop = threading.Event()
+
+        def saver(batch):
+            for line in batch:
+                append(path, line, True)
+
+        def config_writer():
+            version = 0
+            while not stop.is_set():
+                version += 1
+                main.save_config({**main.load_config(), "bench_version": version})
+
+        def config_reader():
+            while not stop.is_set():
+                try:
+                    with open(main.CONFIG_FILE, "r", encoding="utf-8") as f:
+                        loaded = json.load(f)
+                    if loaded["categories"] != config["categories"]:
+                        errors.append("配置内容错误")
+                    main.load_config()["categories"]
+                except (OSError, ValueError, KeyError) as e:
+                    errors.append(repr(e))
+                reads[0] += 1
+
+        savers = [threading.Thread(target=saver, args=(b,)) for b in batches]
+        others = [threading.Thread(target=config_writer)]
+        others += [threading.Thread(target=config_reader) for _ in range(2)]
+        start = time.perf_counter()
+        for thread in savers + others:
+            thread.start()
+        for thread in savers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for thread in others:
+            thread.join()
+
+        # 清空内存索引，按磁盘上的文本和索引重新检查
+        extract_store._indexes.clear()
+        problems = _check_extract(path, expected)
+        total = sum(len(batch) for batch in batches)
+        print(
+            f"{args.savers} 个线程共保存 {total} 次（不重复 {len(expected)} 行）："
+            f"{elapsed:.2f} 秒，{total / elapsed:.0f} 次/秒"
+            f"{'' if args.lock else '（不加锁）'}"
+        )
+        print(
+            f"同时读取配置 {reads[0]} 次，配置版本 {main.config_version()}，"
+            f"读取错误 {len(errors)} 次"
+        )
+
+        start = time.perf_counter()
+        for _ in range(1000):
+            main.load_config()
+        cached = (time.perf_counter() - start) / 1000
+        start = time.perf_counter()
+        for _ in range(1000):
+            with open(main.CONFIG_FILE, "r", encoding="utf-8") as f:
+                json.load(f)
+        parsed = (time.perf_counter() - start) / 1000
+        print(
+            f"load_config：快照 {cached * 1e6:.1f} us，"
+            f"每次读取解析 {parsed * 1e6:.1f} us"
+        )
+        for problem in problems + errors[:5]:
+            print(f"  {problem}")
+        if problems or errors:
+            sys.exit(1)
+        print("extract 文件与索引完整：无丢失、重复或交错的行")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def bench_vector(args):
+    import vector_match
+
+    if not vector_match.is_available():
+        print("未安装 NumPy，无法测试向量化精确匹配（pip install numpy）")
+        sys.exit(1)
+    config = main.load_config()
+    if args.scale != "shipped":
+        root = tempfile.mkdtemp(prefix="sdpc_bench_vector_")
+        config = {**config, **generate_dictionary(root, int(args.scale))}
+    main.clear_dictionary_caches()
+    token_map = main.get_token_map(config, args.replace_underscore)
+    names = [category["name"] for category in config["categories"]]
+
+    # 一部分提示带权重括号（逐条分词），其余为纯文本提示
+    rng = random.Random(0)
+    words = list(token_map)
+    texts = []
+    for _ in range(args.prompts):
+        if rng.random() < args.syntax:
+            texts.append(generate_prompt(token_map, args.tags, rng))
+        else:
+            texts.append(
+                ", ".join(
+                    rng.choice(words) if rng.random() < 0.7 else synthetic_tag(rng)
+                    for _ in range(args.tags)
+                )
+            )
+    tokens = args.prompts * args.tags
+
+    start = time.perf_counter()
+    matcher = vector_match.VectorMatcher(
+        token_map, names, config.get("extra_networks_category")
+    )
+    build = time.perf_counter() - start
+
+    def per_token_loop():
+        return [
+            main.classify_text(text, False, args.replace_underscore, config, token_map)
+            for text in texts
+        ]
+
+    expected = per_token_loop()
+    loop = _timeit(per_token_loop, args.repeat)
+    vector = _timeit(lambda: matcher.classify_batch(texts), args.repeat)
+    same = matcher.classify_batch(texts) == expected
+
+    print(f"词典规模：{len(token_map)} 个提示词，索引构建 {build * 1000:.0f} ms")
+    print(
+        f"{args.prompts} 条提示 × {args.tags} 个提示词，"
+        f"{args.syntax:.0%} 的提示带权重语法"
+    )
+    print(f"逐个查找：{loop:.2f} 秒，{tokens / loop / 1e6:.2f} M 提示词/秒")
+    print(f"向量化：  {vector:.2f} 秒，{tokens / vector / 1e6:.2f} M 提示词/秒")
+    print(f"加速比：{loop / vector:.1f}x，结果{'一致' if same else '不一致'}")
+    main.clear_dictionary_caches()
+    if args.scale != "shipped":
+        shutil.rmtree(root, ignore_errors=True)
+    if not same:
+        sys.exit(1)
+
+
+def _run_ai(tags, config, base_url):
+    import ai_classify
+
+    start = time.perf_counter()
+    answers, stats = asyncio.run(
+        ai_classify.classify_tags(tags, config, "stub", base_url, "stub", "stub")
+    )
+    return answers, stats, time.perf_counter() - start
+
+
+def bench_ai(args):
+    """用本地模拟服务跑 ai_classify.classify_tags，检查分块、缓存和结果校验"""
+    import ai_classify
+    import ai_stub_server
+
+    try:
+        import openai  # noqa: F401
+    except ImportError:
+        print("未安装 openai，无法测试AI分类（pip install openai）")
+        sys.exit(1)
+
+    config = {
+        **main.load_config(),
+        "ai_chunk_size": args.chunk,
+        "ai_concurrency": args.concurrency,
+    }
+    names = [category["name"] for category in config["categories"]]
+    rng = random.Random(0)
+    tags = sorted({synthetic_tag(rng) for _ in range(args.tags)})
+    chunks = -(-len(tags) // args.chunk)
+    stub = ai_stub_server.StubHandler
+    problems = []
+
+    def check(label, condition):
+        if not condition:
+            problems.append(label)
+
+    cwd = os.getcwd()
+    root = tempfile.mkdtemp(prefix="sdpc_bench_ai_")
+    servers = []
+    try:
+        # 缓存文件写在临时目录，不影响真实的 ai_cache.sqlite3
+        os.chdir(root)
+        ai_classify._cache_conn = None
+        server, base_url = ai_stub_server.start_stub_server(delay=args.delay)
+        servers.append(server)
+
+        before = stub.request_count
+        answers, stats, elapsed = _run_ai(tags, config, base_url)
+        print(
+            f"首次：{len(tags)} 个提示词，{stats['api_calls']} 次请求，"
+            f"{elapsed:.2f} 秒"
+        )
+        check("请求次数与分块数不符", stats["api_calls"] == chunks)
+        check("模拟服务收到的请求数与分块数不符", stub.request_count - before == chunks)
+        check("首次运行不应命中缓存", stats["cache_hits"] == 0)
+        check("有提示词没有得到分类", sorted(answers) == tags)
+        check("分类不在配置中", all(name in names for name in answers.values()))
+        check("出现请求错误", not stats["errors"])
+
+        before = stub.request_count
+        cached, stats, elapsed = _run_ai(tags, config, base_url)
+        print(
+            f"再次：缓存命中 {stats['cache_hits']} 个，"
+            f"{stats['api_calls']} 次请求，{elapsed * 1000:.1f} ms"
+        )
+        check("再次运行没有全部命中缓存", stats["cache_hits"] == len(tags))
+        check("再次运行仍发出了请求", stub.request_count == before)
+        check("缓存结果与首次结果不同", cached == answers)
+
+        server, base_url = ai_stub_server.start_stub_server(malformed=True)
+        servers.append(server)
+        fresh = [f"{tag} malformed" for tag in tags]
+        answers, stats, elapsed = _run_ai(fresh, config, base_url)
+        print(
+            f"不合法回复：{stats['api_calls']} 次请求，"
+            f"丢弃 {stats['rejected']} 个条目"
+        )
+        rejected_tags = {fresh[i] for i in range(0, len(fresh), args.chunk)}
+        check(
+            "没有丢弃全部不合法条目",
+            stats["rejected"] == chunks * ai_stub_server.MALFORMED_PER_REPLY,
+        )
+        check(
+            "不合法条目进入了结果",
+            sorted(answers) == sorted(set(fresh) - rejected_tags)
+            and ai_stub_server.UNKNOWN_TAG not in answers,
+        )
+        cached = ai_classify.cache_get_many(
+            [ai_classify.normalize_tag(tag) for tag in rejected_tags]
+            + [ai_stub_server.UNKNOWN_TAG]
+        )
+        check("不合法条目被写入缓存", not cached)
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        if ai_classify._cache_conn is not None:
+            ai_classify._cache_conn.close()
+            ai_classify._cache_conn = None
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+    for problem in problems:
+        print(f"  {problem}")
+    if problems:
+        sys.exit(1)
+    print("分块、缓存和结果校验均符合预期")
+
+
+def _syntax_piece(words, rng):
+    """含括号组、交替、调度、BREAK、额外网络或转义的标注片段"""
+    a, b = rng.choice(words), rng.choice(words)
+    return rng.choice(
+        [
+            f"(({a}:1.2), {b})",
+            f"[{a}|{b}]",
+            f"[{a}:{b}:10]",
+            f"{a} BREAK {b}",
+            f"<lora:{synthetic_tag(rng)}:0.8>",
+            f"{{{a}, {b}}}",
+            f"\\({synthetic_tag(rng)}\\)",
+        ]
+    )
+
+
+def bench_dataset(args):
+    """检查 dataset.rewrite_caption：不排除时原样输出，排除、重排时语法片段原样保留"""
+    import dataset
+
+    config = main.load_config()
+    token_map = main.get_token_map(config, True)
+    names = [category["name"] for category in config["categories"]]
+    words = list(token_map)
+    rng = random.Random(0)
+    captions = []
+    for _ in range(args.captions):
+        pieces = list(dict.fromkeys(rng.choice(words) for _ in range(args.tags)))
+        for _ in range(rng.randint(0, 3)):
+            pieces.insert(rng.randrange(len(pieces) + 1), _syntax_piece(words, rng))
+        caption = pieces[0]
+        for piece in pieces[1:]:
+            caption += rng.choice([", ", ", ", ",", " , ", "\n"]) + piece
+        captions.append(caption)
+
+    problems = []
+    exclude = names[:1]
+    start = time.perf_counter()
+    for caption in captions:
+        categories = main.classify_text(caption, False, True, config, token_map)
+        unchanged, _ = dataset.rewrite_caption(caption, categories, (), False, 0)
+        if unchanged != caption:
+            problems.append(f"未排除时标注被改动：{caption!r} → {unchanged!r}")
+
+        rewritten, _ = dataset.rewrite_caption(caption, categories, exclude, True, 0)
+        pinned = [p for p, tag, _ in dataset.split_caption(caption) if not tag]
+        pieces = dataset.split_caption(rewritten)
+        if [p for p, tag, _ in pieces if not tag] != pinned:
+            problems.append(f"语法片段未原样保留：{caption!r} → {rewritten!r}")
+        owners = {tag: name for name, tags in categories.items() for tag in tags}
+        if any(tag and owners.get(p) in exclude for p, tag, _ in pieces):
+            problems.append(f"排除的分类仍有提示词：{caption!r} → {rewritten!r}")
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{len(captions)} 条标注（每条约 {args.tags} 个提示词），"
+        f"{len(captions) / elapsed:.0f} 条/秒（含分类）"
+    )
+    for problem in problems[:5]:
+        print(f"  {problem}")
+    if problems:
+        print(f"共 {len(problems)} 处问题")
+        sys.exit(1)
+    print(f"未排除时全部原样输出；排除 {exclude[0]} 并重排时语法片段全部原样保留")
+
+
+def bench_move(args):
+    """移动提示词的耗时与分类大小无关；撤销/重做逐条恢复原顺序"""
+    names = [f"分类{i}" for i in range(args.categories)]
+    problems = []
+    print(f"{'分类大小':>8} {'移动 μs':>8} {'撤销 μs':>8} {'重做 μs':>8}")
+    for size in [int(n) for n in args.sizes.split(",")]:
+        rng = random.Random(size)
+        results = {
+            name: [f"{name}_{i}" for i in range(size)] for name in names + ["未分类"]
+        }
+        state = ClassifyState()
+        state.replace(results)
+        snapshots = [state.to_dict()]
+        timings = {"move": [], "undo": [], "redo": []}
+        for _ in range(args.moves):
+            source, destination = rng.sample(names, 2)
+            tags = state.tags(source)
+            selection = rng.sample(tags, min(args.selected, len(tags)))
+            start = time.perf_counter()
+            state.move({source: selection}, destination)
+            timings["move"].append(time.perf_counter() - start)
+            snapshots.append(state.to_dict())
+        for expected in reversed(snapshots[:-1]):
+            start = time.perf_counter()
+            state.undo()
+            timings["undo"].append(time.perf_counter() - start)
+            if state.to_dict() != expected:
+                problems.append(f"分类大小 {size}：撤销后内容或顺序与移动前不同")
+                break
+        for expected in snapshots[1 : len(state.redo_stack) + 1]:
+            start = time.perf_counter()
+            state.redo()
+            timings["redo"].append(time.perf_counter() - start)
+            if state.to_dict() != expected:
+                problems.append(f"分类大小 {size}：重做后内容或顺序与撤销前不同")
+                break
+        medians = {}
+        for kind, seconds in timings.items():
+            seconds.sort()
+            medians[kind] = _percentile(seconds, 0.5) * 1e6
+        print(
+            f"{size:>8} {medians['move']:>8.1f} {medians['undo']:>8.1f} "
+            f"{medians['redo']:>8.1f}"
+        )
+    for problem in problems:
+        print(f"  {problem}")
+    if problems:
+        sys.exit(1)
+    print(f"每次移动 {args.selected} 个提示词；撤销、重做后内容与顺序全部一致")
+
+
+def _wait_background_builds():
+    for thread in list(main._background_builds.values()):
+        thread.join()
+
+
+def bench_complete(args):
+    """补全：保存或词典变化后的第一次按键不在请求线程中重建索引、重算排名"""
+    import tag_complete
+    import tag_stats
+
+    config = main.load_config()
+    problems = []
+    cwd = os.getcwd()
+    root = tempfile.mkdtemp(prefix="sdpc_bench_complete_")
+    try:
+        # 词典复制到临时目录，统计文件也写在这里，不影响真实数据
+        for category in config["categories"]:
+            target = os.path.join(root, "dict", category["name"])
+            shutil.copytree(category["path"], target)
+            category["path"] = target
+        os.chdir(root)
+        main.clear_dictionary_caches()
+        tag_complete.RANK_REFRESH_SECONDS = 0
+
+        words = list(main.get_token_map(config, False))
+        rng = random.Random(0)
+        prefixes = [rng.choice(words)[:3] for _ in range(args.keys)]
+        start = time.perf_counter()
+        main.get_completion_index(config)
+        print(f"构建补全索引 {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        def keystroke(prefix):
+            start = time.perf_counter()
+            index = main.get_completion_index(config, wait=False)
+            completions = index.complete(prefix) if index else []
+            return time.perf_counter() - start, completions
+
+        steady = sorted(keystroke(prefix)[0] for prefix in prefixes)
+        print(f"普通按键 p50 {_percentile(steady, 0.5) * 1000:.2f} ms")
+
+        # 保存一行：统计变化，排名在后台重算
+        tag = rng.choice(words)
+        for _ in range(args.saves):
+            tag_stats.record_line(config["categories"][0]["name"], tag)
+        elapsed, _ = keystroke(tag[:3])
+        print(f"保存后第一次按键 {elapsed * 1000:.2f} ms")
+        if elapsed * 1000 > args.budget_ms:
+            problems.append(f"保存后第一次按键超过 {args.budget_ms} ms")
+        _wait_background_builds()
+        _, completions = keystroke(tag[:3])
+        if not completions or completions[0][0] != tag.replace("_", " "):
+            problems.append(f"后台重算排名后 {tag} 不在第一位：{completions}")
+
+        # AI分类结果加入词典：索引在后台重建
+        new_word = "zqxv_bench_completion"
+        main.add_words_to_category(config, config["categories"][0]["name"], [new_word])
+        elapsed, _ = keystroke("zqxv")
+        print(f"词典变化后第一次按键 {elapsed * 1000:.2f} ms")
+        if elapsed * 1000 > args.budget_ms:
+            problems.append(f"词典变化后第一次按键超过 {args.budget_ms} ms")
+        _wait_background_builds()
+        _, completions = keystroke("zqxv")
+        if [word for word, _ in completions] != [new_word.replace("_", " ")]:
+            problems.append(f"后台重建后找不到新词：{completions}")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+        main.clear_dictionary_caches()
+
+    for problem in problems:
+        print(f"  {problem}")
+    if problems:
+        sys.exit(1)
+    print(f"第一次按键均在 {args.budget_ms} ms 内，后台更新后结果正确")
+
+
+def bench_compare(args):
+    with open(args.old, encoding="utf-8") as f:
+        old = {_result_key(r): r for r in json.load(f)["results"]}
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)["results"]
+
+    regressions = 0
+    for result in new:
+        before = old.get(_result_key(result))
+        if not before:
+            continue
+        old_seconds, new_seconds = _result_seconds(before), _result_seconds(result)
+        if not old_seconds or new_seconds is None:
+            continue
+        ratio = new_seconds / old_seconds
+        flag = ""
+        if ratio > 1 + args.threshold:
+            flag = "  <-- 变慢"
+            regressions += 1
+        label = ", ".join(f"{k}={v}" for k, v in _result_key(result))
+        print(f"{ratio:6.2f}x  {label}{flag}")
+    if regressions:
+        print(f"{regressions} 项变慢超过 {args.threshold:.0%}")
+        sys.exit(1)
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="提示词分类性能基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fuzzy = subparsers.add_parser("fuzzy", help="双向模糊匹配：新引擎对比旧循环")
+    fuzzy.add_argument("--tags", type=int, default=100)
+    fuzzy.add_argument("--repeat", type=int, default=3)
+    fuzzy.add_argument(
+        "--no-replace-underscore", dest="replace_underscore", action="store_false"
+    )
+    fuzzy.set_defaults(func=bench_fuzzy)
+
+    startup = subparsers.add_parser("startup", help="启动导入耗时（-X importtime）")
+    startup.add_argument("--module", default="main")
+    startup.add_argument("--budget-ms", type=float, default=200)
+    startup.set_defaults(func=bench_startup)
+
+    suite = subparsers.add_parser("suite", help="完整基准套件，结果写入 JSON")
+    suite.add_argument(
+        "--scales",
+        default="shipped,100000,1000000",
+        help="词典规模，逗号分隔；shipped 表示仓库自带词典",
+    )
+    suite.add_argument(
+        "--fuzzy-max-scale",
+        type=int,
+        default=200_000,
+        help="超过该规模的词典不测模糊匹配（纯 Python 索引构建耗时较长）",
+    )
+    suite.add_argument("--skip-save", action="store_true", help="不测保存耗时")
+    suite.add_argument("--out", help="结果文件，默认 bench_results/bench_<时间>.json")
+    suite.set_defaults(func=bench_suite)
+
+    compare = subparsers.add_parser("compare", help="对比两次套件结果")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=0.2)
+    compare.set_defaults(func=bench_compare)
+
+    api = subparsers.add_parser("api", help="分类接口压测：各并发下的延迟和吞吐")
+    api.add_argument("--url", help="已启动的接口地址，默认在子进程中启动一个")
+    api.add_argument("--port", type=int, default=7862, help="自动启动时使用的端口")
+    api.add_argument("--workers", type=int, default=1, help="自动启动时的分类进程数")
+    api.add_argument("--concurrency", default="1,4,16,64", help="并发数，逗号分隔")
+    api.add_argument("--requests", type=int, default=2000, help="每档并发的请求数")
+    api.add_argument("--batch", type=int, default=1, help="每个请求的提示词条数")
+    api.add_argument("--tags", type=int, default=30, help="每条提示词的提示词个数")
+    api.set_defaults(func=bench_api)
+
+    live = subparsers.add_parser("live", help="实时分类：逐字输入时每次按键的耗时")
+    live.add_argument("--sizes", default="30,100,300,1000", help="提示词数，逗号分隔")
+    live.add_argument("--repeat", type=int, default=5)
+    live.add_argument("--typo", action="store_true", help="启用拼写纠错")
+    live.add_argument(
+        "--no-replace-underscore", dest="replace_underscore", action="store_false"
+    )
+    live.set_defaults(func=bench_live)
+
+    semantic = subparsers.add_parser(
+        "semantic", help="本地语义分类：构建耗时、批量延迟和留出集准确率"
+    )
+    semantic.add_argument(
+        "--holdout", type=float, default=0.1, help="留出集占词典词的比例"
+    )
+    semantic.set_defaults(func=bench_semantic)
+
+    concurrency = subparsers.add_parser(
+        "concurrency", help="并发保存压测：检查 extract 文件无丢失、重复或损坏的行"
+    )
+    concurrency.add_argument("--savers", type=int, default=16, help="保存线程数")
+    concurrency.add_argument("--lines", type=int, default=200, help="每个线程保存的行数")
+    concurrency.add_argument(
+        "--no-lock",
+        dest="lock",
+        action="store_false",
+        help="不加文件锁（对照，用于确认压测能发现问题）",
+    )
+    concurrency.set_defaults(func=bench_concurrency)
+
+    vector = subparsers.add_parser(
+        "vector", help="向量化精确匹配：批量分类吞吐对比逐个查找"
+    )
+    vector.add_argument("--prompts", type=int, default=20000, help="提示条数")
+    vector.add_argument("--tags", type=int, default=30, help="每条提示的提示词个数")
+    vector.add_argument(
+        "--syntax", type=float, default=0.2, help="带权重括号语法的提示所占比例"
+    )
+    vector.add_argument(
+        "--scale", default="shipped", help="词典规模：shipped 或合成词典的词数"
+    )
+    vector.add_argument("--repeat", type=int, default=3)
+    vector.add_argument(
+        "--no-replace-underscore", dest="replace_underscore", action="store_false"
+    )
+    vector.set_defaults(func=bench_vector)
+
+    ai = subparsers.add_parser(
+        "ai", help="AI分类自检：用本地模拟服务检查分块、缓存命中和不合法回复的丢弃"
+    )
+    ai.add_argument("--tags", type=int, default=200, help="提示词个数")
+    ai.add_argument("--chunk", type=int, default=40, help="每次请求的提示词个数")
+    ai.add_argument("--concurrency", type=int, default=4, help="并发请求数")
+    ai.add_argument("--delay", type=float, default=0.05, help="模拟服务每次请求的延迟")
+    ai.set_defaults(func=bench_ai)
+
+    dataset = subparsers.add_parser(
+        "dataset", help="标注改写自检：不排除时原样输出，语法片段原样保留"
+    )
+    dataset.add_argument("--captions", type=int, default=5000, help="标注条数")
+    dataset.add_argument("--tags", type=int, default=20, help="每条标注的提示词个数")
+    dataset.set_defaults(func=bench_dataset)
+
+    move = subparsers.add_parser(
+        "move", help="移动提示词：各分类大小下的移动/撤销/重做耗时，检查撤销后顺序不变"
+    )
+    move.add_argument("--sizes", default="100,10000,100000", help="每个分类的提示词数")
+    move.add_argument("--categories", type=int, default=8)
+    move.add_argument("--moves", type=int, default=HISTORY_LIMIT, help="连续移动次数")
+    move.add_argument("--selected", type=int, default=5, help="每次移动的提示词数")
+    move.set_defaults(func=bench_move)
+
+    complete = subparsers.add_parser(
+        "complete", help="补全：保存或词典变化后第一次按键的耗时，检查后台更新结果"
+    )
+    complete.add_argument("--keys", type=int, default=1000, help="普通按键次数")
+    complete.add_argument("--saves", type=int, default=50, help="保存同一行的次数")
+    complete.add_argument("--budget-ms", type=float, default=10.0)
+    complete.set_defaults(func=bench_complete)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,233 @@
+"""界面中的分类状态
+
+ClassifyState 保存 {分类名: 有序集合}，有序集合用 dict（键为提示词、值为位置序号）
+实现，判断、删除、追加都是 O(1)。位置序号单调递增，提示词按序号排列。
+
+移动提示词直接修改有序集合，撤销记录只保存被移动的提示词及其原位置
+（可逆的操作记录），因此移动与撤销/重做的耗时只与移动的提示词数成正比，
+与分类大小无关。撤销后提示词按原序号放回，该分类在下次读取时重新排序一次。
+
+整体替换（重新分类、实时分类、分类增删后的整理）以 {分类名: 有序集合} 映射为单位
+记录新旧两份映射，内容不变的分类沿用原 dict。
+
+各修改方法返回内容可能变化的分类名集合，界面只需更新这些组件。
+输入时的实时分类以 replace(results, coalesce=True) 写入：连续的实时分类只占一条
+撤销记录。
+"""
+
+from operator import itemgetter
+
+HISTORY_LIMIT = 50
+UNCLASSIFIED = "未分类"
+
+# 撤销记录：("move", [(源分类, 目标分类, 提示词, 原序号, 新序号或 None)])，
+# 新序号为 None 表示提示词原本就在目标分类中；("swap", 旧映射, 新映射)
+_MOVE = "move"
+_SWAP = "swap"
+
+
+class ClassifyState:
+    __slots__ = (
+        "boxes",
+        "undo_stack",
+        "redo_stack",
+        "coalescing",
+        "_next",
+        "_unsorted",
+    )
+
+    def __init__(self):
+        self.boxes = {}
+        self.undo_stack = []
+        self.redo_stack = []
+        # 为真时表示当前状态来自实时分类，下一次实时分类直接替换而不新增撤销记录
+        self.coalescing = False
+        self._next = 0
+        # 有提示词按原序号放回、需要重新排序的分类
+        self._unsorted = set()
+
+    def _box(self, name):
+        box = self.boxes.get(name)
+        if box is None:
+            return {}
+        if name in self._unsorted:
+            items = sorted(box.items(), key=itemgetter(1))
+            box.clear()
+            box.update(items)
+            self._unsorted.discard(name)
+        return box
+
+    def get(self, name, default=()):
+        """返回分类的有序集合（只读）"""
+        return self._box(name) if name in self.boxes else default
+
+    def tags(self, name):
+        return list(self._box(name))
+
+    def to_dict(self):
+        return {name: self.tags(name) for name in self.boxes}
+
+    def _positions(self, count):
+        start = self._next
+        self._next += count
+        return range(start, self._next)
+
+    def _push(self, entry):
+        self.undo_stack.append(entry)
+        del self.undo_stack[:-HISTORY_LIMIT]
+        self.redo_stack.clear()
+        self.coalescing = False
+
+    def _swap(self, boxes):
+        """以新映射 boxes 替换全部内容，返回内容可能变化的分类名"""
+        # 先排好待排序的分类：旧映射会留在撤销记录中，之后可能被换回
+        for name in list(self._unsorted):
+            self._box(name)
+        changed = {
+            name
+            for name in self.boxes.keys() | boxes.keys()
+            if self.boxes.get(name) is not boxes.get(name)
+        }
+        self.boxes = boxes
+        return changed
+
+    def replace(self, results, coalesce=False):
+        """
+        用新的分类结果 {分类名: [提示词]} 替换全部内容，可撤销。
+        coalesce 为真时与上一次 coalesce 的替换合并为一条撤销记录，内容（含顺序）
+        不变的分类沿用原 dict。返回内容可能变化的分类名集合
+        """
+        boxes = {}
+        for name, tags in results.items():
+            box = self.boxes.get(name) if coalesce else None
+            if box is None or len(box) != len(tags) or self.tags(name) != tags:
+                box = dict(zip(tags, self._positions(len(tags))))
+            boxes[name] = box
+        if coalesce and boxes.keys() == self.boxes.keys():
+            if all(boxes[name] is self.boxes[name] for name in boxes):
+                return set()
+        old = self.boxes
+        changed = self._swap(boxes)
+        if coalesce and self.coalescing:
+            # 合并到上一条实时分类的撤销记录，只更新其中的新映射
+            self.undo_stack[-1] = (_SWAP, self.undo_stack[-1][1], boxes)
+            self.redo_stack.clear()
+            return changed
+        self._push((_SWAP, old, boxes))
+        self.coalescing = coalesce
+        return changed
+
+    def _apply_moves(self, moves):
+        """moves: [(源分类, 目标分类, 提示词)]，返回撤销记录的条目列表"""
+        records = []
+        for source, destination, tag in moves:
+            box = self.boxes.get(source)
+            if box is None or tag not in box:
+                continue
+            target = self.boxes.get(destination)
+            if target is None:
+                target = self.boxes[destination] = {}
+            new_position = None
+            if tag not in target:
+                new_position = target[tag] = self._positions(1)[0]
+            records.append((source, destination, tag, box.pop(tag), new_position))
+        return records
+
+    def move(self, selections, destination):
+        """
+        把 selections {源分类: [提示词]} 中的提示词移到 destination，可撤销。
+        已在目标分类中的提示词保持原位置；不在源分类中的提示词忽略。
+        直接修改涉及的有序集合，耗时只与移动的提示词数成正比（每个 O(1)）。
+        返回内容变化的分类名集合，没有需要移动的提示词时返回空集合且不新增撤销记录
+        """
+        records = self._apply_moves(
+            (source, destination, tag)
+            for source, tags in selections.items()
+            if source != destination
+            for tag in tags
+        )
+        if not records:
+            return set()
+        self._push((_MOVE, records))
+        return _move_changed(records)
+
+    def apply_answers(self, answers):
+        """把 {提示词: 分类名} 应用到未分类中的提示词，整次只占一条撤销记录"""
+        unclassified = self.get(UNCLASSIFIED, {})
+        records = self._apply_moves(
+            [
+                (UNCLASSIFIED, answers[tag], tag)
+                for tag in unclassified
+                if answers.get(tag) and answers[tag] != UNCLASSIFIED
+            ]
+        )
+        if not records:
+            return set()
+        self._push((_MOVE, records))
+        return _move_changed(records)
+
+    def migrate(self, names):
+        """
+        按分类名列表 names 整理状态：已删除分类中的提示词移入未分类，可撤销。
+        返回内容变化的分类名集合，无变化时返回空集合
+        """
+        known = set(names)
+        removed = [n for n in self.boxes if n not in known and n != UNCLASSIFIED]
+        if not removed:
+            return set()
+
+        unclassified = dict(self.get(UNCLASSIFIED, {}))
+        for name in removed:
+            for tag in self.tags(name):
+                if tag not in unclassified:
+                    unclassified[tag] = self._positions(1)[0]
+        boxes = {name: tags for name, tags in self.boxes.items() if name in known}
+        boxes[UNCLASSIFIED] = unclassified
+        old = self.boxes
+        changed = self._swap(boxes)
+        self._push((_SWAP, old, boxes))
+        return changed
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def undo(self):
+        """撤销最近一次修改，返回内容变化的分类名集合"""
+        if not self.undo_stack:
+            return set()
+        entry = self.undo_stack.pop()
+        self.redo_stack.append(entry)
+        self.coalescing = False
+        if entry[0] == _SWAP:
+            return self._swap(entry[1])
+        for source, destination, tag, position, new_position in reversed(entry[1]):
+            if new_position is not None:
+                del self.boxes[destination][tag]
+            self.boxes[source][tag] = position
+            self._unsorted.add(source)
+        return _move_changed(entry[1])
+
+    def redo(self):
+        """重做最近一次撤销的修改，返回内容变化的分类名集合"""
+        if not self.redo_stack:
+            return set()
+        entry = self.redo_stack.pop()
+        self.undo_stack.append(entry)
+        self.coalescing = False
+        if entry[0] == _SWAP:
+            return self._swap(entry[2])
+        # 之后追加的提示词都已撤销，按原顺序重新追加即保持序号有序
+        for source, destination, tag, _, new_position in entry[1]:
+            del self.boxes[source][tag]
+            if new_position is not None:
+                self.boxes[destination][tag] = new_position
+        return _move_changed(entry[1])
+
+
+def _move_changed(records):
+    return {record[0] for record in records} | {
+        record[1] for record in records if record[4] is not None
+    }
@@ -0,0 +1,376 @@
+"""训练集标注整理（kohya 风格：图片旁的同名 .txt 标注文件）
+
+用法：
+    python main.py dataset --dir train/ --out cleaned/ --exclude Backgrounds,未分类
+    python main.py dataset --dir train/ --in-place --reorder --resume
+    python main.py dataset --dir train/ --exclude 未分类 --dry-run
+
+流式遍历 --dir 下的标注文件，在进程池中逐个分类，按选项改写：
+    --exclude   去掉这些分类中的提示词（对应界面中的"排除保存"）
+    --reorder   按分类顺序重排（config.json 中的分类顺序，未分类在最后），
+                默认保持原顺序
+    --keep-first N  前 N 个提示词（如触发词）始终保留在最前
+结果写入 --out 下的相同相对路径，或使用 --in-place 原地覆盖。
+--dry-run 只输出改写前后的差异，不写文件。
+每处理完一个窗口更新检查点（<输出目录>/.dataset.ckpt），--resume 从中断处继续；
+结束时输出各分类的提示词计数并写入 <输出目录>/dataset_summary.json。
+"""
+
+import argparse
+import difflib
+import json
+import os
+import time
+
+import batch
+import dict_artifact
+import main as core
+import prompt_tokenizer
+
+CHECKPOINT_FILE = ".dataset.ckpt"
+SUMMARY_FILE = "dataset_summary.json"
+
+# 工作进程内的改写参数，由 _init_worker 设置
+_dataset_options = None
+
+
+def iter_caption_files(root, ext=".txt", skip_dir=None):
+    """按固定顺序（目录、文件名排序）逐个产出标注文件路径，不预先收集整个列表"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        if skip_dir:
+            dirnames[:] = [
+                d
+                for d in dirnames
+                if os.path.abspath(os.path.join(dirpath, d)) != skip_dir
+            ]
+        for filename in sorted(filenames):
+            if filename.endswith(ext) and filename != SUMMARY_FILE:
+                yield os.path.join(dirpath, filename)
+
+
+def split_caption(text):
+    """
+    按顶层片段（prompt_tokenizer.segments）切分标注，返回 [(片段原文, 提示词 Token)]。
+    只含一个普通提示词的片段（如 "blue sky"、"(smile:1.2)"）Token 为该提示词；
+    其余片段（多个提示词的括号组、交替、调度、BREAK/AND、额外网络）Token 为 None。
+    """
+    pieces = []
+    for start, end, plain in prompt_tokenizer.segments(text):
+        piece = text[start:end].strip()
+        if not piece:
+            continue
+        tokens = prompt_tokenizer.tokenize_segment(piece, plain)
+        tag = None
+        if (
+            len(tokens) == 1
+            and tokens[0].kind == prompt_tokenizer.KIND_TAG
+            and tokens[0].raw == piece
+        ):
+            tag = tokens[0]
+        pieces.append((piece, tag, tokens))
+    return pieces
+
+
+def rewrite_caption(text, categories, exclude, reorder, keep_first):
+    """
+    根据分类结果改写一条标注，返回 (新标注, {分类名: 提示词数})。
+    categories 为 classify_text 的结果。
+    只删除、重排单个提示词的片段；含其他语法的片段原样保留在原位置。
+    没有删除、去重或调整顺序时原样返回标注。
+    """
+    owner = {}
+    for name, tags in categories.items():
+        for tag in tags:
+            owner.setdefault(tag, name)
+
+    pieces = split_caption(text)
+    # 单个提示词的片段按原顺序去重
+    seen = set()
+    ordered = []
+    for piece, tag, _ in pieces:
+        if tag:
+            if piece in seen:
+                continue
+            seen.add(piece)
+        ordered.append((piece, tag))
+
+    kept_first = [piece for piece, _ in ordered[:keep_first]]
+    rest = ordered[keep_first:]
+    movable = [
+        piece for piece, tag in rest if tag and owner.get(piece) not in exclude
+    ]
+    if reorder:
+        rank = {name: i for i, name in enumerate(categories)}
+        movable.sort(key=lambda piece: rank.get(owner.get(piece), len(rank)))
+    # 保留下来的提示词依次填回提示词片段的位置，其余片段位置不变
+    refill = iter(movable)
+    kept = kept_first + [
+        next(refill) if tag else piece
+        for piece, tag in rest
+        if not tag or owner.get(piece) not in exclude
+    ]
+
+    counts = {}
+    seen = set()
+    for _, _, tokens in pieces:
+        for token in tokens:
+            name = owner.get(token.raw)
+            if name and token.raw not in seen:
+                seen.add(token.raw)
+                counts[name] = counts.get(name, 0) + 1
+    if kept == [piece for piece, _, _ in pieces]:
+        return text, counts
+    return ", ".join(kept), counts
+
+
+def _init_worker(config, use_fuzzy, replace_underscore, artifact_path, options):
+    global _dataset_options
+    batch._init_worker(config, use_fuzzy, replace_underscore, artifact_path)
+    _dataset_options = options
+
+
+def process_file(item):
+    """改写一个标注文件，返回 (序号, 相对路径, 分类计数, 是否改动, 差异文本)"""
+    index, path = item
+    root, out_dir, exclude, reorder, keep_first, dry_run = _dataset_options
+    use_fuzzy, replace_underscore, config, token_map = batch._worker_options
+
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+    categories = core.classify_text(
+        text, use_fuzzy, replace_underscore, config, token_map
+    )
+    new_text, counts = rewrite_caption(text, categories, exclude, reorder, keep_first)
+    relative = os.path.relpath(path, root)
+    changed = new_text != text
+
+    diff = None
+    if dry_run:
+        if changed:
+            diff = "".join(
+                difflib.unified_diff(
+                    [text + "\n"],
+                    [new_text + "\n"],
+                    f"a/{relative}",
+                    f"b/{relative}",
+                )
+            )
+    elif out_dir or changed:
+        target = os.path.join(out_dir, relative) if out_dir else path
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        with open(target + ".tmp", "w", encoding="utf-8") as f:
+            f.write(new_text)
+        os.replace(target + ".tmp", target)
+    return index, relative, counts, changed, diff
+
+
+def load_checkpoint(path, root):
+    """返回检查点内容，不存在或不属于该目录时返回 None"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if checkpoint.get("root") != os.path.abspath(root):
+        return None
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def format_summary(summary):
+    lines = [
+        f"共 {summary['files']} 个文件，改动 {summary['changed']} 个，"
+        f"{summary['files_per_second']:.0f} 个/秒"
+    ]
+    total = sum(summary["tags"].values()) or 1
+    for name, count in sorted(summary["tags"].items(), key=lambda kv: -kv[1]):
+        excluded = "（已排除）" if name in summary["exclude"] else ""
+        lines.append(f"  {name:<16} {count:>10}  {count / total:6.1%}{excluded}")
+    return "\n".join(lines)
+
+
+def process_dataset(
+    root,
+    config,
+    out_dir=None,
+    exclude=(),
+    reorder=False,
+    keep_first=0,
+    dry_run=False,
+    resume=False,
+    use_fuzzy=False,
+    replace_underscore=True,
+    workers=1,
+    window=500,
+    ext=".txt",
+    artifact_path=dict_artifact.DEFAULT_PATH,
+):
+    """处理整个标注目录，返回汇总信息"""
+    names = [category["name"] for category in config["categories"]] + ["未分类"]
+    unknown = [name for name in exclude if name not in names]
+    if unknown:
+        raise ValueError(f"未知的分类：{'、'.join(unknown)}")
+
+    state_dir = out_dir or root
+    checkpoint_path = os.path.join(state_dir, CHECKPOINT_FILE)
+    checkpoint = None
+    if resume and not dry_run:
+        checkpoint = load_checkpoint(checkpoint_path, root)
+    if checkpoint is None:
+        checkpoint = {
+            "root": os.path.abspath(root),
+            "files_done": 0,
+            "last_file": None,
+            "changed": 0,
+            "tags": {},
+        }
+    elif checkpoint["files_done"]:
+        print(f"从第 {checkpoint['files_done'] + 1} 个文件继续")
+
+    if use_fuzzy:
+        # 同 batch.classify_file：模糊匹配不使用编译词典
+        artifact_path = None
+    if artifact_path:
+        dict_artifact.ensure_artifact(config, artifact_path)
+    else:
+        core.get_token_map(config, replace_underscore)
+        if use_fuzzy:
+            core.get_fuzzy_matcher(config, replace_underscore)
+    if out_dir and not dry_run:
+        os.makedirs(out_dir, exist_ok=True)
+
+    skip_dir = os.path.abspath(out_dir) if out_dir else None
+    files = enumerate(iter_caption_files(root, ext, skip_dir), 1)
+    files_done = checkpoint["files_done"]
+    start = time.perf_counter()
+    processed = 0
+
+    def skip_done(items):
+        for index, path in items:
+            if index < files_done:
+                continue
+            if index == files_done:
+                # 目录内容与检查点不一致时不能按序号跳过
+                if os.path.relpath(path, root) != checkpoint["last_file"]:
+                    raise RuntimeError(
+                        "目录内容已变化，检查点失效，请去掉 --resume 重新处理"
+                    )
+                continue
+            yield index, path
+
+    def on_window(batch_items, results):
+        nonlocal processed
+        for _, relative, counts, changed, diff in results:
+            if diff:
+                print(diff, end="")
+            checkpoint["changed"] += changed
+            for name, count in counts.items():
+                checkpoint["tags"][name] = checkpoint["tags"].get(name, 0) + count
+            checkpoint["last_file"] = relative
+        processed += len(results)
+        checkpoint["files_done"] = batch_items[-1][0]
+        if not dry_run:
+            save_checkpoint(checkpoint_path, checkpoint)
+        elapsed = time.perf_counter() - start
+        print(
+            f"已处理 {checkpoint['files_done']} 个文件，"
+            f"{processed / max(elapsed, 1e-9):.0f} 个/秒"
+        )
+
+    options = (root, out_dir, frozenset(exclude), reorder, keep_first, dry_run)
+    batch.run_pipeline(
+        skip_done(files),
+        process_file,
+        workers,
+        window,
+        _init_worker,
+        (config, use_fuzzy, replace_underscore, artifact_path, options),
+        on_window,
+    )
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "files": checkpoint["files_done"],
+        "changed": checkpoint["changed"],
+        "tags": checkpoint["tags"],
+        "exclude": list(exclude),
+        "seconds": elapsed,
+        "files_per_second": processed / max(elapsed, 1e-9),
+    }
+    if not dry_run:
+        with open(os.path.join(state_dir, SUMMARY_FILE), "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python main.py dataset", description="按分类整理训练集标注文件"
+    )
+    parser.add_argument("--dir", required=True, help="标注文件所在目录（递归）")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--out", help="输出目录，保持相对路径")
+    target.add_argument("--in-place", action="store_true", help="原地覆盖标注文件")
+    parser.add_argument(
+        "--exclude", default="", help="要去掉的分类，逗号分隔（可包含 未分类）"
+    )
+    parser.add_argument("--reorder", action="store_true", help="按分类顺序重排")
+    parser.add_argument(
+        "--keep-first", type=int, default=0, help="始终保留在最前的提示词个数"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="只显示差异，不写文件")
+    parser.add_argument("--resume", action="store_true", help="从检查点继续")
+    parser.add_argument("--ext", default=".txt", help="标注文件扩展名")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="工作进程数"
+    )
+    parser.add_argument("--window", type=int, default=500, help="每个检查点的文件数")
+    parser.add_argument("--fuzzy", action="store_true", help="启用双向模糊匹配")
+    parser.add_argument(
+        "--no-replace-underscore",
+        dest="replace_underscore",
+        action="store_false",
+        help="按下划线类提示词进行字典匹配",
+    )
+    parser.add_argument(
+        "--artifact",
+        default=dict_artifact.DEFAULT_PATH,
+        help="编译词典路径，过期时自动重建；传空字符串则使用进程内词典",
+    )
+    args = parser.parse_args(argv)
+    if not (args.out or args.in_place or args.dry_run):
+        parser.error("请指定 --out 或 --in-place（或使用 --dry-run 预览）")
+
+    exclude = [name.strip() for name in args.exclude.split(",") if name.strip()]
+    try:
+        summary = process_dataset(
+            args.dir,
+            core.load_config(),
+            out_dir=args.out,
+            exclude=exclude,
+            reorder=args.reorder,
+            keep_first=args.keep_first,
+            dry_run=args.dry_run,
+            resume=args.resume,
+            use_fuzzy=args.fuzzy,
+            replace_underscore=args.replace_underscore,
+            workers=args.workers,
+            window=args.window,
+            ext=args.ext,
+            artifact_path=args.artifact,
+        )
+    except (ValueError, RuntimeError) as e:
+        print(f"错误：{e}")
+        return 1
+    print(format_summary(summary))
+    return 0
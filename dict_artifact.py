@@ -0,0 +1,284 @@
+"""编译后的词典文件（可 mmap，多进程共享）
+
+用法：
+    python main.py build-dict [--out dictionary.bin] [--force]
+
+把配置中所有分类目录编译成一个二进制文件，去重并按 UTF-8 字节排序，
+同时保存下划线形式与空格形式两份键。查询时 mmap 打开，通过 crc32 开放寻址
+哈希表定位（排序后的键也支持二分查找），不需要在每个进程里构建 Python 集合。
+
+文件布局（本机字节序，各段按 8 字节对齐）：
+    MAGIC(8) | 元数据长度 u32 | 元数据 JSON |
+    对每种形式（下划线、空格）：
+        键数量 u32 | 偏移数组 u32 × (n+1) | 归属数组 u32 × n |
+        哈希表大小 u32 | 哈希槽 u32 × 表大小 | 键数据
+归属数组每项高 16 位为分类编号（按优先级排列），低 16 位为来源文件编号。
+哈希槽存放 键序号 + 1（0 表示空槽），线性探测。
+任一来源 .txt 被修改、增删，或分类配置变化时会自动重建。
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
+
+import main as core
+
+MAGIC = b"SDPCDIC2"
+DEFAULT_PATH = "dictionary.bin"
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _source_signature(config):
+    """{文件路径: [mtime_ns, size]}"""
+    sources = {}
+    for category in config["categories"]:
+        folder = category["path"]
+        if not os.path.isdir(folder):
+            continue
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.endswith(".txt") and entry.is_file():
+                    stat = entry.stat()
+                    sources[entry.path] = [stat.st_mtime_ns, stat.st_size]
+    return sources
+
+
+def _config_signature(config):
+    return {
+        "categories": [[c["name"], c["path"]] for c in config["categories"]],
+        "priority": core.get_category_priority(config),
+    }
+
+
+def _hash_slots(keys):
+    size = 8
+    while size < 2 * len(keys):
+        size *= 2
+    slots = array("I", bytes(4 * size))
+    mask = size - 1
+    for index, (key, _) in enumerate(keys):
+        slot = zlib.crc32(key) & mask
+        while slots[slot]:
+            slot = (slot + 1) & mask
+        slots[slot] = index + 1
+    return slots
+
+
+def build_artifact(config, path=DEFAULT_PATH):
+    priority = core.get_category_priority(config)
+    category_ids = {name: i for i, name in enumerate(priority)}
+    files = []
+    file_ids = {}
+    meta = {
+        "byteorder": sys.byteorder,
+        "config": _config_signature(config),
+        "sources": _source_signature(config),
+        "categories": priority,
+        "files": files,
+    }
+
+    sections = []
+    for replace_underscore in (False, True):
+        token_map = core.get_token_map(config, replace_underscore)
+        keys = sorted((w.encode("utf-8"), owner) for w, owner in token_map.items())
+        offsets = array("I", [0])
+        owners = array("I")
+        blob = bytearray()
+        for key, (category_name, filename) in keys:
+            file_key = (category_name, filename)
+            if file_key not in file_ids:
+                file_ids[file_key] = len(files)
+                files.append(list(file_key))
+            blob += key
+            offsets.append(len(blob))
+            owners.append(category_ids[category_name] << 16 | file_ids[file_key])
+        sections.append((len(keys), offsets, owners, _hash_slots(keys), bytes(blob)))
+
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+    # 临时文件名唯一，多个进程同时构建时不会写入同一个文件
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=".dictionary-", suffix=".tmp", dir=os.path.dirname(os.path.abspath(path))
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC + struct.pack("=I", len(meta_bytes)) + meta_bytes)
+            for count, offsets, owners, slots, blob in sections:
+                parts = (
+                    struct.pack("=I", count),
+                    offsets.tobytes(),
+                    owners.tobytes(),
+                    struct.pack("=I", len(slots)),
+                    slots.tobytes(),
+                )
+                for part in parts:
+                    f.write(b"\0" * (_align(f.tell()) - f.tell()))
+                    f.write(part)
+                f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def _read_meta(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None
+        (length,) = struct.unpack("=I", f.read(4))
+        return json.loads(f.read(length).decode("utf-8"))
+
+
+def is_stale(config, path=DEFAULT_PATH):
+    try:
+        meta = _read_meta(path)
+    except (OSError, ValueError, struct.error):
+        return True
+    return (
+        meta is None
+        or meta["byteorder"] != sys.byteorder
+        or meta["config"] != _config_signature(config)
+        or meta["sources"] != _source_signature(config)
+    )
+
+
+def ensure_artifact(config, path=DEFAULT_PATH):
+    """词典文件不存在或已过期时重新编译，返回文件路径"""
+    if is_stale(config, path):
+        print(f"正在编译词典：{path}")
+        build_artifact(config, path)
+    return path
+
+
+class _Variant:
+    """单一形式（下划线或空格）的只读视图，提供与 dict 相同的 get 接口"""
+
+    def __init__(self, artifact, count, offsets, owners, slots, blob_start):
+        self._artifact = artifact
+        self._count = count
+        self._offsets = offsets
+        self._owners = owners
+        self._slots = slots
+        self._mask = len(slots) - 1
+        self._blob_start = blob_start
+
+    def __len__(self):
+        return self._count
+
+    def key(self, index):
+        base, offsets = self._blob_start, self._offsets
+        return self._artifact._mm[base + offsets[index] : base + offsets[index + 1]]
+
+    def _find(self, key):
+        slots, mask = self._slots, self._mask
+        slot = zlib.crc32(key) & mask
+        while True:
+            entry = slots[slot]
+            if not entry:
+                return -1
+            if self.key(entry - 1) == key:
+                return entry - 1
+            slot = (slot + 1) & mask
+
+    def bisect_left(self, key):
+        """返回排序后第一个不小于 key 的键序号"""
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def owner(self, index):
+        packed = self._owners[index]
+        return (
+            self._artifact.categories[packed >> 16],
+            self._artifact.files[packed & 0xFFFF][1],
+        )
+
+    def get(self, token, default=None):
+        index = self._find(token.encode("utf-8"))
+        if index < 0:
+            return default
+        return self.owner(index)
+
+    def __contains__(self, token):
+        return self._find(token.encode("utf-8")) >= 0
+
+
+class DictionaryArtifact:
+    def __init__(self, path=DEFAULT_PATH):
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mm)
+        (length,) = struct.unpack_from("=I", self._mm, len(MAGIC))
+        position = len(MAGIC) + 4
+        meta = json.loads(bytes(view[position : position + length]).decode("utf-8"))
+        position += length
+        self.categories = meta["categories"]
+        self.files = meta["files"]
+
+        self._views = []
+        self._variants = []
+        for _ in range(2):
+            position = _align(position)
+            (count,) = struct.unpack_from("=I", self._mm, position)
+            position = _align(position + 4)
+            offsets = view[position : position + 4 * (count + 1)].cast("I")
+            position = _align(position + 4 * (count + 1))
+            owners = view[position : position + 4 * count].cast("I")
+            position = _align(position + 4 * count)
+            (size,) = struct.unpack_from("=I", self._mm, position)
+            position = _align(position + 4)
+            slots = view[position : position + 4 * size].cast("I")
+            position += 4 * size
+            self._views += [offsets, owners, slots]
+            self._variants.append(
+                _Variant(self, count, offsets, owners, slots, position)
+            )
+            position += offsets[count]
+        self._views.append(view)
+
+    def token_map(self, replace_underscore=False):
+        return self._variants[1 if replace_underscore else 0]
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._mm.close()
+        self._file.close()
+
+
+def open_artifact(config, path=DEFAULT_PATH):
+    return DictionaryArtifact(ensure_artifact(config, path))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python main.py build-dict", description="编译分类词典为二进制文件"
+    )
+    parser.add_argument("--out", default=DEFAULT_PATH)
+    parser.add_argument("--force", action="store_true", help="即使未过期也重新编译")
+    args = parser.parse_args(argv)
+
+    config = core.load_config()
+    if args.force or is_stale(config, args.out):
+        build_artifact(config, args.out)
+        print(f"已编译：{args.out}（{os.path.getsize(args.out)} 字节）")
+    else:
+        print(f"{args.out} 已是最新")
+    return 0
@@ -0,0 +1,139 @@
+"""extract_*.txt 的追加式去重存储
+
+每个 extract 文件旁有一个索引文件 <文件名>.idx，由 16 字节的记录组成：
+    行内容的 blake2b-64 摘要 | 该行写入后文本文件的长度（u64）
+保存时只查内存中的摘要集合并追加新行，耗时只与新行数相关，行顺序即写入顺序。
+
+写入顺序为先文本后索引。进程在两次写入之间中断时，下次打开会发现文本长度
+大于索引覆盖的长度，只需补扫末尾几行；索引末尾残缺的记录会被丢弃；
+文本比索引记录的短（被手工截断或替换）时整份重建索引。
+
+多个用户同时保存时，同一文件的查重、写文本、写索引在该文件的锁内完成，
+不会写入重复行、交错的行或与文本不一致的索引；不同文件互不阻塞。
+"""
+
+import hashlib
+import os
+import struct
+import threading
+
+RECORD = struct.Struct("<8sQ")
+
+# {文本路径: {"hashes": 摘要集合, "covered": 索引已覆盖的文本长度}}
+_indexes = {}
+# {绝对路径: 该文件的写锁}
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+
+def file_lock(path):
+    """返回 path 对应的锁，同一文件（按绝对路径）总是同一个锁"""
+    key = os.path.abspath(path)
+    with _file_locks_guard:
+        lock = _file_locks.get(key)
+        if lock is None:
+            lock = _file_locks[key] = threading.Lock()
+    return lock
+
+
+def line_digest(line):
+    return hashlib.blake2b(line.encode("utf-8"), digest_size=8).digest()
+
+
+def _index_path(path):
+    return path + ".idx"
+
+
+def _scan_lines(path, start):
+    """从 start 偏移处读取文本，返回 [(摘要, 行结束偏移)]"""
+    records = []
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+        for raw in f:
+            offset += len(raw)
+            line = raw.decode("utf-8", errors="replace").strip()
+            if line:
+                records.append((line_digest(line), offset))
+    return records
+
+
+def _append_records(path, records):
+    if not records:
+        return
+    with open(_index_path(path), "ab") as f:
+        f.write(b"".join(RECORD.pack(digest, end) for digest, end in records))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _load_index(path):
+    hashes = set()
+    covered = 0
+    index_path = _index_path(path)
+    if os.path.exists(index_path):
+        with open(index_path, "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % RECORD.size
+        for digest, end in RECORD.iter_unpack(data[:usable]):
+            hashes.add(digest)
+            covered = end
+        if usable != len(data):
+            # 丢弃写了一半的索引记录
+            with open(index_path, "r+b") as f:
+                f.truncate(usable)
+    return {"hashes": hashes, "covered": covered}
+
+
+def _sync_index(path):
+    """返回与文本文件一致的内存索引，必要时补扫或重建"""
+    index = _indexes.get(path)
+    if index is None:
+        index = _indexes[path] = _load_index(path)
+
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if size < index["covered"]:
+        # 文本被截断或替换，整份重建
+        if os.path.exists(_index_path(path)):
+            os.remove(_index_path(path))
+        index = _indexes[path] = {"hashes": set(), "covered": 0}
+    if size > index["covered"]:
+        records = _scan_lines(path, index["covered"])
+        _append_records(path, records)
+        index["hashes"].update(digest for digest, _ in records)
+        index["covered"] = size
+    return index
+
+
+def append_line(path, line, dedupe=True):
+    """追加一行，dedupe 为真且该行已保存过时跳过。返回写入的字节数（跳过时为 0）"""
+    line = line.strip()
+    if not line:
+        return 0
+    with file_lock(path):
+        return _append_line_locked(path, line, dedupe)
+
+
+def _append_line_locked(path, line, dedupe):
+    index = _sync_index(path)
+    digest = line_digest(line)
+    if dedupe and digest in index["hashes"]:
+        return 0
+
+    data = line.encode("utf-8") + b"\n"
+    if index["covered"]:
+        # 旧版保存的文件末尾没有换行
+        with open(path, "rb") as f:
+            f.seek(index["covered"] - 1)
+            if f.read(1) != b"\n":
+                data = b"\n" + data
+    with open(path, "ab") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        end = f.tell()
+
+    _append_records(path, [(digest, end)])
+    index["hashes"].add(digest)
+    index["covered"] = end
+    return len(data)
@@ -0,0 +1,156 @@
+"""双向模糊匹配引擎
+
+- 词典词包含在提示词中：Aho-Corasick 自动机，一次扫描找出提示词里出现的所有词典词
+- 提示词包含在词典词中：三元组（trigram）倒排索引，只校验候选词
+
+两个方向都要求匹配落在词边界上（首尾或非字母数字字符），并且参与匹配的一方
+长度不小于 min_length，避免 "a"、"on" 之类的短词匹配一切。
+返回重合部分最长的匹配，而不是第一个命中的词。
+"""
+
+from collections import deque
+
+DEFAULT_MIN_LENGTH = 3
+NGRAM = 3
+
+
+def _is_boundary(text, index):
+    return index <= 0 or index >= len(text) or not text[index].isalnum()
+
+
+def _at_word_boundary(text, start, end):
+    return (start == 0 or not text[start - 1].isalnum()) and _is_boundary(text, end)
+
+
+class FuzzyMatcher:
+    def __init__(self, token_map, priority=(), min_length=DEFAULT_MIN_LENGTH):
+        """
+        token_map: {词典词: 归属信息}，通常为 get_token_map 的结果
+        priority: 分类名按优先级排列，长度相同的候选按此决定先后
+        """
+        self.min_length = max(1, min_length)
+        rank = {name: i for i, name in enumerate(priority)}
+        self.words = []
+        self.owners = []
+        self.ranks = []
+        for word, owner in token_map.items():
+            if len(word) < self.min_length:
+                continue
+            self.words.append(word)
+            self.owners.append(owner)
+            category = owner[0] if isinstance(owner, tuple) else owner
+            self.ranks.append(rank.get(category, len(rank)))
+        self._build_automaton()
+        self._build_ngram_index()
+
+    # --- Aho-Corasick ---
+    def _build_automaton(self):
+        goto = [{}]
+        output = [-1]
+        for word_id, word in enumerate(self.words):
+            node = 0
+            for ch in word:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    output.append(-1)
+                node = nxt
+            output[node] = word_id
+
+        fail = [0] * len(goto)
+        # 输出链：沿失败指针能到达的下一个有输出的节点
+        dict_link = [-1] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                target = goto[state].get(ch, 0)
+                fail[child] = target if target != child else 0
+                link = fail[child]
+                dict_link[child] = link if output[link] >= 0 else dict_link[link]
+
+        self._goto = goto
+        self._fail = fail
+        self._output = output
+        self._dict_link = dict_link
+
+    def _words_in(self, text):
+        """返回 text 中落在词边界上的词典词 id"""
+        goto, fail, output, dict_link = (
+            self._goto,
+            self._fail,
+            self._output,
+            self._dict_link,
+        )
+        node = 0
+        found = []
+        for end, ch in enumerate(text, 1):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            hit = node if output[node] >= 0 else dict_link[node]
+            while hit > 0:
+                word_id = output[hit]
+                start = end - len(self.words[word_id])
+                if _at_word_boundary(text, start, end):
+                    found.append(word_id)
+                hit = dict_link[hit]
+        return found
+
+    # --- n-gram 倒排索引 ---
+    def _build_ngram_index(self):
+        index = {}
+        for word_id, word in enumerate(self.words):
+            for gram in {word[i : i + NGRAM] for i in range(len(word) - NGRAM + 1)}:
+                index.setdefault(gram, []).append(word_id)
+        self._ngrams = index
+
+    def _words_containing(self, text):
+        """返回包含 text（且落在词边界上）的词典词 id"""
+        if len(text) < NGRAM:
+            return []
+        postings = []
+        for i in range(len(text) - NGRAM + 1):
+            posting = self._ngrams.get(text[i : i + NGRAM])
+            if posting is None:
+                return []
+            postings.append(posting)
+        candidates = min(postings, key=len)
+
+        found = []
+        for word_id in candidates:
+            word = self.words[word_id]
+            start = word.find(text)
+            while start >= 0:
+                if _at_word_boundary(word, start, start + len(text)):
+                    found.append(word_id)
+                    break
+                start = word.find(text, start + 1)
+        return found
+
+    def match(self, text):
+        """返回 (词典词, 归属信息)，没有满足条件的匹配时返回 None"""
+        if len(text) < self.min_length:
+            return None
+        best = None
+        best_key = None
+        # 重合长度越长越好；其次长度越接近越好；最后按分类优先级
+        for word_id in self._words_in(text):
+            word = self.words[word_id]
+            key = (len(word), -(len(text) - len(word)), -self.ranks[word_id])
+            if best_key is None or key > best_key:
+                best, best_key = word_id, key
+        for word_id in self._words_containing(text):
+            word = self.words[word_id]
+            key = (len(text), -(len(word) - len(text)), -self.ranks[word_id])
+            if best_key is None or key > best_key:
+                best, best_key = word_id, key
+        if best is None:
+            return None
+        return self.words[best], self.owners[best]
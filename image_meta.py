@@ -0,0 +1,370 @@
+"""从生成图片的元数据中提取提示词
+
+用法：
+    python main.py images --dir outputs/ --out image_prompts.jsonl [--workers 16]
+
+只读取元数据，不解码像素：
+    PNG   逐个读取块头，tEXt / zTXt / iTXt 块解析内容，其余块（含 IDAT）直接 seek 跳过
+    JPEG  逐个读取段头，APP1 中的 EXIF UserComment，遇到图像数据（SOS）即停止
+    WebP  RIFF 容器中的 EXIF 块，其余块 seek 跳过
+解析 A1111 格式的 parameters 文本（正向提示词 / Negative prompt: / Steps: ...），
+NovelAI 的 Description / Comment 也会识别。
+文件读取在线程池中进行（磁盘 I/O 释放 GIL），分类在主线程按文件顺序逐条进行，
+结果写入 JSON Lines：
+    {"file": 相对路径, "prompt": 正向提示词, "negative": 反向提示词,
+     "categories": {分类名: [提示词, ...]}}
+"""
+
+import argparse
+import codecs
+import concurrent.futures
+import json
+import os
+import struct
+import time
+import unicodedata
+import zlib
+
+import batch
+import main as core
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# EXIF 标签
+EXIF_IFD_POINTER = 0x8769
+USER_COMMENT = 0x9286
+IMAGE_DESCRIPTION = 0x010E
+
+
+def read_png_text(f):
+    """返回 PNG 中所有文本块 {关键字: 文本}"""
+    if f.read(8) != PNG_SIGNATURE:
+        return {}
+    texts = {}
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type == b"IEND":
+            break
+        if chunk_type not in (b"tEXt", b"zTXt", b"iTXt"):
+            f.seek(length + 4, os.SEEK_CUR)  # 跳过数据和 CRC
+            continue
+        data = f.read(length)
+        f.seek(4, os.SEEK_CUR)
+        keyword, _, body = data.partition(b"\0")
+        try:
+            if chunk_type == b"tEXt":
+                text = body.decode("latin-1")
+            elif chunk_type == b"zTXt":
+                text = zlib.decompress(body[1:]).decode("latin-1")
+            else:
+                compressed = body[0]
+                _, _, rest = body[2:].partition(b"\0")  # 语言标记
+                _, _, rest = rest.partition(b"\0")  # 翻译后的关键字
+                if compressed:
+                    rest = zlib.decompress(rest)
+                text = rest.decode("utf-8")
+        except (zlib.error, UnicodeDecodeError, IndexError):
+            continue
+        texts[keyword.decode("latin-1")] = text
+    return texts
+
+
+def _invalid_chars(text):
+    """代理、私用区、未分配的字符以及替换符的个数，用于判断字节序是否猜错"""
+    return sum(
+        ch == "\ufffd" or unicodedata.category(ch) in ("Cs", "Co", "Cn") for ch in text
+    )
+
+
+def _decode_utf16(data):
+    """
+    piexif 写入 UTF-16 BE，也有工具写入 LE。依次按 BOM、偶数/奇数位上 0 字节的多少
+    （ASCII 字符的高位字节为 0）判断字节序；都无法判断时（如全是中文）两种都解码，
+    取无效字符较少的，相同时取 BE
+    """
+    if data[:2] == codecs.BOM_UTF16_BE:
+        return data[2:].decode("utf-16-be", errors="replace")
+    if data[:2] == codecs.BOM_UTF16_LE:
+        return data[2:].decode("utf-16-le", errors="replace")
+    even, odd = data[0::2].count(0), data[1::2].count(0)
+    if even != odd:
+        encoding = "utf-16-be" if even > odd else "utf-16-le"
+        return data.decode(encoding, errors="replace")
+    big = data.decode("utf-16-be", errors="replace")
+    little = data.decode("utf-16-le", errors="replace")
+    return little if _invalid_chars(little) < _invalid_chars(big) else big
+
+
+def _decode_user_comment(value):
+    """UserComment 以 8 字节编码标识开头"""
+    prefix, data = value[:8], value[8:]
+    if prefix.startswith(b"UNICODE"):
+        return _decode_utf16(data).rstrip("\0")
+    if prefix.startswith(b"ASCII") or prefix == b"\0" * 8:
+        return data.decode("utf-8", errors="replace").rstrip("\0")
+    return value.decode("utf-8", errors="replace").rstrip("\0")
+
+
+def read_exif_text(tiff):
+    """从 TIFF 格式的 EXIF 数据中读取 {"UserComment": ..., "ImageDescription": ...}"""
+    if tiff.startswith(b"Exif\0\0"):
+        tiff = tiff[6:]
+    if tiff[:2] == b"II":
+        order = "<"
+    elif tiff[:2] == b"MM":
+        order = ">"
+    else:
+        return {}
+    type_sizes = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+
+    def read_ifd(offset):
+        entries = {}
+        if offset + 2 > len(tiff):
+            return entries
+        (count,) = struct.unpack_from(order + "H", tiff, offset)
+        for i in range(count):
+            position = offset + 2 + i * 12
+            if position + 12 > len(tiff):
+                break
+            tag, value_type, n = struct.unpack_from(order + "HHI", tiff, position)
+            size = type_sizes.get(value_type, 1) * n
+            if size <= 4:
+                value = tiff[position + 8 : position + 8 + size]
+            else:
+                (value_offset,) = struct.unpack_from(order + "I", tiff, position + 8)
+                value = tiff[value_offset : value_offset + size]
+            entries[tag] = value
+        return entries
+
+    texts = {}
+    try:
+        (ifd0_offset,) = struct.unpack_from(order + "I", tiff, 4)
+        ifd0 = read_ifd(ifd0_offset)
+        if IMAGE_DESCRIPTION in ifd0:
+            texts["ImageDescription"] = (
+                ifd0[IMAGE_DESCRIPTION].rstrip(b"\0").decode("utf-8", errors="replace")
+            )
+        if EXIF_IFD_POINTER in ifd0:
+            (exif_offset,) = struct.unpack(order + "I", ifd0[EXIF_IFD_POINTER][:4])
+            exif = read_ifd(exif_offset)
+            if USER_COMMENT in exif:
+                texts["UserComment"] = _decode_user_comment(exif[USER_COMMENT])
+    except struct.error:
+        pass
+    return texts
+
+
+def read_jpeg_text(f):
+    if f.read(2) != b"\xff\xd8":
+        return {}
+    texts = {}
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            break
+        if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+            continue  # 无长度的标记
+        if marker[1] in (0xDA, 0xD9):
+            break  # 图像数据开始 / 文件结束
+        (length,) = struct.unpack(">H", f.read(2))
+        if marker[1] == 0xE1:
+            data = f.read(length - 2)
+            if data.startswith(b"Exif\0\0"):
+                texts.update(read_exif_text(data))
+        elif marker[1] == 0xFE:
+            texts["Comment"] = f.read(length - 2).decode("utf-8", errors="replace")
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+    return texts
+
+
+def read_webp_text(f):
+    header = f.read(12)
+    if len(header) < 12 or header[:4] != b"RIFF" or header[8:] != b"WEBP":
+        return {}
+    texts = {}
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            break
+        fourcc, size = struct.unpack("<4sI", chunk)
+        if fourcc == b"EXIF":
+            texts.update(read_exif_text(f.read(size)))
+            f.seek(size & 1, os.SEEK_CUR)
+        else:
+            f.seek(size + (size & 1), os.SEEK_CUR)  # 块按偶数字节对齐
+    return texts
+
+
+def read_image_text(path):
+    """按文件头判断格式，返回元数据中的文本 {关键字: 文本}"""
+    with open(path, "rb") as f:
+        head = f.read(12)
+        f.seek(0)
+        if head.startswith(PNG_SIGNATURE):
+            return read_png_text(f)
+        if head.startswith(b"\xff\xd8"):
+            return read_jpeg_text(f)
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            return read_webp_text(f)
+    return {}
+
+
+def parse_parameters(text):
+    """
+    解析 A1111 的 parameters 文本，返回 (正向提示词, 反向提示词, 参数行)：
+        正向提示词（可多行）
+        Negative prompt: 反向提示词（可多行）
+        Steps: 20, Sampler: ..., ...
+    """
+    lines = text.strip().split("\n")
+    settings = ""
+    if lines and lines[-1].startswith("Steps: "):
+        settings = lines.pop()
+    positive, negative = [], []
+    target = positive
+    for line in lines:
+        if line.startswith("Negative prompt:"):
+            target = negative
+            line = line[len("Negative prompt:") :]
+        target.append(line.strip())
+    return (
+        "\n".join(positive).strip(),
+        "\n".join(negative).strip(),
+        settings,
+    )
+
+
+def extract_prompts(texts):
+    """从元数据文本中取出 (正向提示词, 反向提示词)，没有提示词时返回 None"""
+    parameters = texts.get("parameters") or texts.get("UserComment")
+    if parameters:
+        positive, negative, _ = parse_parameters(parameters)
+        return positive, negative
+    if "Description" in texts:
+        # NovelAI：Description 为正向提示词，Comment 为 JSON，其中 uc 为反向提示词
+        negative = ""
+        try:
+            negative = json.loads(texts.get("Comment", "{}")).get("uc", "")
+        except (ValueError, AttributeError):
+            pass
+        return texts["Description"].strip(), negative.strip()
+    return None
+
+
+def read_image_prompts(path):
+    """返回 (路径, (正向, 反向) 或 None, 错误信息)"""
+    try:
+        return path, extract_prompts(read_image_text(path)), None
+    except (OSError, struct.error, ValueError) as e:
+        return path, None, str(e)
+
+
+def iter_image_files(root, extensions=IMAGE_EXTENSIONS):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(extensions):
+                yield os.path.join(dirpath, filename)
+
+
+def iter_image_prompts(paths, workers=16, window=256):
+    """
+    在线程池中读取元数据，按输入顺序产出 read_image_prompts 的结果。
+    同一时间最多提交两个窗口，内存占用与图片数量无关。
+    """
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        pending = []
+        for paths_window in batch._windows(paths, window):
+            pending.append([pool.submit(read_image_prompts, p) for p in paths_window])
+            if len(pending) > 1:
+                for future in pending.pop(0):
+                    yield future.result()
+        for futures in pending:
+            for future in futures:
+                yield future.result()
+
+
+def classify_images(
+    root,
+    out_path,
+    config,
+    use_fuzzy=False,
+    replace_underscore=True,
+    include_negative=False,
+    workers=16,
+):
+    """提取目录下所有图片的提示词并分类，返回统计信息"""
+    token_map = core.get_token_map(config, replace_underscore)
+    stats = {"images": 0, "prompts": 0, "no_metadata": 0, "errors": 0}
+    start = time.perf_counter()
+    with open(out_path, "w", encoding="utf-8") as out:
+        for path, prompts, error in iter_image_prompts(iter_image_files(root), workers):
+            stats["images"] += 1
+            if error:
+                stats["errors"] += 1
+                print(f"读取失败：{path}：{error}")
+                continue
+            if not prompts or not prompts[0]:
+                stats["no_metadata"] += 1
+                continue
+            positive, negative = prompts
+            record = {
+                "file": os.path.relpath(path, root),
+                "prompt": positive,
+                "negative": negative,
+                "categories": core.classify_text(
+                    positive, use_fuzzy, replace_underscore, config, token_map
+                ),
+            }
+            if include_negative and negative:
+                record["negative_categories"] = core.classify_text(
+                    negative, use_fuzzy, replace_underscore, config, token_map
+                )
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            stats["prompts"] += 1
+            if stats["images"] % 1000 == 0:
+                elapsed = time.perf_counter() - start
+                print(
+                    f"已处理 {stats['images']} 张图片，"
+                    f"{stats['images'] / max(elapsed, 1e-9):.0f} 张/秒"
+                )
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python main.py images", description="从图片元数据中提取提示词并分类"
+    )
+    parser.add_argument("--dir", required=True, help="图片目录（递归）")
+    parser.add_argument("--out", required=True, help="输出的 JSON Lines 文件")
+    parser.add_argument("--workers", type=int, default=16, help="读取文件的线程数")
+    parser.add_argument("--negative", action="store_true", help="同时分类反向提示词")
+    parser.add_argument("--fuzzy", action="store_true", help="启用双向模糊匹配")
+    parser.add_argument(
+        "--no-replace-underscore",
+        dest="replace_underscore",
+        action="store_false",
+        help="按下划线类提示词进行字典匹配",
+    )
+    args = parser.parse_args(argv)
+
+    stats = classify_images(
+        args.dir,
+        args.out,
+        core.load_config(),
+        use_fuzzy=args.fuzzy,
+        replace_underscore=args.replace_underscore,
+        include_negative=args.negative,
+        workers=args.workers,
+    )
+    print(
+        f"完成：{stats['images']} 张图片，提取 {stats['prompts']} 条提示词，"
+        f"无元数据 {stats['no_metadata']} 张，失败 {stats['errors']} 张，"
+        f"{stats['images'] / max(stats['seconds'], 1e-9):.0f} 张/秒"
+    )
+    return 0
@@ -0,0 +1,156 @@
+"""分阶段耗时统计
+
+用法：
+    with instrument.run("classify"):
+        with instrument.stage("match"):
+            ...
+        instrument.count("tokens", 12)
+
+    @instrument.timed("save")      # 等价于用 run("save") 包住整个函数
+    def save_results(...): ...
+
+每次 run 结束后记录各阶段耗时和计数，保存为该操作的最近一次结果，
+并以 JSON Lines 追加到滚动日志 timings.log（超过 LOG_MAX_BYTES 时轮转为 .1）。
+调用 request_profile() 后，下一次 run 会在 cProfile 下执行并附带分析结果。
+当前记录保存在 contextvars 中，线程和 asyncio 任务之间互不干扰。
+"""
+
+import contextlib
+import contextvars
+import cProfile
+import functools
+import inspect
+import io
+import json
+import os
+import pstats
+import threading
+import time
+
+LOG_FILE = "timings.log"
+LOG_MAX_BYTES = 1024 * 1024
+PROFILE_LINES = 25
+
+_current = contextvars.ContextVar("instrument_run", default=None)
+_lock = threading.Lock()
+_last_runs = {}
+_profile_next = False
+
+
+def request_profile():
+    """下一次 run 在 cProfile 下执行"""
+    global _profile_next
+    _profile_next = True
+
+
+def _take_profile_request():
+    global _profile_next
+    with _lock:
+        requested, _profile_next = _profile_next, False
+    return requested
+
+
+@contextlib.contextmanager
+def run(name):
+    record = {
+        "name": name,
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "stages": {},
+        "counts": {},
+    }
+    token = _current.set(record)
+    profiler = cProfile.Profile() if _take_profile_request() else None
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler:
+            profiler.disable()
+        record["total"] = time.perf_counter() - start
+        _current.reset(token)
+        if profiler:
+            stream = io.StringIO()
+            stats = pstats.Stats(profiler, stream=stream)
+            stats.sort_stats("cumulative").print_stats(PROFILE_LINES)
+            record["profile"] = stream.getvalue().rstrip()
+        with _lock:
+            _last_runs[name] = record
+            _write_log(record)
+
+
+def timed(name):
+    """装饰器：函数（含 async 函数）的每次调用记为一次 run"""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with run(name):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with run(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextlib.contextmanager
+def stage(name):
+    record = _current.get()
+    if record is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages = record["stages"]
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+
+
+def count(name, value=1):
+    record = _current.get()
+    if record is not None:
+        record["counts"][name] = record["counts"].get(name, 0) + value
+
+
+def _write_log(record):
+    entry = {key: value for key, value in record.items() if key != "profile"}
+    try:
+        if os.path.exists(LOG_FILE) and os.path.getsize(LOG_FILE) > LOG_MAX_BYTES:
+            os.replace(LOG_FILE, LOG_FILE + ".1")
+        with open(LOG_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"写入耗时日志失败：{e}")
+
+
+def last_runs():
+    with _lock:
+        return dict(_last_runs)
+
+
+def format_last_runs():
+    runs = last_runs()
+    if not runs:
+        return "暂无记录"
+    blocks = []
+    for name, record in runs.items():
+        lines = [f"[{name}] {record['time']}  总计 {record['total'] * 1000:.1f} ms"]
+        for stage_name, seconds in record["stages"].items():
+            lines.append(f"  {stage_name:<16} {seconds * 1000:10.2f} ms")
+        for count_name, value in record["counts"].items():
+            lines.append(f"  {count_name:<16} {value:>10}")
+        if "profile" in record:
+            lines.append(record["profile"])
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
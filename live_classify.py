@@ -0,0 +1,244 @@
+"""输入时的实时分类（增量）
+
+LiveSession 记住上一次的输入文本、它的顶层片段（prompt_tokenizer.segments）
+以及各片段的匹配结果。文本变化时先求新旧文本的公共前缀和公共后缀：
+完全落在公共前缀内的片段原样沿用，公共后缀内的片段平移下标后沿用，
+只有编辑位置所在的片段重新分词和匹配。匹配引擎或词典变化时整体重建。
+
+分类结果也是增量维护的：每个片段有一个排序键（相邻片段之间留有间隔，插入新片段
+时取中间值），每个 (分类名, 写法) 记录全部出现位置，各分类按首次出现位置排序。
+一次编辑只增删被改动片段中的条目，耗时与提示词总长度无关。
+
+    session = LiveSession()
+    session.update(text, matchers, match, extra_category)
+    results, corrections = session.results(category_names)
+"""
+
+import bisect
+import itertools
+import operator
+
+import prompt_tokenizer
+
+UNCLASSIFIED = "未分类"
+# 初始排序键的间隔；插入位置的间隔用尽时重新编号
+KEY_GAP = 1 << 32
+
+_CORRECTIONS = operator.itemgetter(2)
+
+
+def _common_prefix(a, b, limit):
+    """a、b 前 limit 个字符内的公共前缀长度（二分比较切片，在 C 层逐字符比较）"""
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _common_suffix(a, b, limit):
+    low, high = 0, limit
+    end_a, end_b = len(a), len(b)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[end_a - middle : end_a - low] == b[end_b - middle : end_b - low]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class LiveSession:
+    def __init__(self):
+        self.text = ""
+        # 顶层片段的起止位置和排序键，与 entries 一一对应
+        self.starts = []
+        self.ends = []
+        self.keys = []
+        # 每个片段：(额外网络 ((分类名, 原文), ...), 提示词 ((分类名, 写法), ...),
+        #          纠错记录 ((原文, 纠正后, 分类名, TypoMatch), ...))
+        self.entries = []
+        self.matchers = None
+        self.extra_category = None
+        # {(分类名, 写法): 各次出现的排序键（有序）}，排序键为
+        # (0 额外网络 / 1 提示词, 片段排序键, 片段内序号)：额外网络排在提示词之前
+        self._occurrences = {}
+        # {分类名: 首次出现的排序键（有序）} 及与之平行的 {分类名: 写法}
+        self._first_keys = {}
+        self._tags = {}
+        self._correction_segments = 0
+        # 最近一次 update 重新分词的片段数和沿用的片段数
+        self.parsed = 0
+        self.reused = 0
+        # 界面上次显示的拼写建议与语义分类记录，未变化时不再发送
+        self.notes = ""
+
+    def update(self, text, matchers, match, extra_category=None):
+        """
+        matchers: 决定匹配结果的对象（词典映射、模糊/纠错引擎），按 is 比较，变化时整体重建
+        match(原文, 核心词) → (分类名, 写法, TypoMatch 或 None)
+        extra_category: <lora:...> 等额外网络归入的分类名，为空时不参与分类
+        """
+        if (
+            self.matchers is None
+            or len(matchers) != len(self.matchers)
+            or any(a is not b for a, b in zip(matchers, self.matchers))
+            or extra_category != self.extra_category
+        ):
+            self.__init__()
+            self.matchers = tuple(matchers)
+            self.extra_category = extra_category
+        elif text == self.text:
+            self.parsed = 0
+            self.reused = len(self.entries)
+            return
+
+        old = self.text
+        limit = min(len(old), len(text))
+        prefix = _common_prefix(old, text, limit)
+        suffix = _common_suffix(old, text, limit - prefix)
+        shift = len(text) - len(old)
+
+        # 结束位置（即其后的分隔符）在公共前缀内的片段不受影响
+        keep = bisect.bisect_left(self.ends, prefix)
+        resume = self.ends[keep - 1] if keep else 0
+        # 起始位置之前的分隔符也在公共后缀内的旧片段，才可能原样沿用
+        boundary = len(text) - suffix
+        first_tail = bisect.bisect_right(self.starts, len(old) - suffix)
+
+        spans = []
+        added = []
+        tail = len(self.entries)
+        for start, end, plain in prompt_tokenizer.segments(text, resume):
+            if start > boundary:
+                i = bisect.bisect_left(self.starts, start - shift, first_tail)
+                if i < len(self.starts) and self.starts[i] == start - shift:
+                    # 从同一位置起的文本完全相同，后续片段的切分和结果都不变
+                    tail = i
+                    break
+            spans.append((start, end))
+            added.append(self._match_segment(text[start:end], plain, match))
+
+        removed = self.entries[keep:tail]
+        removed_keys = self.keys[keep:tail]
+        left = self.keys[keep - 1] if keep else 0
+        if tail < len(self.keys):
+            right = self.keys[tail]
+        else:
+            right = left + KEY_GAP * (len(added) + 1)
+        step = (right - left) // (len(added) + 1)
+        added_keys = [left + step * (n + 1) for n in range(len(added))]
+
+        self.text = text
+        self.starts = [
+            *self.starts[:keep],
+            *(start for start, _ in spans),
+            *map(shift.__add__, self.starts[tail:]),
+        ]
+        self.ends = [
+            *self.ends[:keep],
+            *(end for _, end in spans),
+            *map(shift.__add__, self.ends[tail:]),
+        ]
+        self.entries = [*self.entries[:keep], *added, *self.entries[tail:]]
+        self.keys = [*self.keys[:keep], *added_keys, *self.keys[tail:]]
+        self.parsed = len(added)
+        self.reused = len(self.entries) - len(added)
+
+        if step:
+            for entry, key in zip(removed, removed_keys):
+                self._apply(entry, key, False)
+            for entry, key in zip(added, added_keys):
+                self._apply(entry, key, True)
+        else:
+            self._reindex()
+
+    def _reindex(self):
+        """排序键间隔用尽时重新编号，并重建分类结果"""
+        self._occurrences = {}
+        self._first_keys = {}
+        self._tags = {}
+        self._correction_segments = 0
+        self.keys = [KEY_GAP * (n + 1) for n in range(len(self.entries))]
+        for entry, key in zip(self.entries, self.keys):
+            self._apply(entry, key, True)
+
+    def _match_segment(self, segment, plain, match):
+        extras = []
+        pairs = []
+        corrections = []
+        for token in prompt_tokenizer.tokenize_segment(segment, plain):
+            if token.kind == prompt_tokenizer.KIND_EXTRA_NETWORK:
+                if self.extra_category:
+                    extras.append((self.extra_category, token.raw))
+            elif token.kind not in prompt_tokenizer.SYNTAX_KINDS:
+                category, tag, typo_hit = match(token.raw, token.core)
+                pairs.append((category, tag))
+                if typo_hit:
+                    corrections.append((token.raw, tag, category, typo_hit))
+        return tuple(extras), tuple(pairs), tuple(corrections)
+
+    def _apply(self, entry, key, adding):
+        extras, pairs, corrections = entry
+        for kind, items in ((0, extras), (1, pairs)):
+            for j, pair in enumerate(items):
+                if adding:
+                    self._add_occurrence(pair, (kind, key, j))
+                else:
+                    self._remove_occurrence(pair, (kind, key, j))
+        if corrections:
+            self._correction_segments += 1 if adding else -1
+
+    def _add_occurrence(self, pair, sort_key):
+        occurrences = self._occurrences.get(pair)
+        if occurrences is None:
+            self._occurrences[pair] = [sort_key]
+            self._place(pair, sort_key)
+            return
+        first = occurrences[0]
+        bisect.insort(occurrences, sort_key)
+        if sort_key < first:
+            self._unplace(pair[0], first)
+            self._place(pair, sort_key)
+
+    def _remove_occurrence(self, pair, sort_key):
+        occurrences = self._occurrences[pair]
+        first = occurrences[0]
+        del occurrences[bisect.bisect_left(occurrences, sort_key)]
+        if sort_key == first:
+            self._unplace(pair[0], first)
+            if occurrences:
+                self._place(pair, occurrences[0])
+            else:
+                del self._occurrences[pair]
+
+    def _place(self, pair, sort_key):
+        category, tag = pair
+        first_keys = self._first_keys.setdefault(category, [])
+        i = bisect.bisect_left(first_keys, sort_key)
+        first_keys.insert(i, sort_key)
+        self._tags.setdefault(category, []).insert(i, tag)
+
+    def _unplace(self, category, sort_key):
+        first_keys = self._first_keys[category]
+        i = bisect.bisect_left(first_keys, sort_key)
+        del first_keys[i]
+        del self._tags[category][i]
+
+    def results(self, names):
+        """
+        返回 (分类结果, 纠错记录)，与 classify_text 对同一文本的结果相同：
+        {分类名: [提示词, ...], "未分类": [...]}, {原提示词: (纠正后, 分类名, TypoMatch)}
+        """
+        results = {name: list(self._tags.get(name, ())) for name in names}
+        results[UNCLASSIFIED] = list(self._tags.get(UNCLASSIFIED, ()))
+        corrections = {}
+        if self._correction_segments:
+            for part, tag, category, typo_hit in itertools.chain.from_iterable(
+                map(_CORRECTIONS, self.entries)
+            ):
+                corrections[part] = (tag, category, typo_hit)
+        return results, corrections
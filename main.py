@@ -1,27 +1,76 @@
-import gradio as gr
 import os
 import re
 import json
+import copy
 import sys
-import openai
-from torch import fill
+import tempfile
+import threading
+import time
+
+import extract_store
+import instrument
+import live_classify
+import prompt_tokenizer
+import semantic_fallback
+import tag_complete
+import tag_stats
+import typo_match
+from classify_state import ClassifyState
+from fuzzy_match import DEFAULT_MIN_LENGTH, FuzzyMatcher
+
+# gradio 与 openai 导入耗时较长，仅在启动界面 / 首次AI分类时才导入，
+# 使分类核心（classify_text 等）只依赖标准库
 
 CONFIG_FILE = "config.json"
 
 
-# 重启应用函数
-def restart_app():
-    """重启Gradio应用"""
-    python = sys.executable
-    os.execl(python, python, *sys.argv)
+# --- 配置管理 ---
+# 进程内的配置快照：config.json 的 (mtime_ns, size, inode) 不变时直接复用，
+# 每次重新读取或保存后 version 加 1
+_config_lock = threading.RLock()
+_config_snapshot = {"stat": None, "config": None, "version": 0}
+
+
+def _config_stat():
+    try:
+        stat = os.stat(CONFIG_FILE)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def config_version():
+    """
+    配置快照的版本号，配置文件被重新读取或保存后递增。
+    界面会话与会话配置一起保存载入时的版本号，用于发现其他会话对配置的修改
+    """
+    load_config()
+    return _config_snapshot["version"]
 
 
-# --- 配置管理 ---
 def load_config():
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    else:
+    """
+    返回配置快照，文件未变化时不重新读取和解析。
+    返回的字典由所有调用方共用，只读；需要修改时先复制再 save_config。
+    """
+    stat = _config_stat()
+    with _config_lock:
+        snapshot = _config_snapshot
+        if stat is not None and stat == snapshot["stat"]:
+            return snapshot["config"]
+        if stat is not None:
+            try:
+                with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+                    config = json.load(f)
+            except ValueError:
+                if snapshot["config"] is None:
+                    raise
+                # 手工编辑到一半等情况：继续使用上一份快照，下次调用时重试
+                print(f"{CONFIG_FILE} 解析失败，继续使用已加载的配置")
+                return snapshot["config"]
+            snapshot.update(stat=stat, config=config, version=snapshot["version"] + 1)
+            return config
+
         # 创建默认配置
         default_config = {
             "categories": [
@@ -29,199 +78,909 @@ def load_config():
                 {"name": "Clothes", "path": "Clothes"},
                 {"name": "Others", "path": "Others"},
             ],
+            "category_priority": [],
+            "extra_networks_category": "",
+            "typo_max_distance": typo_match.DEFAULT_MAX_DISTANCE,
+            "semantic_threshold": semantic_fallback.DEFAULT_THRESHOLD,
             "api_key": "",
             "base_url": "",
             "system_prompt": "你是AI分类助手",
             "model": "deepseek-chat",
         }
         save_config(default_config)
-        return default_config
+        return _config_snapshot["config"]
 
 
 def save_config(config):
-    with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-        json.dump(config, f, indent=4)
+    """
+    先写同目录下的临时文件再原子替换，读取方不会读到写了一半的 config.json；
+    保存后更新进程内快照（保存的是副本，调用方之后修改 config 不影响快照）
+    """
+    directory = os.path.dirname(os.path.abspath(CONFIG_FILE))
+    with _config_lock:
+        fd, tmp_path = tempfile.mkstemp(prefix=".config-", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(config, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, CONFIG_FILE)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        _config_snapshot.update(
+            stat=_config_stat(),
+            config=copy.deepcopy(config),
+            version=_config_snapshot["version"] + 1,
+        )
 
 
 # --- 核心逻辑 ---
-def load_category_words(folder_path):
-    print(f"正在加载目录：{folder_path}")
+# 进程级词典缓存：按文件路径缓存，(mtime, size) 变化时只重新读取该文件
+# 值为 (mtime_ns, size, 下划线形式词集, 空格形式词集)
+_word_file_cache = {}
+
+
+def _load_word_file(file_path, stat):
+    cached = _word_file_cache.get(file_path)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached
+
+    print(f"正在加载文件：{file_path}")
+    with open(file_path, "r", encoding="utf-8") as f:
+        words = frozenset(line.strip() for line in f if line.strip())
+    space_words = frozenset(word.replace("_", " ") for word in words)
+    cached = (stat.st_mtime_ns, stat.st_size, words, space_words)
+    _word_file_cache[file_path] = cached
+    return cached
 
-    words = set()
+
+def _scan_category(folder_path):
+    """返回 [(文件名, 缓存项)]，只重新读取发生变化的文件"""
+    entries_out = []
     if not os.path.isdir(folder_path):
-        return words
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".txt"):
-            with open(os.path.join(folder_path, filename), "r", encoding="utf-8") as f:
-                words.update(line.strip() for line in f if line.strip())
+        return entries_out
+    with os.scandir(folder_path) as entries:
+        for entry in sorted(entries, key=lambda e: e.name):
+            if entry.name.endswith(".txt") and entry.is_file():
+                cached = _load_word_file(entry.path, entry.stat())
+                entries_out.append((entry.name, cached))
+    return entries_out
+
+
+# 分类词集缓存：{(路径, 是否替换下划线): (文件签名, 合并后的词集)}
+_category_words_cache = {}
+
+
+def _category_signature(scanned):
+    return tuple((name, entry[0], entry[1]) for name, entry in scanned)
+
+
+def get_category_words(folder_path, replace_underscore=False):
+    scanned = _scan_category(folder_path)
+    signature = _category_signature(scanned)
+    key = (folder_path, replace_underscore)
+    cached = _category_words_cache.get(key)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    variant = 3 if replace_underscore else 2
+    words = frozenset().union(*(entry[variant] for _, entry in scanned))
+    _category_words_cache[key] = (signature, words)
     return words
 
 
 def get_all_words(config, replace_underscore=False):
     all_words = {}
     for category in config["categories"]:
-        name = category["name"]
-        path = category["path"]
-        words = load_category_words(path)
-        if replace_underscore:
-            all_words[name] = {word.replace("_", " ") for word in words}
-        else:
-            all_words[name] = words
+        all_words[category["name"]] = get_category_words(
+            category["path"], replace_underscore
+        )
     return all_words
 
 
-def extract_core_word(part):
-    part = part.strip()
-    while len(part) > 1 and (
-        (part.startswith("(") and part.endswith(")"))
-        or (part.startswith("[") and part.endswith("]"))
-        or (part.startswith("{") and part.endswith("}"))
-    ):
-        part = part[1:-1].strip()
-    part = re.sub(r":\s*[-+]?\d*\.?\d+\s*$", "", part).strip()
-    return part
+def get_category_priority(config):
+    """分类匹配优先级：config["category_priority"] 中列出的在前，其余按分类顺序"""
+    names = [category["name"] for category in config["categories"]]
+    priority = [n for n in config.get("category_priority", []) if n in names]
+    return priority + [name for name in names if name not in priority]
 
 
-def classify_prompt(text, use_fuzzy, replace_underscore, config):
-    parts = re.split(",", text)
+# 标记→分类映射缓存：{是否替换下划线: (签名, 映射, 冲突表)}
+_token_map_cache = {}
+# 增量修改映射及安装后台构建的索引时持有；版本号在每次增量修改后加一
+_index_update_lock = threading.RLock()
+_dictionary_version = 0
 
-    print(f"正在处理：{len(parts)}")
 
-    category_words = get_all_words(config, replace_underscore)
+def _token_index_signature(config):
+    """返回 (签名, [(分类名, 扫描结果)])，分类按优先级排列"""
+    paths = {category["name"]: category["path"] for category in config["categories"]}
+    order = get_category_priority(config)
+    scanned = [(name, _scan_category(paths[name])) for name in order]
+    signature = tuple(
+        (name, paths[name], _category_signature(files)) for name, files in scanned
+    )
+    return signature, scanned
 
-    # 添加"未分类"类别
-    results = {category["name"]: [] for category in config["categories"]}
-    results["未分类"] = []  # 新增未分类列表
 
-    for part in parts:
-        part = part.strip()
-        raw_part = extract_core_word(part).strip()
-        if not raw_part:
+def _build_token_index(config, replace_underscore=False):
+    signature, scanned = _token_index_signature(config)
+    cached = _token_map_cache.get(replace_underscore)
+    if cached and cached[0] == signature:
+        return cached[1], cached[2]
+
+    variant = 3 if replace_underscore else 2
+    token_map = {}
+    conflicts = {}
+    for name, files in scanned:
+        for filename, entry in files:
+            owner = (name, filename)
+            for word in entry[variant]:
+                first = token_map.setdefault(word, owner)
+                if first[0] == name:
+                    continue
+                owners = conflicts.setdefault(word, [first])
+                if all(other[0] != name for other in owners):
+                    owners.append(owner)
+
+    _token_map_cache[replace_underscore] = (signature, token_map, conflicts)
+    return token_map, conflicts
+
+
+def get_token_map(config, replace_underscore=False):
+    """返回 {标记: (分类名, 来源文件)}，同一标记出现在多个分类时取优先级最高的"""
+    return _build_token_index(config, replace_underscore)[0]
+
+
+def find_category_conflicts(config, replace_underscore=False):
+    """返回 {标记: [(分类名, 来源文件), ...]}，列出出现在多个分类中的标记"""
+    return _build_token_index(config, replace_underscore)[1]
+
+
+def format_conflict_report(conflicts):
+    if not conflicts:
+        return "未发现跨分类冲突的提示词。"
+    lines = [f"共 {len(conflicts)} 个提示词出现在多个分类中（按优先级排列，首个生效）："]
+    for word in sorted(conflicts):
+        owners = " > ".join(f"{name}/{file}" for name, file in conflicts[word])
+        lines.append(f"{word}: {owners}")
+    return "\n".join(lines)
+
+
+def clear_dictionary_caches():
+    """清空所有词典缓存，下次使用时重新加载"""
+    _word_file_cache.clear()
+    _category_words_cache.clear()
+    _token_map_cache.clear()
+    _fuzzy_matcher_cache.clear()
+    _typo_matcher_cache.clear()
+    _completion_index_cache.clear()
+    _semantic_classifier_cache.clear()
+
+
+# AI分类结果写入分类词典时使用的文件名
+AI_ADDED_FILE = "ai_added.txt"
+
+
+def add_words_to_category(config, category_name, words, filename=AI_ADDED_FILE):
+    """
+    把新提示词（存为下划线形式）追加到分类目录下的 filename，
+    并增量更新内存中的词典索引，不重新扫描目录也不需要重启。
+    返回实际新增的提示词。
+    """
+    folder = next(
+        c["path"] for c in config["categories"] if c["name"] == category_name
+    )
+    existing = get_category_words(folder, False)
+    new_words = [
+        word
+        for word in dict.fromkeys(w.strip().replace(" ", "_") for w in words)
+        if word and word not in existing
+    ]
+    if not new_words:
+        return []
+
+    old_signature = _token_index_signature(config)[0]
+    old_category_signature = _category_signature(_scan_category(folder))
+
+    os.makedirs(folder, exist_ok=True)
+    file_path = os.path.join(folder, filename)
+    with extract_store.file_lock(file_path):
+        prefix = ""
+        if os.path.exists(file_path) and os.path.getsize(file_path):
+            with open(file_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                prefix = "" if f.read(1) == b"\n" else "\n"
+        with open(file_path, "a", encoding="utf-8") as f:
+            f.write(prefix + "".join(word + "\n" for word in new_words))
+
+    # 1. 文件级缓存：直接合并新词，并记录写入后的 mtime/size
+    stat = os.stat(file_path)
+    added = {False: frozenset(new_words)}
+    added[True] = frozenset(word.replace("_", " ") for word in new_words)
+    cached = _word_file_cache.get(file_path)
+    if cached:
+        words_set, space_set = cached[2] | added[False], cached[3] | added[True]
+    else:
+        words_set, space_set = added[False], added[True]
+    _word_file_cache[file_path] = (stat.st_mtime_ns, stat.st_size, words_set, space_set)
+
+    # 2. 分类词集缓存
+    category_signature = _category_signature(_scan_category(folder))
+    for replace_underscore in (False, True):
+        cached = _category_words_cache.get((folder, replace_underscore))
+        if cached and cached[0] == old_category_signature:
+            _category_words_cache[(folder, replace_underscore)] = (
+                category_signature,
+                cached[1] | added[replace_underscore],
+            )
+
+    # 3. 标记→分类映射：只插入新词，按优先级处理与其他分类的冲突
+    signature = _token_index_signature(config)[0]
+    priority = get_category_priority(config)
+    rank = {name: i for i, name in enumerate(priority)}
+    owner = (category_name, filename)
+    with _index_update_lock:
+        for replace_underscore in (False, True):
+            cached = _token_map_cache.get(replace_underscore)
+            if not cached or cached[0] != old_signature:
+                continue
+            token_map, conflicts = cached[1], cached[2]
+            _index_insert(token_map, conflicts, added[replace_underscore], owner, rank)
+            _token_map_cache[replace_underscore] = (signature, token_map, conflicts)
+            # 模糊匹配引擎依赖映射内容，下次使用时重建
+            _fuzzy_matcher_cache.pop(replace_underscore, None)
+            _update_typo_matcher(
+                replace_underscore, token_map, priority, added[replace_underscore]
+            )
+        _dictionary_changed(config)
+
+    return new_words
+
+
+def _update_typo_matcher(replace_underscore, token_map, priority, words):
+    """拼写纠错索引只插入 words 的删除变体，不整体重建"""
+    cached = _typo_matcher_cache.get(replace_underscore)
+    if not cached or cached[0] is not token_map:
+        return
+    matcher = cached[3]
+    # 冲突词的归属可能随新增/删除的分类变化，排序一并重算
+    matcher.set_priority(priority)
+    matcher.add(words)
+    _typo_matcher_cache[replace_underscore] = (token_map, priority, cached[2], matcher)
+
+
+def _dictionary_changed(config):
+    """
+    映射增量修改后调用：本地语义分类模型和补全索引无法增量更新，在后台重建，
+    期间继续使用旧的
+    """
+    global _dictionary_version
+    with _index_update_lock:
+        _dictionary_version += 1
+    if "model" in _semantic_classifier_cache:
+        build_in_background(("semantic",), lambda: _build_semantic_classifier(config))
+    if "index" in _completion_index_cache:
+        build_in_background(("completion",), lambda: _build_completion_index(config))
+
+
+def _index_insert(token_map, conflicts, words, owner, rank):
+    """向标记映射插入 owner 的词，与其他分类冲突时按 rank 决定归属"""
+    name = owner[0]
+    for word in words:
+        first = token_map.setdefault(word, owner)
+        if first[0] == name:
+            continue
+        owners = conflicts.setdefault(word, [first])
+        if all(other[0] != name for other in owners):
+            owners.append(owner)
+            owners.sort(key=lambda o: rank.get(o[0], len(rank)))
+            token_map[word] = owners[0]
+
+
+def _index_remove(token_map, conflicts, words, name):
+    """从标记映射移除分类 name 的词，冲突的词交给优先级次高的分类"""
+    for word in words:
+        owners = conflicts.get(word)
+        if owners is None:
+            if token_map.get(word, ("",))[0] == name:
+                del token_map[word]
             continue
+        owners = [owner for owner in owners if owner[0] != name]
+        if len(owners) > 1:
+            conflicts[word] = owners
+        else:
+            del conflicts[word]
+        token_map[word] = owners[0]
 
-        matched = False
-        for category_name, words in category_words.items():
-            if use_fuzzy:
-                for word in words:
-                    if word in raw_part or raw_part in word:
-                        results[category_name].append(part)
-                        matched = True
-                        break
-            else:
-                if raw_part in words:
-                    results[category_name].append(part)
-                    matched = True
-            if matched:
-                break
-
-        # 如果没有匹配任何类别，放入未分类
-        if not matched:
-            results["未分类"].append(part)
-
-    # 去重
-    results = {
-        cat["name"]: list(set(results[cat["name"]]))
-        for cat in config["categories"] + [{"name": "未分类"}]
-    }
 
-    # 返回所有类别结果和未分类结果
-    output = [", ".join(results[cat["name"]]) for cat in config["categories"]]
-    output.append(", ".join(results["未分类"]))  # 添加未分类结果
+def update_category_index(old_config, new_config):
+    """
+    分类增删或调整顺序后增量更新标记映射：只处理被删除、新增分类的词，
+    顺序变化时只重新排列冲突词的归属。缓存与 old_config 不一致时不做处理，
+    下次使用时整体重建。
+    """
+    old_signature, old_scanned = _token_index_signature(old_config)
+    signature, scanned = _token_index_signature(new_config)
+    old_files = dict(zip(old_signature, (files for _, files in old_scanned)))
+    new_files = dict(zip(signature, (files for _, files in scanned)))
+    # 以 (分类名, 路径, 文件签名) 区分分类，路径或文件变化的按删除后重新添加处理
+    old_keys = {key[:2] for key in old_files}
+    new_keys = {key[:2] for key in new_files}
+    removed = [(k, files) for k, files in old_files.items() if k[:2] not in new_keys]
+    added = [(k, files) for k, files in new_files.items() if k[:2] not in old_keys]
+
+    common = old_keys & new_keys
+    old_order = [key[0] for key in old_signature if key[:2] in common]
+    new_order = [key[0] for key in signature if key[:2] in common]
+    priority = get_category_priority(new_config)
+    rank = {name: i for i, name in enumerate(priority)}
+
+    updated = False
+    with _index_update_lock:
+        for replace_underscore in (False, True):
+            cached = _token_map_cache.get(replace_underscore)
+            if not cached or cached[0] != old_signature:
+                continue
+            token_map, conflicts = cached[1], cached[2]
+            variant = 3 if replace_underscore else 2
+            for key, files in removed:
+                for _, entry in files:
+                    _index_remove(token_map, conflicts, entry[variant], key[0])
+            if old_order != new_order:
+                for word, owners in conflicts.items():
+                    owners.sort(key=lambda o: rank.get(o[0], len(rank)))
+                    token_map[word] = owners[0]
+            new_words = []
+            for key, files in added:
+                for filename, entry in files:
+                    _index_insert(
+                        token_map, conflicts, entry[variant], (key[0], filename), rank
+                    )
+                    new_words.extend(entry[variant])
+            _token_map_cache[replace_underscore] = (signature, token_map, conflicts)
+            _fuzzy_matcher_cache.pop(replace_underscore, None)
+            _update_typo_matcher(replace_underscore, token_map, priority, new_words)
+            updated = True
+        if updated:
+            _dictionary_changed(new_config)
+
 
-    new_tag_output_boxes = []
-    for category in config["categories"]:
-        new_tag_output_boxes.append(
-            gr.CheckboxGroup(
-                value=[],
-                choices=results[category["name"]],
-                label=category["name"],
-                interactive=True,
+def migrate_classify_state(state, config):
+    """
+    按当前分类原地整理分类状态，已删除分类中的提示词移入未分类，
+    返回内容变化的分类名集合
+    """
+    return state.migrate([category["name"] for category in config["categories"]])
+
+
+# 模糊匹配引擎缓存：{是否替换下划线: (标记映射, 优先级, 最短长度, 引擎)}
+_fuzzy_matcher_cache = {}
+
+
+def get_fuzzy_matcher(config, replace_underscore=False):
+    token_map = get_token_map(config, replace_underscore)
+    priority = get_category_priority(config)
+    min_length = config.get("fuzzy_min_length", DEFAULT_MIN_LENGTH)
+    cached = _fuzzy_matcher_cache.get(replace_underscore)
+    if (
+        cached
+        and cached[0] is token_map
+        and cached[1] == priority
+        and cached[2] == min_length
+    ):
+        return cached[3]
+
+    print("正在构建模糊匹配索引")
+    matcher = FuzzyMatcher(token_map, priority, min_length)
+    _fuzzy_matcher_cache[replace_underscore] = (
+        token_map,
+        priority,
+        min_length,
+        matcher,
+    )
+    return matcher
+
+
+# 在后台构建的索引：{键: 线程}，同一索引同时只有一个构建线程
+_background_builds = {}
+_background_lock = threading.Lock()
+
+
+def build_in_background(key, build):
+    """在守护线程中运行 build()；同一 key 的上一次构建尚未结束时不重复启动"""
+    with _background_lock:
+        thread = _background_builds.get(key)
+        if thread is not None and thread.is_alive():
+            return
+        thread = threading.Thread(target=build, name=f"build-{key[0]}", daemon=True)
+        _background_builds[key] = thread
+        thread.start()
+
+
+# 拼写纠错索引缓存：{是否替换下划线: (标记映射, 优先级, 最大距离, 引擎)}
+_typo_matcher_cache = {}
+
+
+def get_typo_matcher(config, replace_underscore=False, wait=True):
+    """
+    wait 为假时（界面请求中）不在当前线程构建：索引未建好时在后台构建并返回 None。
+    索引已过期（词典文件或设置变化）时在后台重建，期间返回旧索引
+    """
+    token_map = get_token_map(config, replace_underscore)
+    priority = get_category_priority(config)
+    max_distance = config.get("typo_max_distance", typo_match.DEFAULT_MAX_DISTANCE)
+    cached = _typo_matcher_cache.get(replace_underscore)
+    if (
+        cached
+        and cached[0] is token_map
+        and cached[1] == priority
+        and cached[2] == max_distance
+    ):
+        return cached[3]
+    if cached or not wait:
+        build_in_background(
+            ("typo", replace_underscore),
+            lambda: _build_typo_matcher(config, replace_underscore),
+        )
+        return cached[3] if cached else None
+    return _build_typo_matcher(config, replace_underscore)
+
+
+def _build_typo_matcher(config, replace_underscore):
+    token_map = get_token_map(config, replace_underscore)
+    priority = get_category_priority(config)
+    max_distance = config.get("typo_max_distance", typo_match.DEFAULT_MAX_DISTANCE)
+    print("正在构建拼写纠错索引")
+    matcher = typo_match.TypoMatcher(token_map, priority, max_distance)
+    with _index_update_lock:
+        # 构建期间映射可能被增量修改，补上遗漏的新词
+        matcher.set_priority(priority)
+        matcher.add()
+        _typo_matcher_cache[replace_underscore] = (
+            token_map,
+            priority,
+            max_distance,
+            matcher,
+        )
+    return matcher
+
+
+# 补全索引缓存：(下划线形式的标记映射, 词典版本, 索引)
+_completion_index_cache = {}
+
+
+def get_completion_index(config, wait=True):
+    """
+    返回补全索引。词典变化后索引在后台重建，保存次数变化后排名在后台重算，
+    期间继续使用旧的索引和排名，按键时不做整表遍历。
+    wait 为假（界面按键）且还没有索引时在后台构建并返回 None
+    """
+    token_map = get_token_map(config, False)
+    cached = _completion_index_cache.get("index")
+    if cached is None:
+        if not wait:
+            build_in_background(
+                ("completion",), lambda: _build_completion_index(config)
             )
+            return None
+        return _build_completion_index(config)
+
+    index = cached[2]
+    if cached[0] is not token_map or cached[1] != _dictionary_version:
+        build_in_background(("completion",), lambda: _build_completion_index(config))
+    elif index.ranks_stale(tag_stats.get_stats()):
+        build_in_background(("completion-ranks",), index.refresh_ranks)
+    return index
+
+
+def _build_completion_index(config):
+    with _index_update_lock:
+        token_map = get_token_map(config, False)
+        version = _dictionary_version
+        snapshot = dict(token_map)
+    index = tag_complete.CompletionIndex(snapshot)
+    index.refresh_ranks()
+    _completion_index_cache["index"] = (token_map, version, index)
+    return index
+
+
+# 本地语义分类模型缓存：(下划线形式的标记映射, 词典版本, 模型)
+_semantic_classifier_cache = {}
+
+
+def get_semantic_classifier(config, wait=True):
+    """
+    返回 SemanticClassifier；未安装 NumPy 时返回 None。
+    词典变化后模型在后台重建，期间返回旧模型；wait 为假且还没有模型时
+    也在后台构建并返回 None
+    """
+    if not semantic_fallback.is_available():
+        return None
+    token_map = get_token_map(config, False)
+    cached = _semantic_classifier_cache.get("model")
+    if cached and cached[0] is token_map and cached[1] == _dictionary_version:
+        return cached[2]
+    if cached or not wait:
+        build_in_background(("semantic",), lambda: _build_semantic_classifier(config))
+        return cached[2] if cached else None
+    return _build_semantic_classifier(config)
+
+
+def _build_semantic_classifier(config):
+    with _index_update_lock:
+        token_map = get_token_map(config, False)
+        version = _dictionary_version
+        snapshot = dict(token_map)
+    print("正在构建本地语义分类模型")
+    classifier = semantic_fallback.SemanticClassifier(snapshot)
+    print(f"本地语义分类模型构建完成，耗时 {classifier.build_seconds:.2f} 秒")
+    # 构建期间词典又有变化时版本号不一致，下次使用时再在后台重建
+    _semantic_classifier_cache["model"] = (token_map, version, classifier)
+    return classifier
+
+
+def apply_semantic_fallback(results, config):
+    """
+    对未分类的提示词做本地语义分类，置信度不低于 semantic_threshold 的移入预测的
+    分类（原地修改 results），返回 {提示词: Proposal}；模型正在后台构建时返回 None
+    """
+    unclassified = results["未分类"]
+    if not unclassified:
+        return {}
+    classifier = get_semantic_classifier(config, wait=False)
+    if classifier is None:
+        return None if semantic_fallback.is_available() else {}
+    threshold = config.get("semantic_threshold", semantic_fallback.DEFAULT_THRESHOLD)
+    with instrument.stage("semantic"):
+        proposals = classifier.propose(unclassified, threshold)
+    accepted = {}
+    for tag, proposal in proposals.items():
+        if proposal.category in results:
+            results[proposal.category].append(tag)
+            accepted[tag] = proposal
+    results["未分类"] = [tag for tag in unclassified if tag not in accepted]
+    instrument.count("semantic_proposed", len(accepted))
+    return accepted
+
+
+def extract_core_word(part):
+    return prompt_tokenizer.normalize_core(part.strip())
+
+
+def classify_text(
+    text,
+    use_fuzzy,
+    replace_underscore,
+    config,
+    token_map=None,
+    use_typo=False,
+    corrections=None,
+):
+    """
+    分类核心逻辑，不依赖界面组件。
+    返回 {分类名: [提示词, ...], "未分类": [...]}，各列表按出现顺序去重。
+    token_map 可传入任何提供 get 方法的映射（如 mmap 打开的编译词典），
+    默认使用进程内的词典索引。
+    use_typo 时对精确查找失败的提示词做拼写纠错，以纠正后的写法归入分类；
+    传入 corrections 字典时记录 {原提示词: (纠正后, 分类名, TypoMatch)}。
+    """
+    fuzzy_matcher = typo_matcher = None
+    with instrument.stage("load_dictionary"):
+        if token_map is None:
+            token_map = get_token_map(config, replace_underscore)
+        if use_fuzzy:
+            fuzzy_matcher = get_fuzzy_matcher(config, replace_underscore)
+        if use_typo:
+            typo_matcher = get_typo_matcher(config, replace_underscore)
+
+    with instrument.stage("tokenize"):
+        tokens = []
+        extra_networks = []
+        for token in prompt_tokenizer.tokenize(text):
+            if token.kind == prompt_tokenizer.KIND_EXTRA_NETWORK:
+                extra_networks.append(token.raw)
+            elif token.kind not in prompt_tokenizer.SYNTAX_KINDS:
+                tokens.append((token.raw, token.core))
+    instrument.count("tokens", len(tokens))
+
+    # 添加"未分类"类别
+    results = {category["name"]: {} for category in config["categories"]}
+    results["未分类"] = {}  # 新增未分类列表
+
+    # <lora:...> 等额外网络不查词典：配置了 extra_networks_category 时归入该分类，
+    # 否则不参与分类
+    extra_category = config.get("extra_networks_category")
+    if extra_category in results:
+        for raw in extra_networks:
+            results[extra_category][raw] = None
+    instrument.count("extra_networks", len(extra_networks))
+
+    with instrument.stage("match"):
+        _match_tokens(
+            tokens, token_map, fuzzy_matcher, results, typo_matcher, corrections
         )
-    new_tag_output_boxes.append(
-        gr.CheckboxGroup(
-            value=[],
-            choices=results["未分类"],
-            label="未分类",
-            interactive=True,
+
+    for name, tags in results.items():
+        instrument.count(f"matched:{name}", len(tags))
+
+    # 去重（字典键保持插入顺序）
+    return {name: list(tags) for name, tags in results.items()}
+
+
+def _match_tokens(
+    tokens, token_map, fuzzy_matcher, results, typo_matcher=None, corrections=None
+):
+    for part, raw_part in tokens:
+        category, tag, typo_hit = match_token(
+            part, raw_part, token_map, fuzzy_matcher, typo_matcher
         )
-    )
+        results[category][tag] = None
+        if typo_hit:
+            instrument.count("typo_corrected")
+            if corrections is not None:
+                corrections[part] = (tag, category, typo_hit)
 
-    return [*output, *new_tag_output_boxes, results, gr.Accordion(open=False)]
 
+def match_token(part, raw_part, token_map, fuzzy_matcher=None, typo_matcher=None):
+    """
+    返回 (分类名, 归入分类的写法, TypoMatch 或 None)：
+    依次尝试精确查找、拼写纠错、双向模糊匹配，都未命中时归入未分类
+    """
+    owner = token_map.get(raw_part)
+    if not owner and "\\" in part:
+        owner = token_map.get(prompt_tokenizer.literal_core(part))
+    if owner:
+        return owner[0], part, None
+    if typo_matcher:
+        typo_hit = typo_matcher.match(raw_part)
+        if typo_hit:
+            corrected = corrected_spelling(part, raw_part, typo_hit)
+            return typo_hit.owner[0], corrected, typo_hit
+    if fuzzy_matcher:
+        fuzzy_hit = fuzzy_matcher.match(raw_part)
+        if fuzzy_hit:
+            return fuzzy_hit[1][0], part, None
+
+    # 如果没有匹配任何类别，放入未分类
+    return "未分类", part, None
+
+
+def corrected_spelling(part, raw_part, typo_hit):
+    """保留权重等写法，只把提示词本身替换为纠正后的写法"""
+    corrected = part.replace(raw_part, typo_hit.word, 1)
+    return typo_hit.word if corrected == part else corrected
+
+
+def suggest_spellings(results, config, replace_underscore):
+    """
+    界面中的拼写纠错：只对未分类的提示词给出建议，不改写提示词也不移动分类。
+    返回 {原提示词: (建议写法, 分类名, TypoMatch)}；索引还在后台构建时返回 None
+    """
+    matcher = get_typo_matcher(config, replace_underscore, wait=False)
+    if matcher is None:
+        return None
+    suggestions = {}
+    with instrument.stage("typo"):
+        for tag in results["未分类"]:
+            raw_part = extract_core_word(tag)
+            typo_hit = matcher.match(raw_part)
+            if typo_hit:
+                corrected = corrected_spelling(tag, raw_part, typo_hit)
+                suggestions[tag] = (corrected, typo_hit.owner[0], typo_hit)
+    instrument.count("typo_suggested", len(suggestions))
+    return suggestions
+
+
+@instrument.timed("classify")
+def classify_prompt(
+    text, use_fuzzy, use_typo, use_semantic, replace_underscore, config, current_state
+):
+    import gradio as gr
+
+    print(f"正在处理：{len(re.split(',', text))}")
+
+    results = classify_text(text, use_fuzzy, replace_underscore, config)
+    notes = []
+    if use_typo:
+        suggestions = suggest_spellings(results, config, replace_underscore)
+        notes.append(typo_match.format_suggestions(suggestions))
+    if use_semantic:
+        if semantic_fallback.is_available():
+            proposals = apply_semantic_fallback(results, config)
+            notes.append(semantic_fallback.format_proposals(proposals))
+        else:
+            gr.Warning("未安装 NumPy，本地语义分类不可用（pip install numpy）")
+    # 重新分类也记入撤销历史
+    current_state.replace(results)
 
-# --- 2. 核心移动逻辑函数 ---
-def move_tags(*args):
+    return [
+        *render_classify_state(current_state, config),
+        current_state,
+        gr.Accordion(open=False),
+        "\n".join(note for note in notes if note),
+    ]
+
+
+def classify_live(session, text, use_fuzzy, use_typo, replace_underscore, config):
     """
-    将选中的标签从源分类移动到目标分类，并更新所有相关的UI组件。
+    增量分类：只重新分词、匹配编辑位置所在的片段，其余片段沿用 session 中的结果。
+    返回值与 classify_text 相同，另返回纠错记录。
     """
-    config = load_config()
-    destination_box = args[0]
-    current_state = args[1]
-    checkbox_group_values = args[2:]
+    fuzzy_matcher = typo_matcher = None
+    with instrument.stage("load_dictionary"):
+        token_map = get_token_map(config, replace_underscore)
+        if use_fuzzy:
+            fuzzy_matcher = get_fuzzy_matcher(config, replace_underscore)
+        if use_typo:
+            typo_matcher = get_typo_matcher(config, replace_underscore)
+
+    def match(part, raw_part):
+        return match_token(part, raw_part, token_map, fuzzy_matcher, typo_matcher)
+
+    with instrument.stage("match"):
+        session.update(
+            text,
+            (token_map, fuzzy_matcher, typo_matcher),
+            match,
+            config.get("extra_networks_category"),
+        )
+    instrument.count("segments_parsed", session.parsed)
+    instrument.count("segments_reused", session.reused)
+    with instrument.stage("merge"):
+        return session.results(category["name"] for category in config["categories"])
 
-    all_category_names = [cat["name"] for cat in config["categories"]] + ["未分类"]
 
-    # 将传入的 checkbox group 的值列表转换成字典，方便处理
-    items_to_move_from_any = dict(zip(all_category_names, checkbox_group_values))
+@instrument.timed("live_classify")
+def classify_prompt_live(
+    text, live, use_fuzzy, use_typo, replace_underscore, config, current_state, session
+):
+    """
+    输入时的实时分类，顺序为 [*output_boxes, *tag_boxes, tags_classify_state,
+    typo_box, live_session]；只发送内容有变化的分类组件
+    """
+    import gradio as gr
 
-    # 检查是否有项目被选中以及是否选择了目标
-    items_did_move = any(items_to_move_from_any.values())
-    if not destination_box or not items_did_move:
-        # 如果没有选择目标或没有选中任何项，则不进行任何操作，仅返回当前状态以刷新UI
-        # 这可以确保即使用户只是点击了移动按钮而没有选择任何东西，UI也能保持一致
-        output_box_values = []
-        for category in config["categories"]:
-            output_box_values.append(", ".join(current_state.get(category["name"], [])))
-        output_box_values.append(", ".join(current_state.get("未分类", [])))
+    if not live:
+        unchanged = [gr.update()] * (2 * len(get_slot_names(config)))
+        return [*unchanged, current_state, gr.update(), session]
 
-        tag_box_updates = []
-        for cat_name in all_category_names:
-            tag_box_updates.append(
-                gr.CheckboxGroup(value=[], choices=current_state.get(cat_name, []))
-            )
+    results, _ = classify_live(
+        session, text or "", use_fuzzy, False, replace_underscore, config
+    )
+    # 连续的实时分类只占一条撤销记录
+    changed = migrate_classify_state(current_state, config)
+    changed |= current_state.replace(results, coalesce=True)
+    notes = ""
+    if use_typo:
+        suggestions = suggest_spellings(results, config, replace_underscore)
+        notes = typo_match.format_suggestions(suggestions)
+    notes_update = gr.update() if notes == session.notes else notes
+    session.notes = notes
+    return [
+        *render_classify_state(current_state, config, changed),
+        current_state,
+        notes_update,
+        session,
+    ]
 
-        return (*output_box_values, *tag_box_updates, current_state)
 
-    # 复制当前状态以进行修改
-    new_state = {k: list(v) for k, v in current_state.items()}
+# --- 2. 核心移动逻辑函数 ---
+@instrument.timed("move")
+def move_tags(destination_box, current_state, config, *checkbox_group_values):
+    """
+    将选中的标签从源分类移动到目标分类，只更新发生变化的UI组件。
+    """
+    changed = migrate_classify_state(current_state, config)
 
-    for source_box, items_to_move in items_to_move_from_any.items():
-        if items_to_move:
-            # 从源框移除项目
-            if source_box in new_state:
-                new_state[source_box] = [
-                    item for item in new_state[source_box] if item not in items_to_move
-                ]
-            # 向目标框添加项目（避免重复添加）
-            if destination_box not in new_state:
-                new_state[destination_box] = []
+    # 将传入的 checkbox group 的值列表转换成字典，方便处理（跳过未使用的分类槽位）
+    items_to_move_from_any = {
+        name: values
+        for name, values in zip(get_slot_names(config), checkbox_group_values)
+        if name and values
+    }
 
-            for item in items_to_move:
-                if item not in new_state[destination_box]:
-                    new_state[destination_box].append(item)
+    # 检查是否有项目被选中以及是否选择了目标，否则不进行任何操作
+    if destination_box and items_to_move_from_any:
+        with instrument.stage("move"):
+            changed |= current_state.move(items_to_move_from_any, destination_box)
+        instrument.count(
+            "moved", sum(len(items) for items in items_to_move_from_any.values())
+        )
 
-    # 准备返回值来更新所有UI组件
     # 顺序必须与 move_button.click 的 outputs 列表完全匹配:
     # [*output_boxes, *tag_boxes, tags_classify_state]
+    # 执行了移动时，选中过提示词的分类即使内容不变（如移到自身所在的分类）也清空选中
+    if destination_box:
+        changed |= items_to_move_from_any.keys()
+    return (
+        *render_classify_state(current_state, config, changed),
+        current_state,
+    )
 
-    # 1. 更新 output_boxes (Textbox) 的值
-    output_box_values = []
-    for category in config["categories"]:
-        output_box_values.append(", ".join(new_state.get(category["name"], [])))
-    output_box_values.append(", ".join(new_state.get("未分类", [])))
-
-    # 2. 更新 tag_boxes (CheckboxGroup) 的选项和值
-    tag_box_updates = []
-    for cat_name in all_category_names:
-        tag_box_updates.append(
-            gr.CheckboxGroup(value=[], choices=new_state.get(cat_name, []))
-        )
 
-    # 3. 更新 tags_classify_state 的值
-    final_state = new_state
+# 界面中预先创建的分类组件槽位数：至少 MAX_CATEGORY_SLOTS 个，且在现有分类之外
+# 至少留出 SPARE_CATEGORY_SLOTS 个空槽位。增删分类只切换槽位的可见性，无需重启
+MAX_CATEGORY_SLOTS = 24
+SPARE_CATEGORY_SLOTS = 8
+_slot_count = MAX_CATEGORY_SLOTS
+
 
-    return (*output_box_values, *tag_box_updates, final_state)
+def get_slot_names(config):
+    """各槽位对应的分类名，未使用的槽位为 None，最后一个槽位是未分类"""
+    names = [category["name"] for category in config["categories"]]
+    return names + [None] * (_slot_count - len(names)) + ["未分类"]
+
+
+def render_classify_state(state, config, changed=None):
+    """
+    根据分类状态生成界面更新，顺序为 [*output_boxes, *tag_boxes]：
+    output_boxes (Textbox) 的文本值，tag_boxes (CheckboxGroup) 的选项（清空选中）。
+    传入 changed（状态修改方法返回的分类名集合）时只更新其中的分类，
+    其余返回 gr.update()。
+    """
+    import gradio as gr
+
+    with instrument.stage("build_ui"):
+        names = get_slot_names(config)
+        output_box_values = []
+        tag_box_updates = []
+        for name in names:
+            if changed is not None and name not in changed:
+                output_box_values.append(gr.update())
+                tag_box_updates.append(gr.update())
+                continue
+            tags = state.tags(name)
+            output_box_values.append(", ".join(tags))
+            tag_box_updates.append(gr.CheckboxGroup(value=[], choices=tags))
+        updated = len(names) if changed is None else len(changed)
+        instrument.count("updated_boxes", updated)
+    return [*output_box_values, *tag_box_updates]
+
+
+def render_category_layout(state, config):
+    """
+    分类增删、调整顺序后的界面更新，顺序为
+    [*category_accordions, *output_boxes, *tag_boxes,
+     destination_selector, exclude_checkboxes, category_selector, category_list_box]
+    """
+    import gradio as gr
+
+    with instrument.stage("build_ui"):
+        names = get_slot_names(config)
+        accordions = [
+            gr.Accordion(label=name or "", visible=name is not None)
+            for name in names[:-1]
+        ]
+        output_boxes = [
+            gr.Textbox(
+                value=", ".join(state.tags(name)),
+                label=name or "",
+                visible=name is not None,
+            )
+            for name in names
+        ]
+        tag_boxes = [
+            gr.CheckboxGroup(value=[], choices=state.tags(name)) for name in names
+        ]
+        category_names = [name for name in names[:-1] if name]
+    return [
+        *accordions,
+        *output_boxes,
+        *tag_boxes,
+        gr.Radio(choices=category_names + ["未分类"], value=None),
+        gr.CheckboxGroup(choices=category_names, value=[]),
+        gr.Dropdown(choices=category_names, value=None),
+        format_category_list(config),
+    ]
+
+
+def format_category_list(config):
+    return "\n".join(
+        f"{category['name']} ({category['path']})" for category in config["categories"]
+    )
 
 
 def save_unique(category_name, text_to_save, fast_save):
@@ -230,31 +989,25 @@ def save_unique(category_name, text_to_save, fast_save):
     text_to_save = ", ".join(text_to_save.split(","))
     text_to_save = text_to_save.replace("  ", " ")
 
-    # 判断文件是否存在
-    is_file_exists = os.path.exists(f"extract_{category_name}.txt")
-
-    if fast_save:
-        with open(f"extract_{category_name}.txt", "a", encoding="utf-8") as f:
-            f.write("" if not is_file_exists else "\n" + text_to_save)
-    else:
-        # 判断文件是否存在
-        if is_file_exists:
-            with open(f"extract_{category_name}.txt", "r", encoding="utf-8") as f:
-                existing = [line.strip() for line in f if line.strip()]
-        else:
-            existing = []
-
-        to_save = set(existing + [text_to_save])
-
-        with open(f"extract_{category_name}.txt", "w", encoding="utf-8") as f:
-            f.write("\n".join(to_save))
+    # 追加保存：查重只查内存中的摘要索引，不再整份读取和重写文件；
+    # 快速保存时跳过查重
+    with instrument.stage("save"):
+        written = extract_store.append_line(
+            f"extract_{category_name}.txt", text_to_save, dedupe=not fast_save
+        )
+    instrument.count("bytes_written", written)
+    instrument.count("lines_written" if written else "lines_skipped")
+    # 实际写入的行计入提示词统计
+    if written:
+        with instrument.stage("stats"):
+            tag_stats.record_line(category_name, text_to_save)
     return "保存成功！"
 
 
-def save_results(*args):
-    config = load_config()
-    fast_save = args[0]
-    output_boxes = args[1:-1]  # 排除最后一个未分类框
+@instrument.timed("save")
+def save_results(config, fast_save, *output_boxes):
+    """config 为当前会话的配置，按槽位对应的分类名保存"""
+    import gradio as gr
 
     # def save_unique(category_name, text_to_save):
     #     # 格式化文本
@@ -280,19 +1033,20 @@ def save_results(*args):
     #             f.write("\n".join(to_save))
     #     return "保存成功！"
 
-    for i, category in enumerate(config["categories"]):
-        save_unique(category["name"], output_boxes[i], fast_save)
+    # 最后一个槽位是未分类，不保存
+    for name, text in zip(get_slot_names(config)[:-1], output_boxes):
+        if name:
+            save_unique(name, text, fast_save)
 
     gr.Info("保存成功！")
 
     return "保存成功！"
 
 
-def save_results_exclude(*args):
-    config = load_config()
-    fast_save = args[0]
-    exclude_cats = args[1]
-    output_boxes = args[2:-1]  # 排除最后一个未分类框
+@instrument.timed("save_exclude")
+def save_results_exclude(config, fast_save, exclude_cats, *output_boxes):
+    """config 为当前会话的配置，按槽位对应的分类名取文本"""
+    import gradio as gr
 
     # def save_unique(category_name, text_to_save):
     #     # 格式化文本
@@ -320,9 +1074,9 @@ def save_results_exclude(*args):
 
     text_to_save = ""
 
-    for i, category in enumerate(config["categories"]):
-        if category["name"] not in exclude_cats:
-            text_to_save += output_boxes[i] + ","
+    for name, text in zip(get_slot_names(config)[:-1], output_boxes):
+        if name and name not in exclude_cats:
+            text_to_save += text + ","
 
     save_unique("exclude", text_to_save, fast_save)
 
@@ -333,12 +1087,22 @@ def save_results_exclude(*args):
 
 # --- UI界面 ---
 def create_ui(config):
+    import gradio as gr
+
+    global _slot_count
+    _slot_count = max(
+        MAX_CATEGORY_SLOTS, len(config["categories"]) + SPARE_CATEGORY_SLOTS
+    )
+    slot_names = get_slot_names(config)[:-1]
+    # 补全索引在后台预先构建，第一次按键不必等待
+    get_completion_index(config, wait=False)
+
     with gr.Blocks() as demo:
         config_state = gr.State(config)
-        _cats = [cat for cat in config["categories"] + [{"name": "未分类"}]]
-        tags_classify_state = gr.State(
-            {box_name: value for box_name, value in zip(_cats, [])}
-        )
+        # 会话配置对应的配置文件版本，落后时说明其他会话修改过 config.json
+        config_version_state = gr.State(config_version())
+        tags_classify_state = gr.State(ClassifyState())
+        live_session = gr.State(live_classify.LiveSession())
 
         with gr.Tabs():
             with gr.TabItem("分类区"):
@@ -356,6 +1120,9 @@ def create_ui(config):
                                 classify_btn = gr.Button(
                                     "初级分类", variant="primary", scale=1
                                 )
+                            completion_radio = gr.Radio(
+                                choices=[], label="补全建议（点击插入）"
+                            )
 
                         gr.Markdown("### 2. 提示词选择区")
                         with gr.Row():
@@ -369,8 +1136,12 @@ def create_ui(config):
                                     interactive=True,
                                 )
 
-                                for category in config["categories"]:
-                                    with gr.Accordion(category["name"], open=True):
+                                # 按槽位预先创建，未使用的槽位隐藏
+                                category_accordions = []
+                                for name in slot_names:
+                                    with gr.Accordion(
+                                        name or "", open=True, visible=name is not None
+                                    ) as accordion:
                                         tag_boxes.append(
                                             gr.CheckboxGroup(
                                                 value=[],
@@ -378,17 +1149,28 @@ def create_ui(config):
                                                 interactive=True,
                                             )
                                         )
+                                    category_accordions.append(accordion)
 
                             tag_boxes.append(unclassified_box)
 
+                        typo_box = gr.Textbox(
+                            label="拼写建议与语义分类（拼写纠错只给出建议，不改动提示词；语义分类为预测结果，请核对）",
+                            lines=2,
+                            interactive=False,
+                        )
+
                         gr.Markdown("### 3. 操作结果展示")
                         with gr.Accordion("文字操作区 (最终结果)", open=False):
                             output_boxes = []
                             with gr.Column(scale=1):
                                 unclassified_box = gr.Textbox(label="未分类", lines=3)
-                                for category in config["categories"]:
+                                for name in slot_names:
                                     output_boxes.append(
-                                        gr.Textbox(label=category["name"], lines=3)
+                                        gr.Textbox(
+                                            label=name or "",
+                                            lines=3,
+                                            visible=name is not None,
+                                        )
                                     )
                                 output_boxes.append(unclassified_box)
 
@@ -408,6 +1190,9 @@ def create_ui(config):
                         with gr.Row():
                             # 移动按钮
                             move_button = gr.Button("🚀 移动选中项", variant="primary")
+                        with gr.Row():
+                            undo_button = gr.Button("↩️ 撤销")
+                            redo_button = gr.Button("↪️ 重做")
 
                         gr.Markdown("### 5. 保存面板")
                         # 新添加：排除保存选项
@@ -433,6 +1218,11 @@ def create_ui(config):
                         with gr.Row():
                             with gr.Column(scale=1):
                                 ai_classify_btn = gr.Button("未分类部分进行AI分类")
+                                ai_commit_checkbox = gr.Checkbox(
+                                    value=False,
+                                    label="将AI分类结果写入分类词典",
+                                    info=f"追加到各分类目录下的 {AI_ADDED_FILE}",
+                                )
                                 ai_result_box = gr.Textbox(
                                     label="AI分类结果", interactive=True
                                 )
@@ -440,12 +1230,47 @@ def create_ui(config):
                                     label="操作结果", interactive=False
                                 )
 
+            with gr.TabItem("统计"):
+                with gr.Row():
+                    stats_category = gr.Dropdown(
+                        choices=[cat["name"] for cat in config["categories"]]
+                        + ["未分类", "exclude"],
+                        label="分类",
+                        allow_custom_value=True,
+                    )
+                    stats_month = gr.Dropdown(
+                        choices=["累计"],
+                        value="累计",
+                        label="月份",
+                        allow_custom_value=True,
+                    )
+                    stats_k = gr.Number(value=50, label="显示个数", precision=0)
+                    stats_top_btn = gr.Button("查询常用提示词")
+                with gr.Row():
+                    stats_tag = gr.Textbox(label="提示词", placeholder="例如：sitting")
+                    stats_neighbors_btn = gr.Button("查询共现提示词")
+                stats_result_box = gr.Textbox(
+                    label="查询结果（次数  提示词）", lines=20, interactive=False
+                )
+                with gr.Row():
+                    stats_rebuild_btn = gr.Button("从 extract 文件重建统计")
+
             with gr.TabItem("设置"):
                 with gr.Accordion("保存设置", open=True):
                     with gr.Row():
                         fuzzy_checkbox = gr.Checkbox(
                             label="双向模糊匹配",
-                            info="启用时：关键词互为子串即匹配（有BUG，不建议启用）",
+                            info="启用时：未精确匹配的提示词按词边界互为子串匹配，取重合最长的词典词",
+                        )
+                        typo_checkbox = gr.Checkbox(
+                            value=False,
+                            label="拼写纠错",
+                            info="启用时：对未分类的提示词按编辑距离给出拼写和单复数建议（不自动修改），索引在后台构建",
+                        )
+                        semantic_checkbox = gr.Checkbox(
+                            value=False,
+                            label="本地语义分类",
+                            info="启用时：仍未分类的提示词用词典训练的本地模型预测分类，置信度不低于 semantic_threshold 的预填到对应分类（需要 NumPy）",
                         )
                         replace_underscore_checkbox = gr.Checkbox(
                             value=True,
@@ -455,6 +1280,11 @@ def create_ui(config):
                         fast_save = gr.Checkbox(
                             value=False, label="快速保存", info="启用时：保存时不查重"
                         )
+                        live_checkbox = gr.Checkbox(
+                            value=True,
+                            label="输入时实时分类",
+                            info="启用时：停止输入后自动分类，只重新处理改动的提示词（本地语义分类仍需点击初级分类）",
+                        )
 
                 with gr.Accordion("AI分类设置", open=True):
                     with gr.Row():
@@ -476,6 +1306,23 @@ def create_ui(config):
                     with gr.Row():
                         save_ai_config_btn = gr.Button("保存AI配置")
 
+                with gr.Accordion("性能统计", open=False):
+                    with gr.Row():
+                        refresh_timings_btn = gr.Button("刷新最近一次耗时")
+                        profile_next_btn = gr.Button("下一次请求启用 cProfile")
+                    timings_box = gr.Textbox(
+                        label=f"各操作最近一次的分阶段耗时（完整记录见 {instrument.LOG_FILE}）",
+                        lines=15,
+                        interactive=False,
+                    )
+
+                with gr.Accordion("词典冲突检查", open=False):
+                    with gr.Row():
+                        check_conflicts_btn = gr.Button("检查跨分类重复提示词")
+                    conflict_report_box = gr.Textbox(
+                        label="冲突报告", lines=10, interactive=False
+                    )
+
                 with gr.Accordion("分类管理", open=True):
                     with gr.Row():
                         new_cat_name = gr.Textbox(
@@ -486,84 +1333,300 @@ def create_ui(config):
                         )
                         add_cat_btn = gr.Button("添加分类")
 
-                    gr.Markdown("---删除分类---")
-                    delete_buttons = []
-                    for i, category in enumerate(config["categories"]):
-                        with gr.Row():
-                            gr.Textbox(
-                                value=f"{category['name']} ({category['path']})",
-                                interactive=False,
-                                scale=3,
-                            )
-                            delete_buttons.append(
-                                gr.Button(f"删除 {category['name']}", scale=1)
-                            )
+                    gr.Markdown("---删除 / 调整分类---")
+                    with gr.Row():
+                        category_selector = gr.Dropdown(
+                            choices=[cat["name"] for cat in config["categories"]],
+                            label="选择分类",
+                            scale=3,
+                        )
+                        move_up_cat_btn = gr.Button("上移", scale=1)
+                        delete_cat_btn = gr.Button("删除", variant="stop", scale=1)
+                    category_list_box = gr.Textbox(
+                        value=format_category_list(config),
+                        label="当前分类（按顺序）",
+                        lines=5,
+                        interactive=False,
+                    )
 
         # --- 事件处理 ---
+        def warn_if_config_changed(version):
+            """其他会话修改过配置时提示刷新页面；本次操作仍按会话中的配置进行"""
+            if version != config_version():
+                gr.Warning("配置已被其他会话修改（如增删分类），请刷新页面以载入最新配置")
+
+        def classify_checked(version, *args):
+            warn_if_config_changed(version)
+            return classify_prompt(*args)
+
         classify_btn.click(
-            fn=classify_prompt,
+            fn=classify_checked,
             inputs=[
+                config_version_state,
                 input_text,
                 fuzzy_checkbox,
+                typo_checkbox,
+                semantic_checkbox,
                 replace_underscore_checkbox,
                 config_state,
+                tags_classify_state,
+            ],
+            outputs=[
+                *output_boxes,
+                *tag_boxes,
+                tags_classify_state,
+                input_accordion,
+                typo_box,
             ],
-            outputs=[*output_boxes, *tag_boxes, tags_classify_state, input_accordion],
+        )
+
+        # 勾选拼写纠错时就在后台开始构建索引，不在分类请求中等待
+        def warm_typo_matcher(enabled, replace_underscore, current_config):
+            if enabled:
+                get_typo_matcher(current_config, replace_underscore, wait=False)
+
+        typo_checkbox.change(
+            fn=warm_typo_matcher,
+            inputs=[typo_checkbox, replace_underscore_checkbox, config_state],
+            queue=False,
+            show_progress="hidden",
+        )
+
+        def warm_semantic_classifier(enabled, current_config):
+            if enabled:
+                get_semantic_classifier(current_config, wait=False)
+
+        semantic_checkbox.change(
+            fn=warm_semantic_classifier,
+            inputs=[semantic_checkbox, config_state],
+            queue=False,
+            show_progress="hidden",
         )
 
         move_button.click(
             fn=move_tags,
-            inputs=[destination_selector, tags_classify_state, *tag_boxes],
+            inputs=[
+                destination_selector,
+                tags_classify_state,
+                config_state,
+                *tag_boxes,
+            ],
+            outputs=[*output_boxes, *tag_boxes, tags_classify_state],
+        )
+
+        # 补全不经过排队，只处理最后一次按键
+        def suggest_completions(text, replace_underscore, current_config):
+            _, fragment = tag_complete.last_fragment(text or "")
+            if len(fragment.strip()) < 2:
+                return gr.Radio(choices=[], value=None)
+            index = get_completion_index(current_config, wait=False)
+            if index is None:
+                return gr.Radio(choices=[], value=None)
+            completions = index.complete(
+                fragment, tag_complete.DEFAULT_K, replace_underscore
+            )
+            return gr.Radio(
+                choices=[(f"{tag}（{category}）", tag) for tag, category in completions],
+                value=None,
+            )
+
+        def insert_completion(text, tag):
+            if not tag:
+                return gr.update(), gr.update()
+            return (
+                tag_complete.apply_completion(text or "", tag),
+                gr.Radio(choices=[], value=None),
+            )
+
+        input_text.input(
+            fn=suggest_completions,
+            inputs=[input_text, replace_underscore_checkbox, config_state],
+            outputs=completion_radio,
+            trigger_mode="always_last",
+            queue=False,
+            show_progress="hidden",
+        )
+        # 实时分类只处理最后一次改动，连续输入期间的中间状态直接跳过
+        input_text.change(
+            fn=classify_prompt_live,
+            inputs=[
+                input_text,
+                live_checkbox,
+                fuzzy_checkbox,
+                typo_checkbox,
+                replace_underscore_checkbox,
+                config_state,
+                tags_classify_state,
+                live_session,
+            ],
+            outputs=[
+                *output_boxes,
+                *tag_boxes,
+                tags_classify_state,
+                typo_box,
+                live_session,
+            ],
+            trigger_mode="always_last",
+            queue=False,
+            show_progress="hidden",
+        )
+        completion_radio.select(
+            fn=insert_completion,
+            inputs=[input_text, completion_radio],
+            outputs=[input_text, completion_radio],
+            queue=False,
+            show_progress="hidden",
+        )
+
+        def undo_move(current_state, current_config):
+            changed = current_state.undo()
+            changed |= migrate_classify_state(current_state, current_config)
+            return (
+                *render_classify_state(current_state, current_config, changed),
+                current_state,
+            )
+
+        def redo_move(current_state, current_config):
+            changed = current_state.redo()
+            changed |= migrate_classify_state(current_state, current_config)
+            return (
+                *render_classify_state(current_state, current_config, changed),
+                current_state,
+            )
+
+        undo_button.click(
+            fn=undo_move,
+            inputs=[tags_classify_state, config_state],
             outputs=[*output_boxes, *tag_boxes, tags_classify_state],
         )
+        redo_button.click(
+            fn=redo_move,
+            inputs=[tags_classify_state, config_state],
+            outputs=[*output_boxes, *tag_boxes, tags_classify_state],
+        )
+
+        def save_checked(version, *args):
+            warn_if_config_changed(version)
+            return save_results(*args)
+
+        def save_exclude_checked(version, *args):
+            warn_if_config_changed(version)
+            return save_results_exclude(*args)
 
         save_btn.click(
-            fn=save_results, inputs=[fast_save, *output_boxes], outputs=result_msg
+            fn=save_checked,
+            inputs=[config_version_state, config_state, fast_save, *output_boxes],
+            outputs=result_msg,
         )
 
         save_exclude_btn.click(
-            fn=save_results_exclude,
-            inputs=[fast_save, exclude_checkboxes, *output_boxes],
+            fn=save_exclude_checked,
+            inputs=[
+                config_version_state,
+                config_state,
+                fast_save,
+                exclude_checkboxes,
+                *output_boxes,
+            ],
             outputs=result_msg,
         )
 
-        def save_ai_config(api_key, base_url, system_prompt, model, current_config):
+        def query_top_tags(category, month, k):
+            start = time.perf_counter()
+            month = "" if month in (None, "", "累计") else month
+            rows = tag_stats.top_tags(category, int(k or 50), month)
+            elapsed = (time.perf_counter() - start) * 1000
+            months = ["累计"] + tag_stats.get_stats().months()
+            return (
+                f"{tag_stats.format_ranking(rows)}\n\n用时 {elapsed:.1f} ms",
+                gr.Dropdown(choices=months),
+            )
+
+        def query_neighbors(tag, k):
+            start = time.perf_counter()
+            rows = tag_stats.neighbors(tag, int(k or 50))
+            elapsed = (time.perf_counter() - start) * 1000
+            return f"{tag_stats.format_ranking(rows)}\n\n用时 {elapsed:.1f} ms"
+
+        def rebuild_tag_stats():
+            lines = tag_stats.rebuild()
+            return f"已从 extract 文件重建统计：{lines} 行"
+
+        stats_top_btn.click(
+            fn=query_top_tags,
+            inputs=[stats_category, stats_month, stats_k],
+            outputs=[stats_result_box, stats_month],
+        )
+        stats_neighbors_btn.click(
+            fn=query_neighbors, inputs=[stats_tag, stats_k], outputs=stats_result_box
+        )
+        stats_rebuild_btn.click(fn=rebuild_tag_stats, outputs=stats_result_box)
+
+        def save_ai_config(
+            api_key, base_url, system_prompt, model, current_config, version
+        ):
+            if version != config_version():
+                # 在最新配置上修改，不覆盖其他会话保存的分类等设置
+                current_config = copy.deepcopy(load_config())
             current_config["api_key"] = api_key
             current_config["base_url"] = base_url
             current_config["system_prompt"] = system_prompt
             current_config["model"] = model
             save_config(current_config)
             gr.Info("AI配置已保存！")
-            return current_config
-
-        def classify_with_ai(
-            api_key, base_url, system_prompt, model, unclassified_text
+            return current_config, config_version()
+
+        @instrument.timed("ai_classify")
+        async def classify_with_ai(
+            api_key,
+            base_url,
+            system_prompt,
+            model,
+            unclassified_text,
+            commit_to_dictionary,
+            current_state,
+            current_config,
         ):
+            # 出错或无内容时只更新结果框，其余组件保持不变
+            unchanged = [gr.update()] * (len(output_boxes) + len(tag_boxes) + 1)
             if not api_key or not base_url:
                 gr.Warning("API Key和Base URL不能为空！")
-                return ""
+                return "", *unchanged
             if not unclassified_text:
                 gr.Info("没有需要分类的内容。")
-                return ""
+                return "", *unchanged
 
-            client = openai.OpenAI(api_key=api_key, base_url=base_url)
+            import ai_classify
 
+            tags = [tag.strip() for tag in unclassified_text.split(",") if tag.strip()]
             try:
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {
-                            "role": "user",
-                            "content": f"请将以下内容进行分类：\n{unclassified_text}",
-                        },
-                    ],
-                    stream=False,
+                answers, stats = await ai_classify.classify_tags(
+                    tags, current_config, api_key, base_url, system_prompt, model
                 )
-                return response.choices[0].message.content
             except Exception as e:
                 gr.Error(f"AI分类失败：{e}")
-                return f"错误: {e}"
+                return f"错误: {e}", *unchanged
+
+            report = ai_classify.format_report(stats)
+            if commit_to_dictionary and answers:
+                by_category = {}
+                for tag, category in answers.items():
+                    by_category.setdefault(category, []).append(extract_core_word(tag))
+                committed = sum(
+                    len(add_words_to_category(current_config, category, words))
+                    for category, words in by_category.items()
+                )
+                report += f"，已写入分类词典 {committed} 个"
+            print(report)
+            gr.Info(report)
+
+            changed = current_state.apply_answers(answers)
+            result = json.dumps(answers, ensure_ascii=False, indent=2)
+            return (
+                f"{result}\n\n{report}",
+                *render_classify_state(current_state, current_config, changed),
+                current_state,
+            )
 
         save_ai_config_btn.click(
             fn=save_ai_config,
@@ -573,8 +1636,9 @@ def create_ui(config):
                 system_prompt_box,
                 model_box,
                 config_state,
+                config_version_state,
             ],
-            outputs=[config_state],
+            outputs=[config_state, config_version_state],
         )
 
         ai_classify_btn.click(
@@ -585,48 +1649,249 @@ def create_ui(config):
                 system_prompt_box,
                 model_box,
                 unclassified_box,
+                ai_commit_checkbox,
+                tags_classify_state,
+                config_state,
             ],
-            outputs=[ai_result_box],
+            outputs=[ai_result_box, *output_boxes, *tag_boxes, tags_classify_state],
+        )
+
+        refresh_timings_btn.click(
+            fn=instrument.format_last_runs, inputs=[], outputs=[timings_box]
         )
 
-        def add_category_and_reload(name, path, current_config):
+        def profile_next_request():
+            instrument.request_profile()
+            gr.Info("下一次分类/移动/保存/AI分类将在 cProfile 下执行")
+
+        profile_next_btn.click(fn=profile_next_request, inputs=[], outputs=[])
+
+        def check_conflicts(replace_underscore, current_config):
+            conflicts = find_category_conflicts(current_config, replace_underscore)
+            return format_conflict_report(conflicts)
+
+        check_conflicts_btn.click(
+            fn=check_conflicts,
+            inputs=[replace_underscore_checkbox, config_state],
+            outputs=[conflict_report_box],
+        )
+
+        # 分类增删、调整顺序后需要刷新的组件，顺序与 render_category_layout 一致
+        category_layout_outputs = [
+            *category_accordions,
+            *output_boxes,
+            *tag_boxes,
+            destination_selector,
+            exclude_checkboxes,
+            category_selector,
+            category_list_box,
+        ]
+
+        def apply_category_change(old_config, current_config, current_state):
+            """保存配置、增量更新词典索引并迁移分类状态，不重启应用"""
+            save_config(current_config)
+            with instrument.stage("update_index"):
+                update_category_index(old_config, current_config)
+            migrate_classify_state(current_state, current_config)
+            return [
+                current_config,
+                config_version(),
+                current_state,
+                *render_category_layout(current_state, current_config),
+            ]
+
+        def reload_session_config(current_config, version, current_state, warn=True):
+            """
+            会话配置落后于 config.json 时载入最新配置并刷新分类组件，返回界面更新；
+            未落后时返回 None。分类数超过界面槽位时只提示重启
+            """
+            if version == config_version():
+                return None
+            latest = copy.deepcopy(load_config())
+            if len(latest["categories"]) > _slot_count:
+                gr.Warning("其他会话添加的分类超过了界面预留的槽位，请重启应用")
+                return [gr.update()] * (len(category_layout_outputs) + 3)
+            if warn:
+                gr.Warning("配置已被其他会话修改，已载入最新配置，请确认后重新操作")
+            migrate_classify_state(current_state, latest)
+            return [
+                latest,
+                config_version(),
+                current_state,
+                *render_category_layout(current_state, latest),
+            ]
+
+        def copy_config(current_config):
+            return {**current_config, "categories": list(current_config["categories"])}
+
+        @instrument.timed("add_category")
+        def add_category_and_reload(
+            name, path, current_config, version, current_state
+        ):
+            unchanged = [gr.update()] * (len(category_layout_outputs) + 5)
+            reloaded = reload_session_config(current_config, version, current_state)
+            if reloaded:
+                return [*reloaded, gr.update(), gr.update()]
+            name, path = name.strip(), path.strip()
             if not name or not path:
                 gr.Warning("分类名称和路径不能为空！")
-                return current_config, gr.update(), gr.update()
+                return unchanged
+            if name == "未分类" or any(
+                cat["name"] == name for cat in current_config["categories"]
+            ):
+                gr.Warning(f"分类 {name} 已存在！")
+                return unchanged
+
+            if len(current_config["categories"]) >= _slot_count:
+                # 槽位已用完时不重启应用（会中断所有会话），由用户重启后再添加
+                gr.Warning(
+                    f"界面预留的 {_slot_count} 个分类槽位已用完，"
+                    "请重启应用（会按现有分类数重新预留槽位）后再添加"
+                )
+                return unchanged
+
+            old_config = copy_config(current_config)
             current_config["categories"].append({"name": name, "path": path})
-            save_config(current_config)
-            gr.Info("已成功，请重启整个应用")
-            restart_app()
-            return current_config, "", ""
+            gr.Info(f"已添加分类 {name}")
+            return [
+                *apply_category_change(old_config, current_config, current_state),
+                "",
+                "",
+            ]
 
         add_cat_btn.click(
             fn=add_category_and_reload,
-            inputs=[new_cat_name, new_cat_path, config_state],
-            outputs=[config_state, new_cat_name, new_cat_path],
+            inputs=[
+                new_cat_name,
+                new_cat_path,
+                config_state,
+                config_version_state,
+                tags_classify_state,
+            ],
+            outputs=[
+                config_state,
+                config_version_state,
+                tags_classify_state,
+                *category_layout_outputs,
+                new_cat_name,
+                new_cat_path,
+            ],
         )
 
-        def delete_category_and_reload(index_to_delete, current_config):
-            # 使用 gr.State 的 .value 属性来获取最新值
-            current_config["categories"].pop(index_to_delete)
-            save_config(current_config)
-            gr.Info("已成功，请重启整个应用")
-            restart_app()
-            return current_config
-
-        for i, btn in enumerate(delete_buttons):
-            # 使用 functools.partial 来正确捕获循环变量
-            from functools import partial
-
-            btn.click(
-                fn=partial(delete_category_and_reload, i),
-                inputs=[config_state],
-                outputs=[config_state],
+        @instrument.timed("delete_category")
+        def delete_category_and_reload(name, current_config, version, current_state):
+            reloaded = reload_session_config(current_config, version, current_state)
+            if reloaded:
+                return reloaded
+            names = [cat["name"] for cat in current_config["categories"]]
+            if name not in names:
+                gr.Warning("请先选择要删除的分类！")
+                return [gr.update()] * (len(category_layout_outputs) + 3)
+
+            old_config = copy_config(current_config)
+            current_config["categories"].pop(names.index(name))
+            if name in current_config.get("category_priority", []):
+                current_config["category_priority"] = [
+                    n for n in current_config["category_priority"] if n != name
+                ]
+            gr.Info(f"已删除分类 {name}，其中的提示词已移入未分类")
+            return apply_category_change(old_config, current_config, current_state)
+
+        delete_cat_btn.click(
+            fn=delete_category_and_reload,
+            inputs=[
+                category_selector,
+                config_state,
+                config_version_state,
+                tags_classify_state,
+            ],
+            outputs=[
+                config_state,
+                config_version_state,
+                tags_classify_state,
+                *category_layout_outputs,
+            ],
+        )
+
+        @instrument.timed("move_category")
+        def move_category_up(name, current_config, version, current_state):
+            reloaded = reload_session_config(current_config, version, current_state)
+            if reloaded:
+                return reloaded
+            names = [cat["name"] for cat in current_config["categories"]]
+            if name not in names or names.index(name) == 0:
+                return [gr.update()] * (len(category_layout_outputs) + 3)
+
+            old_config = copy_config(current_config)
+            categories = current_config["categories"]
+            i = names.index(name)
+            categories[i - 1], categories[i] = categories[i], categories[i - 1]
+            updates = apply_category_change(old_config, current_config, current_state)
+            # 保持下拉框选中当前分类，便于连续上移
+            updates[-2] = gr.Dropdown(
+                choices=[category["name"] for category in categories], value=name
             )
+            return updates
+
+        move_up_cat_btn.click(
+            fn=move_category_up,
+            inputs=[
+                category_selector,
+                config_state,
+                config_version_state,
+                tags_classify_state,
+            ],
+            outputs=[
+                config_state,
+                config_version_state,
+                tags_classify_state,
+                *category_layout_outputs,
+            ],
+        )
+
+        def refresh_on_load(current_config, version, current_state):
+            # 新打开的页面拿到的是启动时的配置，其间被修改过时静默载入最新配置
+            reloaded = reload_session_config(
+                current_config, version, current_state, warn=False
+            )
+            return reloaded or [gr.update()] * (len(category_layout_outputs) + 3)
+
+        demo.load(
+            fn=refresh_on_load,
+            inputs=[config_state, config_version_state, tags_classify_state],
+            outputs=[
+                config_state,
+                config_version_state,
+                tags_classify_state,
+                *category_layout_outputs,
+            ],
+        )
 
     return demo
 
 
+# 命令行子命令：python main.py <命令> [参数]，值为实现该命令的模块
+COMMANDS = {
+    "classify": "batch",
+    "build-dict": "dict_artifact",
+    "dataset": "dataset",
+    "images": "image_meta",
+    "stats": "tag_stats",
+    "serve": "api_server",
+    "promote": "promote",
+}
+
+
 if __name__ == "__main__":
+    # 其他模块 import main 时复用当前模块，保证词典索引等状态只有一份
+    sys.modules.setdefault("main", sys.modules["__main__"])
+
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        import importlib
+
+        command = importlib.import_module(COMMANDS[sys.argv[1]])
+        sys.exit(command.main(sys.argv[2:]))
+
     config = load_config()
     demo = create_ui(config)
     demo.launch()
@@ -0,0 +1,310 @@
+"""把 extract_*.txt 中保存的提示词批量并入分类词典
+
+用法：
+    python main.py promote [--categories Clothes,Poses] [--min-count 2] [--dry-run]
+
+extract_{分类}.txt 的每一行是保存时整条逗号分隔的提示词。逐行分词后按
+extract_core_word 的规则取核心词，按"识别空格类提示词"的设置规范化
+（默认按空格形式比较，--no-replace-underscore 时按下划线形式比较），
+与所有分类目录中的词典去重，新提示词排序后写入各分类目录下的 --file
+（默认 promoted.txt，已有时合并），写入形式与 AI 分类结果相同（下划线形式）。
+
+为支持 GB 级的历史记录，统计采用外部排序：每读满 --chunk-size 个不同的
+(提示词, 分类) 就排序写出一个临时有序段，最后用 heapq.merge 多路归并，
+内存占用只与 --chunk-size 和词典大小有关。有序段超过 MERGE_FAN_IN 个时先分轮合并。
+
+每个提示词归为以下一种，写入报告（--report，制表符分隔，按提示词排序）：
+    new        不在词典中，且只出现在一个分类的 extract 中 → 写入该分类
+    known      已在词典中，且词典分类与 extract 分类一致
+    dictionary 已在词典中，但词典分类与 extract 分类不同（冲突，不写入）
+    conflict   出现在多个分类的 extract 中（冲突，不写入）
+    rare       新提示词，但出现次数少于 --min-count（不写入）
+"""
+
+import argparse
+import contextlib
+import functools
+import heapq
+import os
+import tempfile
+import time
+from collections import Counter
+
+import main as core
+import prompt_tokenizer
+
+PROMOTED_FILE = "promoted.txt"
+REPORT_FILE = "promote_report.tsv"
+DEFAULT_CHUNK_SIZE = 500_000
+MERGE_FAN_IN = 64
+
+STATUSES = ("new", "known", "dictionary", "conflict", "rare")
+
+
+def tag_key(core_word, replace_underscore=True):
+    """核心词 → 去重用的比较形式（与 get_token_map 的键相同）"""
+    if replace_underscore:
+        return core_word.replace("_", " ")
+    return core_word.replace(" ", "_")
+
+
+def iter_extract_tags(path, replace_underscore=True):
+    """逐行读取 extract 文件，产出每行去重后的提示词比较形式"""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            keys = {}
+            for token in prompt_tokenizer.tokenize(line):
+                if token.kind == prompt_tokenizer.KIND_EXTRA_NETWORK:
+                    continue
+                if token.kind in prompt_tokenizer.SYNTAX_KINDS:
+                    continue
+                key = tag_key(token.core, replace_underscore)
+                if key:
+                    keys[key] = None
+            yield from keys
+
+
+def _write_run(counts, directory):
+    """把一块 {(提示词, 分类): 次数} 排序写成临时有序段，返回文件路径"""
+    fd, path = tempfile.mkstemp(suffix=".run", dir=directory)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        for (key, category), count in sorted(counts.items()):
+            f.write(f"{key}\t{category}\t{count}\n")
+    return path
+
+
+def _read_run(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            key, category, count = line.rstrip("\n").split("\t")
+            yield key, category, int(count)
+
+
+def _merge_sorted(runs):
+    """多路归并有序段，相同 (提示词, 分类) 的次数相加"""
+    merged = heapq.merge(*(_read_run(path) for path in runs))
+    current = None
+    total = 0
+    for key, category, count in merged:
+        if (key, category) != current:
+            if current is not None:
+                yield current[0], current[1], total
+            current = (key, category)
+            total = 0
+        total += count
+    if current is not None:
+        yield current[0], current[1], total
+
+
+def _merge_runs(runs, directory):
+    """有序段过多时分轮合并，直到不超过 MERGE_FAN_IN 个"""
+    while len(runs) > MERGE_FAN_IN:
+        next_runs = []
+        for i in range(0, len(runs), MERGE_FAN_IN):
+            group = runs[i : i + MERGE_FAN_IN]
+            fd, path = tempfile.mkstemp(suffix=".run", dir=directory)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for key, category, count in _merge_sorted(group):
+                    f.write(f"{key}\t{category}\t{count}\n")
+            for old in group:
+                os.remove(old)
+            next_runs.append(path)
+        runs = next_runs
+    return runs
+
+
+def sorted_tag_counts(sources, directory, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    sources: [(分类名, 提示词迭代器)]
+    按提示词排序产出 (提示词, {分类名: 次数})，内存中最多保留 chunk_size 个计数
+    """
+    runs = []
+    counts = Counter()
+    for category, keys in sources:
+        for key in keys:
+            counts[(key, category)] += 1
+            if len(counts) >= chunk_size:
+                runs.append(_write_run(counts, directory))
+                counts = Counter()
+    if counts:
+        runs.append(_write_run(counts, directory))
+    runs = _merge_runs(runs, directory)
+
+    current = None
+    by_category = {}
+    for key, category, count in _merge_sorted(runs):
+        if key != current:
+            if current is not None:
+                yield current, by_category
+            current = key
+            by_category = {}
+        by_category[category] = count
+    if current is not None:
+        yield current, by_category
+
+
+def classify_tag(key, by_category, token_map, min_count=1):
+    """返回 (状态, 词典分类名或 None)，状态见模块说明"""
+    owner = token_map.get(key)
+    if owner:
+        if set(by_category) == {owner[0]}:
+            return "known", owner[0]
+        return "dictionary", owner[0]
+    if len(by_category) > 1:
+        return "conflict", None
+    if sum(by_category.values()) < min_count:
+        return "rare", None
+    return "new", None
+
+
+def write_additions(folder, filename, words, replace_underscore=True):
+    """
+    把新词与 folder/filename 中已有的词归并后写回（先写临时文件再替换）。
+    words 须按比较形式（tag_key）排序，写出的文件也按比较形式排序。
+    """
+    key = functools.partial(tag_key, replace_underscore=replace_underscore)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, filename)
+    existing = []
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            existing = sorted({line.strip() for line in f if line.strip()}, key=key)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for word in heapq.merge(existing, words, key=key):
+            f.write(word + "\n")
+    os.replace(tmp_path, path)
+
+
+def promote(
+    config,
+    categories=None,
+    replace_underscore=True,
+    min_count=1,
+    filename=PROMOTED_FILE,
+    report_path=REPORT_FILE,
+    dry_run=False,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    tmp_dir=None,
+):
+    """
+    返回 {"tags": {状态: 个数}, "added": {分类名: 新增个数}, "occurrences": 提示词出现次数}
+    """
+    selected = [
+        category
+        for category in config["categories"]
+        if not categories or category["name"] in categories
+    ]
+    token_map = core.get_token_map(config, replace_underscore)
+    summary = {
+        "tags": dict.fromkeys(STATUSES, 0),
+        "added": {category["name"]: 0 for category in selected},
+        "occurrences": 0,
+    }
+
+    def read(path):
+        print(f"正在读取：{path}")
+        for key in iter_extract_tags(path, replace_underscore):
+            summary["occurrences"] += 1
+            yield key
+
+    sources = []
+    for category in selected:
+        path = f"extract_{category['name']}.txt"
+        if os.path.exists(path):
+            sources.append((category["name"], read(path)))
+
+    with contextlib.ExitStack() as stack:
+        directory = stack.enter_context(tempfile.TemporaryDirectory(dir=tmp_dir))
+        # 新词按分类先写入临时文件（已按提示词排序），全部归并完后再写入词典
+        additions = {}
+        with open(report_path, "w", encoding="utf-8") as report:
+            report.write("状态\t提示词\textract 次数\t词典分类\n")
+            for key, by_category in sorted_tag_counts(sources, directory, chunk_size):
+                status, owner = classify_tag(key, by_category, token_map, min_count)
+                summary["tags"][status] += 1
+                counts = ",".join(f"{name}:{n}" for name, n in by_category.items())
+                report.write(f"{status}\t{key}\t{counts}\t{owner or ''}\n")
+                if status != "new":
+                    continue
+                (name,) = by_category
+                if name not in additions:
+                    additions[name] = stack.enter_context(
+                        open(
+                            os.path.join(directory, f"{len(additions)}.add"),
+                            "w+",
+                            encoding="utf-8",
+                        )
+                    )
+                additions[name].write(key.replace(" ", "_") + "\n")
+                summary["added"][name] += 1
+
+        if not dry_run:
+            for category in selected:
+                handle = additions.get(category["name"])
+                if handle is None:
+                    continue
+                handle.seek(0)
+                words = (line.rstrip("\n") for line in handle)
+                write_additions(category["path"], filename, words, replace_underscore)
+    return summary
+
+
+def format_summary(summary, filename, dry_run):
+    tags = summary["tags"]
+    lines = [
+        f"共 {sum(tags.values())} 个不同的提示词（{summary['occurrences']} 次出现）：",
+        f"  新提示词 {tags['new']}，已在词典中 {tags['known']}，"
+        f"与词典分类冲突 {tags['dictionary']}，跨分类冲突 {tags['conflict']}，"
+        f"次数不足 {tags['rare']}",
+    ]
+    action = "将写入" if dry_run else "已写入"
+    for name, count in summary["added"].items():
+        if count:
+            lines.append(f"  {name}：{action} {count} 个新提示词到 {filename}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python main.py promote", description="把 extract 文件中的提示词并入分类词典"
+    )
+    parser.add_argument("--categories", help="只处理这些分类，逗号分隔；默认全部")
+    parser.add_argument(
+        "--min-count", type=int, default=1, help="新提示词至少出现的次数"
+    )
+    parser.add_argument(
+        "--file", default=PROMOTED_FILE, help="各分类目录下写入新提示词的文件名"
+    )
+    parser.add_argument("--report", default=REPORT_FILE, help="报告文件路径")
+    parser.add_argument(
+        "--no-replace-underscore",
+        dest="replace_underscore",
+        action="store_false",
+        help="按下划线类提示词进行去重",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="只生成报告，不写词典")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="内存中最多保留的不同 (提示词, 分类) 个数，超过后写出临时有序段",
+    )
+    parser.add_argument("--tmp-dir", help="临时有序段所在目录，默认系统临时目录")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    summary = promote(
+        core.load_config(),
+        categories=args.categories.split(",") if args.categories else None,
+        replace_underscore=args.replace_underscore,
+        min_count=args.min_count,
+        filename=args.file,
+        report_path=args.report,
+        dry_run=args.dry_run,
+        chunk_size=args.chunk_size,
+        tmp_dir=args.tmp_dir,
+    )
+    print(format_summary(summary, args.file, args.dry_run))
+    print(f"报告：{args.report}，用时 {time.perf_counter() - start:.1f} 秒")
+    return 0
@@ -0,0 +1,321 @@
+"""A1111 提示词分词
+
+tokenize(text) 线性扫描一次提示词，产出 Token(raw, core, weight, kind)：
+    raw     原文片段；若外层括号只包裹这一个提示词，则包含这些括号，如 "(smile:1.2)"
+    core    用于查词典的核心词：去掉括号、权重和转义符
+    weight  累计权重：( ) ×1.1，{ } ×1.05，[ ] ÷1.1，(x:1.3) 为显式权重
+    kind    语法类型，见下方 KIND_* 常量
+
+支持的语法：逗号/换行分隔、嵌套括号 "((a:1.2), b)"、转义 "\\(" "\\)"、
+"<lora:name:0.8>" 等额外网络、BREAK、AND、交替 "[a|b]"、调度 "[a:b:10]" "[a:10]"。
+"""
+
+import functools
+import re
+from collections import namedtuple
+
+Token = namedtuple("Token", "raw core weight kind")
+
+KIND_TAG = "tag"
+KIND_SCHEDULE = "schedule"  # [a:b:10] 中的 a、b
+KIND_ALTERNATE = "alternate"  # [a|b] 中的 a、b
+KIND_EXTRA_NETWORK = "extra_network"  # <lora:name:0.8>、<hypernet:name:1> 等
+KIND_BREAK = "break"
+KIND_AND = "and"
+
+# 这些类型只是语法标记，不参与分类
+SYNTAX_KINDS = (KIND_BREAK, KIND_AND)
+
+_BRACKETS = {"(": ")", "[": "]", "{": "}"}
+_CLOSERS = {")": "(", "]": "[", "}": "{"}
+# 一次扫描切出：普通文本（含转义字符）、额外网络、单个语法字符
+_SCAN_RE = re.compile(
+    r"(?P<text>(?:\\.|[^\\()\[\]{},|:\n<])+)"
+    r"|(?P<extra><(\w+):([^<>:]+)(?::([^<>]*))?>)"
+    r"|(?P<single>[\s\S])"
+)
+_KEYWORD_RE = re.compile(r"\b(BREAK|AND)\b")
+_CHUNK_RE = re.compile(r"(?:\\.|[^,\n])+")
+_SYNTAX_RE = re.compile(r"[()\[\]{}<\\]|\bBREAK\b|\bAND\b")
+_NUMBER_RE = re.compile(r"\s*[-+]?(?:\d+\.?\d*|\.\d+)\s*")
+_WEIGHT_RE = re.compile(r":\s*[-+]?(?:\d+\.?\d*|\.\d+)\s*$")
+_ESCAPE_RE = re.compile(r"\\(.)")
+
+
+@functools.lru_cache(maxsize=65536)
+def normalize_core(raw, unescape=True):
+    """原文片段 → 核心词：去掉外层括号、末尾权重和转义符，合并空白"""
+    core = raw.strip()
+    while len(core) > 1 and core[0] in _BRACKETS and core[-1] == _BRACKETS[core[0]]:
+        core = core[1:-1].strip()
+    core = _WEIGHT_RE.sub("", core)
+    if unescape:
+        core = _ESCAPE_RE.sub(r"\1", core)
+    return " ".join(core.split())
+
+
+def literal_core(raw):
+    """
+    保留转义符的核心词。词典中有本身带反斜杠的提示词（如 \\m/、\\(^o^)/），
+    按 core 查找未命中时再用它查一次
+    """
+    return normalize_core(raw, unescape=False)
+
+
+def _parse(text, start, end):
+    """
+    把提示词解析成嵌套的条目列表，条目为：
+        ("text", 起, 止) / ("sep", 位置, 字符) / ("extra", 起, 止, 匹配)
+        ("group", 起, 止, 左括号, 子条目)
+    """
+    root = []
+    stack = [(None, 0, root)]
+    items = root
+    text_start = -1
+    for piece in _SCAN_RE.finditer(text, start, end):
+        kind = piece.lastgroup
+        position = piece.start()
+        if kind == "single":
+            ch = piece.group()
+            if ch in _CLOSERS:
+                # 不配对的右括号按普通字符处理
+                if stack[-1][0] != _CLOSERS[ch]:
+                    kind = "text"
+            elif ch not in _BRACKETS and ch not in ",|:\n":
+                kind = "text"
+        if kind == "text":
+            if text_start < 0:
+                text_start = position
+            continue
+
+        if text_start >= 0:
+            items.append(("text", text_start, position))
+            text_start = -1
+        if kind == "extra":
+            items.append(("extra", position, piece.end(), piece))
+            continue
+        ch = piece.group()
+        if ch in _BRACKETS:
+            items = []
+            stack.append((ch, position, items))
+        elif ch in _CLOSERS:
+            open_char, group_start, group_items = stack.pop()
+            items = stack[-1][2]
+            items.append(("group", group_start, position + 1, open_char, group_items))
+        else:
+            items.append(("sep", position, ch))
+
+    if text_start >= 0:
+        items.append(("text", text_start, end))
+    # 未闭合的括号延伸到末尾
+    while len(stack) > 1:
+        open_char, group_start, group_items = stack.pop()
+        stack[-1][2].append(("group", group_start, end, open_char, group_items))
+    return root
+
+
+def _has_keyword(text, start, end):
+    return text.find("BREAK", start, end) >= 0 or text.find("AND", start, end) >= 0
+
+
+def _span(item):
+    return item[1], item[1] + 1 if item[0] == "sep" else item[2]
+
+
+class _Walker:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = []
+
+    def _is_blank(self, item):
+        return item[0] == "text" and not self.text[item[1] : item[2]].strip()
+
+    def _is_number(self, item):
+        return item[0] == "text" and _NUMBER_RE.fullmatch(
+            self.text, item[1], item[2]
+        )
+
+    def walk(self, items, weight, kind):
+        """按逗号、换行以及 BREAK/AND 切分为片段"""
+        segment = []
+        for item in items:
+            if item[0] == "sep" and item[2] in ",\n":
+                self.segment(segment, weight, kind)
+                segment = []
+            elif item[0] == "text" and _has_keyword(self.text, item[1], item[2]):
+                start, end = item[1], item[2]
+                chunk = self.text[start:end]
+                position = start
+                for match in _KEYWORD_RE.finditer(chunk):
+                    if match.start() + start > position:
+                        segment.append(("text", position, match.start() + start))
+                    self.segment(segment, weight, kind)
+                    segment = []
+                    keyword = match.group(1)
+                    self.tokens.append(
+                        Token(
+                            keyword,
+                            "",
+                            weight,
+                            KIND_BREAK if keyword == "BREAK" else KIND_AND,
+                        )
+                    )
+                    position = match.end() + start
+                if position < end:
+                    segment.append(("text", position, end))
+            else:
+                segment.append(item)
+        self.segment(segment, weight, kind)
+
+    def segment(self, items, weight, kind):
+        meaningful = [item for item in items if not self._is_blank(item)]
+        if not meaningful:
+            return
+        if len(meaningful) == 1 and meaningful[0][0] == "group":
+            self.group(meaningful[0], weight, kind)
+            return
+        if len(meaningful) == 1 and meaningful[0][0] == "extra":
+            _, start, end, match = meaningful[0]
+            extra_weight = 1.0
+            if match.group(5) and _NUMBER_RE.fullmatch(match.group(5)):
+                extra_weight = float(match.group(5))
+            self.tokens.append(
+                Token(
+                    self.text[start:end],
+                    match.group(4).strip(),
+                    extra_weight,
+                    KIND_EXTRA_NETWORK,
+                )
+            )
+            return
+
+        start = _span(meaningful[0])[0]
+        end = _span(meaningful[-1])[1]
+        raw = self.text[start:end].strip()
+        core = normalize_core(raw)
+        if core:
+            self.tokens.append(Token(raw, core, weight, kind))
+
+    def _split(self, items, char):
+        parts = [[]]
+        for item in items:
+            if item[0] == "sep" and item[2] == char:
+                parts.append([])
+            else:
+                parts[-1].append(item)
+        return parts
+
+    def group(self, group, weight, kind):
+        _, start, end, open_char, items = group
+        before = len(self.tokens)
+        meaningful = [item for item in items if not self._is_blank(item)]
+
+        if open_char == "(":
+            if (
+                len(meaningful) >= 2
+                and meaningful[-2][0] == "sep"
+                and meaningful[-2][2] == ":"
+                and self._is_number(meaningful[-1])
+            ):
+                # (tag:1.3) 显式权重
+                explicit = float(self.text[meaningful[-1][1] : meaningful[-1][2]])
+                colon = items.index(meaningful[-2])
+                self.walk(items[:colon], weight * explicit, kind)
+            else:
+                self.walk(items, weight * 1.1, kind)
+        elif open_char == "{":
+            self.walk(items, weight * 1.05, kind)
+        else:
+            colons = [
+                i
+                for i, item in enumerate(meaningful)
+                if item[0] == "sep" and item[2] == ":"
+            ]
+            pipes = any(item[0] == "sep" and item[2] == "|" for item in meaningful)
+            if colons and colons[-1] == len(meaningful) - 2 and self._is_number(
+                meaningful[-1]
+            ):
+                # [a:b:10] / [a:10] / [:b:10] 调度语法
+                for part in self._split(meaningful[: colons[-1]], ":"):
+                    self.walk(part, weight, KIND_SCHEDULE)
+            elif pipes:
+                for part in self._split(meaningful, "|"):
+                    self.walk(part, weight, KIND_ALTERNATE)
+            else:
+                self.walk(items, weight / 1.1, kind)
+
+        if len(self.tokens) - before == 1 and self.tokens[-1].kind not in SYNTAX_KINDS:
+            # 括号只包裹一个提示词时，原文保留括号以便保存时不丢失权重
+            self.tokens[-1] = self.tokens[-1]._replace(raw=self.text[start:end])
+
+
+@functools.lru_cache(maxsize=16384)
+def _tokenize_chunk(chunk):
+    walker = _Walker(chunk)
+    walker.walk(_parse(chunk, 0, len(chunk)), 1.0, KIND_TAG)
+    return tuple(walker.tokens)
+
+
+def _push_brackets(piece, stack):
+    """按 piece 中的括号更新未闭合括号栈（忽略转义和不配对的右括号）"""
+    if "\\" in piece:
+        piece = _ESCAPE_RE.sub("", piece)
+    for ch in piece:
+        if ch in _BRACKETS:
+            stack.append(ch)
+        elif ch in _CLOSERS and stack and stack[-1] == _CLOSERS[ch]:
+            stack.pop()
+
+
+@functools.lru_cache(maxsize=65536)
+def is_segment(chunk):
+    """含语法字符的块中括号全部闭合、在 segments() 中单独成为一个片段时为真"""
+    stack = []
+    _push_brackets(chunk, stack)
+    return not stack
+
+
+def segments(text, start=0):
+    """
+    从 start 起按逗号/换行切出顶层片段，产出 (起, 止, 是否为纯文本)。
+    含括号等语法字符的块连同括号未闭合时跨越的后续块合为一个片段；
+    每个片段的分词结果只取决于片段原文，与前后文无关。
+    """
+    pending = -1
+    stack = []
+    for chunk in _CHUNK_RE.finditer(text, start):
+        piece = chunk.group()
+        if pending < 0 and not _SYNTAX_RE.search(piece):
+            yield chunk.start(), chunk.end(), True
+            continue
+        if pending < 0:
+            pending = chunk.start()
+        _push_brackets(piece, stack)
+        if not stack:
+            yield pending, chunk.end(), False
+            pending = -1
+    if pending >= 0:
+        yield pending, len(text), False
+
+
+def is_plain(text):
+    """不含括号、转义、额外网络、BREAK/AND 时为真，此时每个逗号/换行分隔的块就是一个提示词"""
+    return not _SYNTAX_RE.search(text)
+
+
+def tokenize_segment(segment, plain=False):
+    """对 segments() 切出的一个片段分词，返回 Token 元组"""
+    if not plain:
+        return _tokenize_chunk(segment)
+    raw = segment.strip()
+    core = normalize_core(raw)
+    return (Token(raw, core, 1.0, KIND_TAG),) if core else ()
+
+
+def tokenize(text):
+    """返回 Token 列表，顺序与提示词中出现的顺序一致"""
+    tokens = []
+    # 不含任何语法字符的块（绝大多数）直接产出；其余片段的解析结果按原文缓存
+    for start, end, plain in segments(text):
+        tokens.extend(tokenize_segment(text[start:end], plain))
+    return tokens
@@ -0,0 +1,262 @@
+"""本地语义分类（词典未命中时的第二阶段，离线、只用 CPU）
+
+用分类目录中的词典词训练：每个提示词表示为字符 n-gram 和单词的 TF-IDF 向量
+（特征哈希到 N_FEATURES 维）。先为每个词典文件（如 posture_head.txt）求归一化的
+质心，各分类取其文件质心的最大值作为线性模型的初始权重，再用全批量梯度下降
+（带动量）训练 EPOCHS 轮 softmax 回归。
+预测时把一条提示中所有未分类的提示词拼成一个稀疏批次，一次矩阵运算得到各分类的
+概率，confidence 为最高的概率。
+
+需要 NumPy（可选依赖，只在首次构建模型时导入）；未安装时 is_available() 为假，
+界面中的"本地语义分类"不可用，其余功能不受影响。
+"""
+
+import importlib.util
+import math
+import time
+import zlib
+from collections import Counter, namedtuple
+
+import prompt_tokenizer
+
+N_FEATURES = 1 << 18
+NGRAM_SIZES = (3, 4, 5)
+# 整词特征的权重，相对于单个字符 n-gram
+WORD_WEIGHT = 3.0
+# 训练参数：质心初始化的缩放、轮数、步长（作用于未平均的梯度）和动量
+INIT_SCALE = 20.0
+EPOCHS = 20
+LEARNING_RATE = 0.02
+MOMENTUM = 0.9
+# 留出集上置信度 ≥ 0.9 的提示词约占 59%，准确率约 97%
+DEFAULT_THRESHOLD = 0.9
+
+Proposal = namedtuple("Proposal", "tag category confidence")
+
+
+def is_available():
+    return importlib.util.find_spec("numpy") is not None
+
+
+def normalize(tag):
+    tag = prompt_tokenizer.normalize_core(tag).lower().replace("_", " ")
+    return " ".join(tag.split())
+
+
+def extract_features(tag):
+    """返回 {特征下标: 权重}：各单词的 3～5 字符 n-gram（含词首尾标记）和整词"""
+    features = Counter()
+    for word in normalize(tag).split():
+        word_feature = zlib.crc32(b"w:" + word.encode("utf-8")) % N_FEATURES
+        features[word_feature] += WORD_WEIGHT
+        padded = f" {word} "
+        for size in NGRAM_SIZES:
+            for i in range(len(padded) - size + 1):
+                gram = padded[i : i + size].encode("utf-8")
+                features[zlib.crc32(gram) % N_FEATURES] += 1
+    return features
+
+
+def _sparse_batch(np, tags):
+    """把一批提示词转为 CSR 三元组 (indptr, indices, tf)"""
+    indptr = [0]
+    indices = []
+    values = []
+    for tag in tags:
+        features = extract_features(tag)
+        indices.extend(features)
+        values.extend(features.values())
+        indptr.append(len(indices))
+    return (
+        np.asarray(indptr, dtype=np.int64),
+        np.asarray(indices, dtype=np.int64),
+        np.asarray(values, dtype=np.float32),
+    )
+
+
+class SemanticClassifier:
+    def __init__(self, token_map, threshold=DEFAULT_THRESHOLD, epochs=EPOCHS):
+        """token_map: {词典词: (分类名, 来源文件)}"""
+        import numpy as np
+
+        self.np = np
+        self.threshold = threshold
+        start = time.perf_counter()
+
+        words = list(token_map)
+        owners = [token_map[word] for word in words]
+        prototypes = sorted(set(owners))
+        self.categories = sorted({category for category, _ in prototypes})
+        category_ids = {name: i for i, name in enumerate(self.categories)}
+        labels = np.asarray([category_ids[category] for category, _ in owners])
+
+        indptr, indices, tf = _sparse_batch(np, words)
+        doc_freq = np.bincount(indices, minlength=N_FEATURES)
+        self.idf = (np.log((1 + len(words)) / (1 + doc_freq)) + 1).astype(np.float32)
+        weights = self._weights(indptr, indices, tf)
+        rows = np.repeat(np.arange(len(words)), np.diff(indptr))
+
+        # 文件质心 → 各分类取最大值，作为初始权重（特征 × 分类）
+        prototype_ids = {owner: i for i, owner in enumerate(prototypes)}
+        prototype_rows = np.asarray([prototype_ids[owner] for owner in owners])[rows]
+        centroids = np.zeros((len(prototypes), N_FEATURES), dtype=np.float32)
+        np.add.at(centroids, (prototype_rows, indices), weights)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        centroids /= np.maximum(norms, 1e-12)
+        self.weights = np.zeros((N_FEATURES, len(self.categories)), dtype=np.float32)
+        for prototype, (category, _) in enumerate(prototypes):
+            column = category_ids[category]
+            np.maximum(
+                self.weights[:, column],
+                centroids[prototype] * INIT_SCALE,
+                out=self.weights[:, column],
+            )
+        del centroids
+        self.bias = np.zeros(len(self.categories), dtype=np.float32)
+
+        targets = np.eye(len(self.categories), dtype=np.float32)[labels]
+        velocity = np.zeros_like(self.weights)
+        for _ in range(epochs):
+            residual = self._probabilities(indptr, indices, weights) - targets
+            gradient = np.zeros_like(self.weights)
+            np.add.at(gradient, indices, weights[:, None] * residual[rows])
+            velocity *= MOMENTUM
+            velocity -= LEARNING_RATE * gradient
+            self.weights += velocity
+            # 偏置只有几个参数，直接按平均梯度更新
+            self.bias -= residual.mean(axis=0)
+        self.build_seconds = time.perf_counter() - start
+
+    def _weights(self, indptr, indices, tf):
+        """次线性 TF × IDF，再按提示词做 L2 归一化"""
+        np = self.np
+        weights = (1 + np.log(tf)) * self.idf[indices]
+        lengths = np.diff(indptr)
+        nonempty = lengths > 0
+        squares = np.zeros(len(lengths), dtype=np.float32)
+        squares[nonempty] = np.add.reduceat(weights**2, indptr[:-1][nonempty])
+        norms = np.sqrt(np.repeat(squares, lengths))
+        return weights / np.maximum(norms, 1e-12)
+
+    def _probabilities(self, indptr, indices, weights):
+        np = self.np
+        lengths = np.diff(indptr)
+        logits = np.zeros((len(lengths), len(self.categories)), np.float32)
+        nonempty = lengths > 0
+        if indices.size:
+            contributions = self.weights[indices] * weights[:, None]
+            logits[nonempty] = np.add.reduceat(
+                contributions, indptr[:-1][nonempty], axis=0
+            )
+        logits += self.bias
+        logits -= logits.max(axis=1, keepdims=True)
+        np.exp(logits, out=logits)
+        logits /= logits.sum(axis=1, keepdims=True)
+        return logits
+
+    def probabilities(self, tags):
+        """返回 (提示词数 × 分类数) 的概率矩阵，分类顺序同 self.categories"""
+        indptr, indices, tf = _sparse_batch(self.np, tags)
+        weights = self._weights(indptr, indices, tf)
+        return self._probabilities(indptr, indices, weights)
+
+    def predict(self, tags):
+        """返回与 tags 一一对应的 Proposal（未达到阈值的也返回，由调用方筛选）"""
+        if not tags:
+            return []
+        probabilities = self.probabilities(tags)
+        best = probabilities.argmax(axis=1)
+        return [
+            Proposal(tag, self.categories[b], float(probabilities[i, b]))
+            for i, (tag, b) in enumerate(zip(tags, best))
+        ]
+
+    def propose(self, tags, threshold=None):
+        """返回 {提示词: Proposal}，只包含置信度不低于阈值的提示词"""
+        threshold = self.threshold if threshold is None else threshold
+        return {
+            proposal.tag: proposal
+            for proposal in self.predict(tags)
+            if proposal.confidence >= threshold
+        }
+
+
+def format_proposals(proposals):
+    """proposals: {提示词: Proposal}，为 None 表示模型构建中"""
+    if proposals is None:
+        return "本地语义分类模型正在后台构建，稍后重新分类即可使用"
+    return "\n".join(
+        f"{tag} → {proposal.category}（语义 {proposal.confidence:.2f}）"
+        for tag, proposal in proposals.items()
+    )
+
+
+def split_holdout(token_map, fraction=0.1):
+    """按词的 crc32 确定性地切出留出集，返回 (训练映射, [(词, 分类名)])"""
+    bucket = max(1, round(1 / fraction))
+    train = {}
+    holdout = []
+    for word, owner in token_map.items():
+        if zlib.crc32(word.encode("utf-8")) % bucket == 0:
+            holdout.append((word, owner[0]))
+        else:
+            train[word] = owner
+    return train, holdout
+
+
+def evaluate(token_map, fraction=0.1, thresholds=(0.0, 0.5, 0.6, 0.7, 0.8, 0.9)):
+    """在留出集上评估，返回构建耗时、批量延迟以及各阈值下的覆盖率和准确率"""
+    train, holdout = split_holdout(token_map, fraction)
+    classifier = SemanticClassifier(train)
+
+    start = time.perf_counter()
+    proposals = classifier.predict([word for word, _ in holdout])
+    predict_seconds = time.perf_counter() - start
+
+    batch = [word for word, _ in holdout[:50]]
+    classifier.predict(batch)
+    start = time.perf_counter()
+    repeat = 20
+    for _ in range(repeat):
+        classifier.predict(batch)
+    batch_seconds = (time.perf_counter() - start) / repeat
+
+    report = {
+        "train_words": len(train),
+        "holdout_words": len(holdout),
+        "build_seconds": classifier.build_seconds,
+        "predict_seconds": predict_seconds,
+        "batch_size": len(batch),
+        "batch_seconds": batch_seconds,
+        "thresholds": [],
+    }
+    for threshold in thresholds:
+        kept = [
+            (proposal, category)
+            for proposal, (_, category) in zip(proposals, holdout)
+            if proposal.confidence >= threshold
+        ]
+        correct = sum(proposal.category == category for proposal, category in kept)
+        report["thresholds"].append(
+            {
+                "threshold": threshold,
+                "coverage": len(kept) / max(len(holdout), 1),
+                "accuracy": correct / len(kept) if kept else math.nan,
+            }
+        )
+    return report
+
+
+def format_report(report):
+    lines = [
+        f"训练 {report['train_words']} 个词，留出 {report['holdout_words']} 个词",
+        f"模型构建：{report['build_seconds']:.2f} 秒",
+        f"整个留出集预测：{report['predict_seconds'] * 1000:.1f} ms",
+        f"每批 {report['batch_size']} 个提示词：{report['batch_seconds'] * 1000:.2f} ms",
+        f"{'阈值':>6} {'覆盖率':>8} {'准确率':>8}",
+    ]
+    for row in report["thresholds"]:
+        lines.append(
+            f"{row['threshold']:>6.2f} {row['coverage']:>8.1%} {row['accuracy']:>8.1%}"
+        )
+    return "\n".join(lines)
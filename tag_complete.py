@@ -0,0 +1,124 @@
+"""提示词补全（前缀索引）
+
+由分类词典构建：每个词典词只保存一份（sys.intern），同时按下划线形式和空格形式
+（小写）建立检索键，两种写法相同时共用同一个字符串对象。
+检索键排序后存为列表，词 id 存为平行的 array('I')；查询时二分查找前缀区间，
+区间内按保存次数（tag_stats 统计）取前 k 个，次数相同时短词优先。
+构建索引和重算排名都要遍历全部词典词，由调用方在后台线程中进行（见
+main.get_completion_index），期间查询继续使用旧的索引和排名。
+
+    index = CompletionIndex(get_token_map(config, False))
+    index.complete("long h", k=10)  → [("long hair", "Characters"), ...]
+"""
+
+import array
+import bisect
+import heapq
+import sys
+import time
+
+import tag_stats
+
+DEFAULT_K = 10
+# 统计变化后最多每隔这么多秒重新计算一次排名
+RANK_REFRESH_SECONDS = 2.0
+
+
+def normalize_prefix(text):
+    """只统一大小写和空白，输入下划线形式时匹配下划线形式的检索键"""
+    return " ".join(text.lower().split())
+
+
+class CompletionIndex:
+    def __init__(self, token_map):
+        """token_map: {下划线形式的词典词: (分类名, 来源文件)}"""
+        self.words = []
+        self.categories = []
+        # 各词在 tag_stats 中的统计键，重算排名时不必再规范化
+        self._stat_keys = []
+        keyed = []
+        for word, owner in token_map.items():
+            word_id = len(self.words)
+            word = sys.intern(word)
+            self.words.append(word)
+            self.categories.append(sys.intern(owner[0]))
+            self._stat_keys.append(tag_stats.normalize_tag(word))
+            lower = word.lower()
+            underscore_key = sys.intern(lower) if lower != word else word
+            keyed.append((underscore_key, word_id))
+            space_key = " ".join(lower.replace("_", " ").split())
+            if space_key != underscore_key:
+                keyed.append((sys.intern(space_key), word_id))
+        keyed.sort()
+        self.keys = [key for key, _ in keyed]
+        self.ids = array.array("I", (word_id for _, word_id in keyed))
+
+        # 无统计时的次序：短词优先，其次按字母
+        by_length = sorted(
+            range(len(self.words)), key=lambda i: (len(self.words[i]), self.words[i])
+        )
+        self._base_rank = array.array("I", bytes(4 * len(self.words)))
+        for rank, word_id in enumerate(by_length):
+            self._base_rank[word_id] = len(by_length) - rank
+        self._score = self._base_rank
+        self._stats_version = None
+        self._refreshed = 0.0
+
+    def ranks_stale(self, stats):
+        """统计有变化且距上次重算超过 RANK_REFRESH_SECONDS 时为真"""
+        if (id(stats), stats.version) == self._stats_version:
+            return False
+        return time.monotonic() - self._refreshed >= RANK_REFRESH_SECONDS
+
+    def refresh_ranks(self):
+        """按 tag_stats 的保存次数重算排名分数：次数 × 词数 + 基础次序"""
+        stats, version, totals = tag_stats.tag_totals()
+        version = (id(stats), version)
+        if version == self._stats_version:
+            return
+        scale = len(self.words) + 1
+        score = array.array("Q", self._base_rank)
+        ids = stats.ids
+        for word_id, key in enumerate(self._stat_keys):
+            stats_id = ids.get(key)
+            if stats_id is not None and stats_id < len(totals) and totals[stats_id]:
+                score[word_id] += totals[stats_id] * scale
+        # 整体替换，同时进行的查询要么用旧分数要么用新分数
+        self._score = score
+        self._stats_version = version
+        self._refreshed = time.monotonic()
+
+    def complete(self, prefix, k=DEFAULT_K, replace_underscore=True):
+        """返回 [(提示词, 分类名)]，replace_underscore 为真时以空格形式显示"""
+        prefix = normalize_prefix(prefix)
+        if not prefix:
+            return []
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + "\uffff", start)
+        candidates = set(self.ids[start:end])
+        best = heapq.nlargest(k, candidates, key=self._score.__getitem__)
+        results = []
+        for word_id in best:
+            word = self.words[word_id]
+            if replace_underscore:
+                word = word.replace("_", " ")
+            results.append((word, self.categories[word_id]))
+        return results
+
+
+def last_fragment(text):
+    """返回 (输入框中最后一个提示词之前的部分, 最后一个提示词)，用于替换正在输入的词"""
+    cut = max(text.rfind(","), text.rfind("\n")) + 1
+    head, fragment = text[:cut], text[cut:]
+    stripped = fragment.lstrip(" ([{")
+    return head + fragment[: len(fragment) - len(stripped)], stripped
+
+
+def apply_completion(text, word):
+    """把输入框中正在输入的提示词替换为 word；不在括号内时补上逗号"""
+    head, _ = last_fragment(text)
+    if head.endswith(("(", "[", "{")):
+        return head + word
+    if head and not head.endswith(" "):
+        head += " "
+    return f"{head}{word}, "
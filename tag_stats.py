@@ -0,0 +1,553 @@
+"""提示词频率与共现统计
+
+保存的每一行（save_unique）以及批量分类（python main.py classify --stats）的结果
+都会增量计入统计，可查询：
+    top_tags("Clothes", k=50, month="2024-05")   某分类（某月）最常用的提示词
+    neighbors("sitting", k=20)                   与某提示词同时出现最多的提示词
+
+存储：
+    提示词驻留为整数 id；计数按 (分类, 月份) 各存一个以 id 为下标的 array('I')，
+    月份为空字符串的一组为累计值。
+    共现为对称稀疏矩阵，以 CSR 形式（indptr / indices / data 三个整数数组）存放，
+    新增的共现先记在内存增量表中，压缩时合并进 CSR。
+    快照写入 tag_stats.bin，两次快照之间的更新追加到 tag_stats.journal，
+    启动时加载快照后重放日志；日志超过 COMPACT_EVERY 行时自动压缩。
+    快照带有代数（generation），每次压缩加 1；日志第一行记录它所接续的快照代数。
+    写入快照后、删除日志前进程中断时，日志的代数与快照不符，加载时丢弃而不重复计入。
+
+多进程：界面、批量分类（--stats）和 stats 命令可能同时使用统计文件。读取、追加日志
+和压缩都在文件锁（tag_stats.lock）内进行，每次先与磁盘同步：快照被其他进程替换时
+重新加载，日志被其他进程追加时重放新增的部分，因此不会以过期的代数续写日志，
+也不会覆盖其他进程计入的数据。批量导入的计数先单独累计，compact() 时同步后再合并。
+
+extract_*.txt 中没有保存时间，用 rebuild() 从这些文件重建时只计入累计值。
+"""
+
+import array
+import bisect
+import contextlib
+import glob
+import heapq
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+import prompt_tokenizer
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+STATS_FILE = "tag_stats.bin"
+JOURNAL_FILE = "tag_stats.journal"
+LOCK_FILE = "tag_stats.lock"
+MAGIC = b"TAGSTAT1"
+COMPACT_EVERY = 2000
+# 单行提示词过多时只统计前面这些提示词的共现，避免成对计数爆炸
+MAX_COOCCURRENCE_TAGS = 128
+
+_EXTRACT_NAME_RE = re.compile(r"^extract_(.+)\.txt$")
+
+
+def normalize_tag(tag):
+    """统计键：去掉权重括号，统一为小写空格形式"""
+    tag = prompt_tokenizer.normalize_core(tag).lower().replace("_", " ")
+    return " ".join(tag.split())
+
+
+def split_line(line):
+    """保存的一行 → 去重后的规范化提示词列表"""
+    tags = (normalize_tag(token.core) for token in prompt_tokenizer.tokenize(line))
+    return [tag for tag in dict.fromkeys(tags) if tag]
+
+
+def current_month():
+    return time.strftime("%Y-%m")
+
+
+class TagStats:
+    def __init__(self):
+        self.tags = []
+        self.ids = {}
+        # {(分类, 月份): array('I')}，月份 "" 为累计
+        self.counts = {}
+        # 共现 CSR（第 i 行为 indices[indptr[i]:indptr[i+1]]，按 id 升序）
+        self.indptr = array.array("Q", [0])
+        self.indices = array.array("I")
+        self.data = array.array("I")
+        # 尚未合并进 CSR 的共现：{id: Counter({id: 次数})}
+        self.delta = {}
+        # 每计入一条记录加 1，供依赖统计的索引判断是否需要刷新
+        self.version = 0
+        # 快照代数，见模块说明
+        self.generation = 0
+
+    def intern(self, tag):
+        tag_id = self.ids.get(tag)
+        if tag_id is None:
+            tag_id = self.ids[tag] = len(self.tags)
+            self.tags.append(tag)
+        return tag_id
+
+    def _counts(self, key, size):
+        """返回 key 的计数数组，长度不足 size 时补 0"""
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = array.array("I")
+        needed = size - len(counts)
+        if needed > 0:
+            counts.frombytes(bytes(needed * counts.itemsize))
+        return counts
+
+    def _bump(self, key, tag_ids):
+        counts = self._counts(key, max(tag_ids) + 1)
+        for tag_id in tag_ids:
+            counts[tag_id] += 1
+
+    def add(self, groups, month=None):
+        """
+        计入一条记录：groups 为 {分类名: [规范化提示词]}，
+        各分类分别计数，记录内全部提示词两两计入共现。
+        month 为空时只计入累计值。
+        """
+        self.version += 1
+        all_ids = []
+        for category, tags in groups.items():
+            if not tags:
+                continue
+            tag_ids = [self.intern(tag) for tag in tags]
+            self._bump((category, ""), tag_ids)
+            if month:
+                self._bump((category, month), tag_ids)
+            all_ids.extend(tag_ids)
+
+        # 每行整体 update（Counter 的计数在 C 中完成）；对角线 (a, a) 即
+        # 包含 a 的记录数，查询共现时跳过
+        unique = set(all_ids[:MAX_COOCCURRENCE_TAGS])
+        delta = self.delta
+        for tag_id in unique:
+            row = delta.get(tag_id)
+            if row is None:
+                row = delta[tag_id] = Counter()
+            row.update(unique)
+
+    def merge(self, other):
+        """把另一份统计（批量导入期间单独累计的）计入本统计"""
+        self.version += 1
+        mapping = [self.intern(tag) for tag in other.tags]
+        for key, counts in other.counts.items():
+            used = [(mapping[i], count) for i, count in enumerate(counts) if count]
+            if not used:
+                continue
+            target = self._counts(key, max(tag_id for tag_id, _ in used) + 1)
+            for tag_id, count in used:
+                target[tag_id] += count
+
+        other.merge_delta()
+        for row in range(len(other.indptr) - 1):
+            start, end = other.indptr[row], other.indptr[row + 1]
+            if start == end:
+                continue
+            changes = self.delta.get(mapping[row])
+            if changes is None:
+                changes = self.delta[mapping[row]] = Counter()
+            for column, count in zip(other.indices[start:end], other.data[start:end]):
+                changes[mapping[column]] += count
+
+    def categories(self):
+        return sorted({category for category, _ in self.counts})
+
+    def months(self):
+        return sorted({month for _, month in self.counts if month}, reverse=True)
+
+    def top(self, category, k=50, month=""):
+        """返回 [(提示词, 次数)]，按次数降序"""
+        counts = self.counts.get((category, month or ""))
+        if not counts:
+            return []
+        best = heapq.nlargest(k, range(len(counts)), key=counts.__getitem__)
+        return [(self.tags[i], counts[i]) for i in best if counts[i]]
+
+    def totals(self):
+        """返回各提示词在所有分类中的累计次数，array('I')，以 id 为下标"""
+        totals = array.array("I", bytes(4 * len(self.tags)))
+        for (_, month), counts in self.counts.items():
+            if month:
+                continue
+            for tag_id, count in enumerate(counts):
+                if count:
+                    totals[tag_id] += count
+        return totals
+
+    def _row(self, tag_id):
+        row = {}
+        if tag_id + 1 < len(self.indptr):
+            start, end = self.indptr[tag_id], self.indptr[tag_id + 1]
+            row = dict(zip(self.indices[start:end], self.data[start:end]))
+        for other, count in self.delta.get(tag_id, {}).items():
+            row[other] = row.get(other, 0) + count
+        return row
+
+    def neighbors(self, tag, k=20):
+        """返回与 tag 同时出现最多的 [(提示词, 共现次数)]"""
+        tag_id = self.ids.get(normalize_tag(tag))
+        if tag_id is None:
+            return []
+        row = self._row(tag_id)
+        row.pop(tag_id, None)
+        best = heapq.nlargest(k, row.items(), key=lambda item: item[1])
+        return [(self.tags[other], count) for other, count in best]
+
+    def cooccurrence(self, tag_a, tag_b):
+        a, b = self.ids.get(normalize_tag(tag_a)), self.ids.get(normalize_tag(tag_b))
+        if a is None or b is None or a == b:
+            return 0
+        count = self.delta.get(a, {}).get(b, 0)
+        if a + 1 < len(self.indptr):
+            start, end = self.indptr[a], self.indptr[a + 1]
+            i = bisect.bisect_left(self.indices, b, start, end)
+            if i < end and self.indices[i] == b:
+                count += self.data[i]
+        return count
+
+    def merge_delta(self):
+        """把增量共现合并进 CSR，耗时与非零元素个数成正比"""
+        if not self.delta:
+            return
+        indptr = array.array("Q", [0])
+        indices = array.array("I")
+        data = array.array("I")
+        old_rows = len(self.indptr) - 1
+        for tag_id in range(len(self.tags)):
+            changes = self.delta.get(tag_id)
+            if tag_id < old_rows:
+                start, end = self.indptr[tag_id], self.indptr[tag_id + 1]
+            else:
+                start = end = 0
+            if not changes:
+                indices.extend(self.indices[start:end])
+                data.extend(self.data[start:end])
+            else:
+                row = Counter(dict(zip(self.indices[start:end], self.data[start:end])))
+                row.update(changes)
+                others = sorted(row)
+                indices.extend(others)
+                data.extend(map(row.__getitem__, others))
+            indptr.append(len(indices))
+        self.indptr, self.indices, self.data = indptr, indices, data
+        self.delta = {}
+
+    def save(self, path=STATS_FILE):
+        self.merge_delta()
+        keys = sorted(self.counts)
+        header = {
+            "byteorder": sys.byteorder,
+            "generation": self.generation,
+            "tags": self.tags,
+            "counts": [
+                [category, month, len(self.counts[(category, month)])]
+                for category, month in keys
+            ],
+            "rows": len(self.indptr) - 1,
+            "nnz": len(self.indices),
+        }
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        with open(path + ".tmp", "wb") as f:
+            f.write(MAGIC + len(header_bytes).to_bytes(8, "little") + header_bytes)
+            for key in keys:
+                self.counts[key].tofile(f)
+            self.indptr.tofile(f)
+            self.indices.tofile(f)
+            self.data.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path=STATS_FILE):
+        stats = cls()
+        with open(path, "rb") as f:
+            raw = f.read()
+        if not raw.startswith(MAGIC):
+            raise ValueError(f"{path} 不是统计索引文件")
+        header_length = int.from_bytes(raw[8:16], "little")
+        header = json.loads(raw[16 : 16 + header_length].decode("utf-8"))
+        swap = header["byteorder"] != sys.byteorder
+        offset = 16 + header_length
+
+        def take(typecode, length):
+            nonlocal offset
+            values = array.array(typecode)
+            size = values.itemsize * length
+            values.frombytes(raw[offset : offset + size])
+            if swap:
+                values.byteswap()
+            offset += size
+            return values
+
+        stats.generation = header.get("generation", 0)
+        stats.tags = header["tags"]
+        stats.ids = {tag: i for i, tag in enumerate(stats.tags)}
+        for category, month, length in header["counts"]:
+            stats.counts[(category, month)] = take("I", length)
+        stats.indptr = take("Q", header["rows"] + 1)
+        stats.indices = take("I", header["nnz"])
+        stats.data = take("I", header["nnz"])
+        return stats
+
+
+# --- 进程内共享的统计索引 ---
+_lock = threading.RLock()
+_stats = None
+_journal_lines = 0
+# 已加载的快照文件签名，以及日志已重放到的字节位置
+_snapshot = None
+_journal_offset = 0
+# record(journal=False) 累计、尚未合并的统计
+_pending = None
+
+
+@contextlib.contextmanager
+def _file_lock():
+    """跨进程的排他锁，与 _lock 一起持有"""
+    with open(LOCK_FILE, "a+b") as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK 重试 10 次后仍未取得时抛出
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _snapshot_signature():
+    try:
+        stat = os.stat(STATS_FILE)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def _sync():
+    """在两把锁内调用：快照被替换时重新加载，日志有新增时重放新增的部分"""
+    global _stats, _snapshot, _journal_offset, _journal_lines
+    signature = _snapshot_signature()
+    try:
+        journal_size = os.path.getsize(JOURNAL_FILE)
+    except FileNotFoundError:
+        journal_size = 0
+    if _stats is None or signature != _snapshot or journal_size < _journal_offset:
+        stats = TagStats()
+        if signature is not None:
+            try:
+                stats = TagStats.load(STATS_FILE)
+            except (OSError, ValueError) as e:
+                print(f"读取统计索引失败，将重新开始统计：{e}")
+        _stats, _snapshot = stats, signature
+        _journal_offset = _journal_lines = 0
+    if journal_size > _journal_offset:
+        _replay_journal(_stats)
+
+
+def get_stats():
+    """加载快照并重放日志，之后常驻内存；其他进程更新了统计文件时重新同步"""
+    with _lock, _file_lock():
+        _sync()
+        return _stats
+
+
+def _replay_journal(stats):
+    """
+    从 _journal_offset 起重放日志；日志接续的不是当前快照（已计入快照）时删除日志
+    """
+    global _journal_offset, _journal_lines
+    with open(JOURNAL_FILE, "rb") as f:
+        f.seek(_journal_offset)
+        data = f.read()
+    # 只处理完整的行，不完整的最后一行（写入时中断）留在原处
+    end = data.rfind(b"\n") + 1
+    entries = []
+    # 没有代数行的旧日志视为接续第 0 代；从中间续读时代数已在开头校验过
+    generation = stats.generation if _journal_offset else 0
+    for line in data[:end].splitlines():
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if "generation" in entry:
+            generation = entry["generation"]
+        else:
+            entries.append(entry)
+    if generation != stats.generation:
+        print(f"{JOURNAL_FILE} 已计入快照，丢弃")
+        os.remove(JOURNAL_FILE)
+        _journal_offset = _journal_lines = 0
+        return
+    for entry in entries:
+        stats.add(entry["groups"], entry.get("month"))
+    _journal_offset += end
+    _journal_lines += len(entries)
+
+
+def _save():
+    """在两把锁内调用：写入快照（代数加 1）并删除日志"""
+    global _snapshot, _journal_offset, _journal_lines
+    _stats.generation += 1
+    _stats.save(STATS_FILE)
+    if os.path.exists(JOURNAL_FILE):
+        os.remove(JOURNAL_FILE)
+    _snapshot = _snapshot_signature()
+    _journal_offset = _journal_lines = 0
+
+
+def compact():
+    """与磁盘同步、合并批量导入的计数后写入快照（代数加 1）并删除日志"""
+    global _pending
+    with _lock, _file_lock():
+        _sync()
+        if _pending is not None:
+            _stats.merge(_pending)
+            _pending = None
+        _save()
+
+
+def record(groups, month=None, journal=True):
+    """
+    计入一条记录 {分类名: [提示词原文]}，提示词会先规范化。
+    journal 为真时追加到日志（界面保存）；批量导入时传 False，计数先单独累计，
+    结束后调用 compact() 合并写入快照。
+    """
+    global _journal_lines, _journal_offset, _pending
+    groups = {
+        category: list(dict.fromkeys(filter(None, map(normalize_tag, tags))))
+        for category, tags in groups.items()
+    }
+    groups = {category: tags for category, tags in groups.items() if tags}
+    if not groups:
+        return
+    month = month or current_month()
+    if not journal:
+        with _lock:
+            if _pending is None:
+                _pending = TagStats()
+            _pending.add(groups, month)
+        return
+    with _lock, _file_lock():
+        _sync()
+        _stats.add(groups, month)
+        entry = {"month": month, "groups": groups}
+        with open(JOURNAL_FILE, "a", encoding="utf-8") as f:
+            if not f.tell():
+                header = {"generation": _stats.generation}
+                f.write(json.dumps(header) + "\n")
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        # 同步后日志已读到末尾，新写入的行不必再重放
+        _journal_offset = os.path.getsize(JOURNAL_FILE)
+        _journal_lines += 1
+        if _journal_lines >= COMPACT_EVERY:
+            _save()
+
+
+def record_line(category, line, month=None):
+    """计入 save_unique 保存的一行"""
+    record({category: split_line(line)}, month)
+
+
+def rebuild(directory="."):
+    """
+    从 extract_*.txt 流式重建统计（这些行没有时间，只计入累计值），返回行数。
+    重建期间持有锁：同时进行的保存等重建完成后再计入，不会丢失或重复计入
+    """
+    global _stats
+    with _lock, _file_lock():
+        _sync()
+        stats = TagStats()
+        # 代数沿用现有快照，写入时加 1 后使现有日志失效
+        stats.generation = _stats.generation
+        lines = 0
+        for path in sorted(glob.glob(os.path.join(directory, "extract_*.txt"))):
+            match = _EXTRACT_NAME_RE.match(os.path.basename(path))
+            if not match:
+                continue
+            category = match.group(1)
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    tags = split_line(line)
+                    if tags:
+                        stats.add({category: tags})
+                        lines += 1
+        _stats = stats
+        _save()
+    return lines
+
+
+def tag_totals():
+    """返回 (统计, 统计版本, 各提示词的累计次数)，在锁内计算，供后台线程使用"""
+    with _lock:
+        stats = get_stats()
+        return stats, stats.version, stats.totals()
+
+
+def top_tags(category, k=50, month=""):
+    with _lock:
+        return get_stats().top(category, k, month)
+
+
+def neighbors(tag, k=20):
+    with _lock:
+        return get_stats().neighbors(tag, k)
+
+
+def format_ranking(rows):
+    if not rows:
+        return "暂无数据"
+    width = len(str(rows[0][1]))
+    return "\n".join(
+        f"{i:>3}. {count:>{width}}  {tag}" for i, (tag, count) in enumerate(rows, 1)
+    )
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="python main.py stats", description="提示词频率与共现统计"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild", help="从 extract_*.txt 重建统计")
+    top_parser = subparsers.add_parser("top", help="某分类最常用的提示词")
+    top_parser.add_argument("category")
+    top_parser.add_argument("-k", type=int, default=50)
+    top_parser.add_argument("--month", default="", help="例如 2024-05，默认累计")
+    neighbor_parser = subparsers.add_parser("neighbors", help="共现最多的提示词")
+    neighbor_parser.add_argument("tag")
+    neighbor_parser.add_argument("-k", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.command == "rebuild":
+        lines = rebuild()
+        print(f"已从 extract 文件重建统计：{lines} 行，{len(get_stats().tags)} 个提示词")
+    elif args.command == "top":
+        print(format_ranking(top_tags(args.category, args.k, args.month)))
+    else:
+        print(format_ranking(neighbors(args.tag, args.k)))
+    print(f"用时 {(time.perf_counter() - start) * 1000:.1f} ms")
+    return 0
@@ -0,0 +1,282 @@
+"""拼写纠错匹配（SymSpell 删除索引）
+
+只用于精确查找失败的提示词，例如：
+    whtie hair       → white hair        （相邻字母对调，距离 1）
+    lookng at viewer → looking at viewer （漏字母，距离 1）
+    thighhigh        → thighhighs        （单复数规则）
+
+构建时对每个词典词的前 prefix_length 个字符生成删除至多 max_distance 个字符
+后的所有变体，建立 {变体: [词 id]} 索引；查询时对提示词做同样的删除，
+取出候选后用 Damerau-Levenshtein（相邻对调记 1）距离校验。
+"holding ..." 这类共用前缀的词有数百个，因此长词的末尾 prefix_length 个字符
+也建同样的索引，前缀候选过多时与后缀候选取交集再校验。
+短词容易误纠，允许的距离随长度递增（见 allowed_distance），短于 min_length
+的提示词不纠错。
+"""
+
+from collections import namedtuple
+
+DEFAULT_MAX_DISTANCE = 2
+DEFAULT_PREFIX_LENGTH = 7
+DEFAULT_MIN_LENGTH = 4
+MEMO_LIMIT = 65536
+# 前缀候选超过这个数时再用后缀索引过滤
+SUFFIX_FILTER_THRESHOLD = 32
+
+# plural 为真表示按单复数规则匹配（此时 distance 为 0）
+TypoMatch = namedtuple("TypoMatch", "word owner distance plural")
+
+
+def damerau_distance(a, b, limit):
+    """相邻对调的 Damerau-Levenshtein 距离（OSA），超过 limit 时返回 limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # 去掉公共前后缀，只比较不同的部分
+    start = 0
+    end_a, end_b = len(a), len(b)
+    while start < end_a and start < end_b and a[start] == b[start]:
+        start += 1
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    # 保留一个公共字符作为对调判断的上下文
+    start = max(start - 1, 0)
+    a, b = a[start:end_a], b[start:end_b]
+    if not a or not b:
+        return len(a) or len(b)
+
+    # 只计算 |i - j| <= limit 的对角带，带外的格子距离必然超过 limit
+    over = limit + 1
+    length_b = len(b)
+    previous2 = None
+    previous = [j if j <= limit else over for j in range(length_b + 1)]
+    for i in range(1, len(a) + 1):
+        char = a[i - 1]
+        current = [over] * (length_b + 1)
+        current[0] = row_min = i if i <= limit else over
+        for j in range(max(1, i - limit), min(length_b, i + limit) + 1):
+            value = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char != b[j - 1]),
+            )
+            if (
+                i > 1
+                and j > 1
+                and char == b[j - 2]
+                and a[i - 2] == b[j - 1]
+                and previous2[j - 2] + 1 < value
+            ):
+                value = previous2[j - 2] + 1
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return over
+        previous2, previous = previous, current
+    return min(previous[-1], over)
+
+
+# 以这些结尾的词复数加 es
+_SIBILANT_ENDINGS = ("s", "x", "z", "ch", "sh")
+
+
+def plural_variants(term):
+    """
+    按末尾单词的常见单复数规则生成候选写法。只生成两者仅差复数词尾的写法，
+    "dres" 不会生成 "dress"（那是漏字母，按编辑距离匹配）
+    """
+    variants = []
+    # 单数 → 复数
+    if term.endswith(_SIBILANT_ENDINGS):
+        variants.append(term + "es")
+    elif term.endswith("y") and term[-2:-1] not in ("", "a", "e", "i", "o", "u"):
+        variants.append(term[:-1] + "ies")
+    else:
+        variants.append(term + "s")
+    # 复数 → 单数
+    if term.endswith("ies"):
+        variants.append(term[:-3] + "y")
+    elif term.endswith("es") and term[:-2].endswith(_SIBILANT_ENDINGS):
+        variants.append(term[:-2])
+    if term.endswith("s") and not term.endswith("ss"):
+        variants.append(term[:-1])
+    return variants
+
+
+def _deletes(text, distance):
+    """删除至多 distance 个字符得到的全部变体（含原文）"""
+    variants = {text}
+    level = variants
+    for _ in range(min(distance, len(text))):
+        level = {word[:i] + word[i + 1 :] for word in level for i in range(len(word))}
+        variants |= level
+    return variants
+
+
+class TypoMatcher:
+    def __init__(
+        self,
+        token_map,
+        priority=(),
+        max_distance=DEFAULT_MAX_DISTANCE,
+        prefix_length=DEFAULT_PREFIX_LENGTH,
+        min_length=DEFAULT_MIN_LENGTH,
+    ):
+        """
+        token_map: {词典词: 归属信息}，通常为 get_token_map 的结果
+        priority: 分类名按优先级排列，距离相同的候选按此决定先后
+        """
+        self.token_map = token_map
+        self.max_distance = max(0, max_distance)
+        self.prefix_length = max(prefix_length, self.max_distance + 1)
+        self.min_length = min_length
+        self._rank = {name: i for i, name in enumerate(priority)}
+        self.words = []
+        self.ranks = []
+        self._word_ids = {}
+        self.deletes = {}
+        # 只收录长于 prefix_length 的词，短词的后缀就是前缀
+        self.suffix_deletes = {}
+        # 先取快照，后台构建时词典可能被其他线程增量修改
+        for word, owner in list(token_map.items()):
+            self._insert(word, owner)
+        self._memo = {}
+
+    def _rank_of(self, owner):
+        category = owner[0] if isinstance(owner, tuple) else owner
+        return self._rank.get(category, len(self._rank))
+
+    def _insert(self, word, owner):
+        word_id = self._word_ids.get(word)
+        if word_id is not None:
+            self.ranks[word_id] = self._rank_of(owner)
+            return
+        word_id = self._word_ids[word] = len(self.words)
+        self.words.append(word)
+        self.ranks.append(self._rank_of(owner))
+        self._index(self.deletes, word[: self.prefix_length], word_id)
+        if len(word) > self.prefix_length:
+            self._index(self.suffix_deletes, word[-self.prefix_length :], word_id)
+
+    def add(self, words=None):
+        """
+        token_map 新增词后增量更新索引：只为 words 中的词生成删除变体，
+        已收录的词只更新排序。words 为 None 时补上 token_map 中所有未收录的词。
+        从 token_map 删除的词不必处理，查询时会跳过
+        """
+        if words is None:
+            words = [word for word in self.token_map if word not in self._word_ids]
+        for word in words:
+            owner = self.token_map.get(word)
+            if owner:
+                self._insert(word, owner)
+        self._memo.clear()
+
+    def set_priority(self, priority):
+        """分类优先级或词的归属变化后重新计算排序，不重建索引"""
+        self._rank = {name: i for i, name in enumerate(priority)}
+        for word_id, word in enumerate(self.words):
+            owner = self.token_map.get(word)
+            if owner:
+                self.ranks[word_id] = self._rank_of(owner)
+        self._memo.clear()
+
+    def _index(self, index, text, word_id):
+        for variant in _deletes(text, self.max_distance):
+            bucket = index.get(variant)
+            if bucket is None:
+                index[variant] = [word_id]
+            else:
+                bucket.append(word_id)
+
+    def _candidates(self, index, text, limit):
+        candidates = set()
+        for variant in _deletes(text, limit):
+            bucket = index.get(variant)
+            if bucket:
+                candidates.update(bucket)
+        return candidates
+
+    def allowed_distance(self, term):
+        """4～7 个字符允许 1 处错误，8 个字符以上允许 2 处（不超过 max_distance）"""
+        if len(term) < self.min_length:
+            return 0
+        return min(self.max_distance, len(term) // 4)
+
+    def match(self, term):
+        """返回 TypoMatch 或 None；term 本身在词典中时也返回 None"""
+        try:
+            return self._memo[term]
+        except KeyError:
+            pass
+        if len(self._memo) >= MEMO_LIMIT:
+            self._memo.clear()
+        result = self._memo[term] = self._lookup(term)
+        return result
+
+    def _lookup(self, term):
+        if len(term) < self.min_length or term in self.token_map:
+            return None
+
+        for variant in plural_variants(term):
+            owner = self.token_map.get(variant)
+            if owner:
+                return TypoMatch(variant, owner, 0, True)
+
+        limit = self.allowed_distance(term)
+        if not limit:
+            return None
+        length = len(term)
+        words = self.words
+        candidates = self._candidates(self.deletes, term[: self.prefix_length], limit)
+        if len(candidates) > SUFFIX_FILTER_THRESHOLD:
+            # 长词还须末尾也在距离内，短词的末尾即前缀，已经校验过
+            suffixes = self._candidates(
+                self.suffix_deletes, term[-self.prefix_length :], limit
+            )
+            candidates = {
+                word_id
+                for word_id in candidates
+                if word_id in suffixes or len(words[word_id]) <= self.prefix_length
+            }
+
+        # 长度接近的候选先校验；找到距离 d 的候选后只需再校验距离不超过 d 的
+        candidates = sorted(
+            (abs(len(words[word_id]) - length), word_id)
+            for word_id in candidates
+            if abs(len(words[word_id]) - length) <= limit
+        )
+        best = None
+        best_key = None
+        for length_gap, word_id in candidates:
+            if length_gap > limit:
+                break
+            word = words[word_id]
+            distance = damerau_distance(term, word, limit)
+            if distance > limit or word not in self.token_map:
+                continue
+            key = (distance, self.ranks[word_id], word)
+            if best_key is None or key < best_key:
+                best, best_key = word, key
+                limit = distance
+        owner = self.token_map.get(best) if best is not None else None
+        if owner is None:
+            return None
+        return TypoMatch(best, owner, best_key[0], False)
+
+
+def format_suggestions(suggestions):
+    """
+    suggestions: {原提示词: (建议写法, 分类名, TypoMatch)}，为 None 表示索引构建中
+    """
+    if suggestions is None:
+        return "拼写纠错索引正在后台构建，稍后重新分类即可看到拼写建议"
+    if not suggestions:
+        return ""
+    lines = ["拼写建议（未自动修改，确认后请手动改正或移动）："]
+    for raw, (corrected, category, hit) in suggestions.items():
+        reason = "单复数" if hit.plural else f"距离 {hit.distance}"
+        lines.append(f"{raw} → {corrected}？（{category}，{reason}）")
+    return "\n".join(lines)
+
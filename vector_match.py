@@ -0,0 +1,427 @@
+"""NumPy 向量化的精确匹配（离线批量分类）
+
+classify_text 对每个提示词做一次 strip/normalize_core 和一次字典查找，语料达到
+千万个提示词时这些逐个调用成为瓶颈。VectorMatcher 一次处理一批提示：
+
+1. 纯 ASCII 的提示拼成一个字节数组，在数组上按逗号/换行切块；不含语法字符的块
+   （绝大多数）直接去掉首尾空白并合并连续空白，不逐个调用 Python。含括号、额外网络、
+   权重的块用 prompt_tokenizer.tokenize_segment 单独分词（有缓存）；括号跨越逗号、
+   含转义或 BREAK/AND 的提示以及非 ASCII 提示整条用 prompt_tokenizer 分词。
+2. 核心词按字节求 FNV-1a 64 位哈希（按字节位置逐列向量化），在按哈希排序的词典
+   数组中 np.searchsorted 查找；命中后与词典词逐字节比较，排除哈希碰撞。
+   词典中哈希相同的词（极少见）用 np.isin 挑出，回退到字典查找。
+3. 按 (提示序号, 分类) 稳定排序后，从分组边界的偏移量拼回每条提示的分类结果。
+
+结果与 classify_text（精确匹配，不启用模糊匹配和拼写纠错）完全相同。
+需要 NumPy（可选依赖）；未安装时 is_available() 为假。
+
+    matcher = VectorMatcher(token_map, category_names, extra_category)
+    results = matcher.classify_batch(texts)   # [{分类名: [提示词]}, ...]
+"""
+
+import importlib.util
+import itertools
+import operator
+import re
+
+import prompt_tokenizer
+
+UNCLASSIFIED = "未分类"
+FNV_OFFSET = 0xCBF29CE484222325
+FNV_PRIME = 0x100000001B3
+# str.strip()/split() 视为空白的 ASCII 字符
+ASCII_WHITESPACE = b" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f"
+# 含这些字节的块交给 prompt_tokenizer 分词：括号、额外网络、权重
+SYNTAX_BYTES = b"()[]{}<:"
+# 含 BREAK/AND 或转义的提示整条交给 prompt_tokenizer 分词
+_KEYWORD_RE = re.compile(r"\b(?:BREAK|AND)\b")
+
+
+def is_available():
+    return importlib.util.find_spec("numpy") is not None
+
+
+def fnv1a64(data):
+    """单个字节串的 FNV-1a 64 位哈希（与 hash_strings 的结果相同）"""
+    value = FNV_OFFSET
+    for byte in data:
+        value = ((value ^ byte) * FNV_PRIME) & 0xFFFFFFFFFFFFFFFF
+    return value
+
+
+def _columns(np, lengths):
+    """
+    按长度降序排列字节串，产出 (顺序, [(列号, 该列仍有字节的个数)])：
+    排序后第 j 列有字节的字节串恰好是前若干个
+    """
+    order = np.argsort(lengths, kind="stable")[::-1]
+    ascending = np.sort(lengths)
+    width = int(ascending[-1]) if len(ascending) else 0
+    active = len(lengths) - np.searchsorted(ascending, np.arange(width), side="right")
+    return order, list(zip(range(width), active.tolist()))
+
+
+def hash_strings(np, data, starts, lengths):
+    """对 data（uint8 数组）中的字节串 data[starts:starts+lengths] 批量求 FNV-1a 64"""
+    order, columns = _columns(np, lengths)
+    sorted_starts = starts[order]
+    hashes = np.full(len(order), FNV_OFFSET, dtype=np.uint64)
+    prime = np.uint64(FNV_PRIME)
+    for j, active in columns:
+        column = hashes[:active]
+        column ^= data[sorted_starts[:active] + j]
+        column *= prime
+    result = np.empty_like(hashes)
+    result[order] = hashes
+    return result
+
+
+def _bytes_equal(np, data_a, starts_a, data_b, starts_b, lengths):
+    """逐字节比较长度相同的两组字节串"""
+    order, columns = _columns(np, lengths)
+    a, b = starts_a[order], starts_b[order]
+    equal = np.ones(len(order), dtype=bool)
+    for j, active in columns:
+        equal[:active] &= data_a[a[:active] + j] == data_b[b[:active] + j]
+    result = np.empty_like(equal)
+    result[order] = equal
+    return result
+
+
+def _pack_lines(np, strings):
+    """
+    把不含换行的字符串列表打包成 (uint8 数组, 起始偏移, 字节长度)。
+    空列表返回空数组，否则 "\n".join 会打包出一个空串
+    """
+    if not strings:
+        empty = np.zeros(0, dtype=np.intp)
+        return np.zeros(0, dtype=np.uint8), empty, empty
+    data = np.frombuffer("\n".join(strings).encode("utf-8") + b"\n", dtype=np.uint8)
+    ends = np.flatnonzero(data == 10)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    return data, starts, ends - starts
+
+
+def _take(values, indices):
+    """按下标列表从 values 中取出元素（在 C 层完成）"""
+    if not indices:
+        return []
+    taken = operator.itemgetter(*indices)(values)
+    return list(taken) if len(indices) > 1 else [taken]
+
+
+class VectorMatcher:
+    def __init__(self, token_map, names, extra_category=None):
+        """
+        token_map: {核心词: (分类名, 来源文件)}（get_token_map 的结果）
+        names: 结果中的分类名顺序（config["categories"] 的顺序）
+        extra_category: <lora:...> 等额外网络归入的分类名，不在 names 中时不参与分类
+        """
+        import numpy as np
+
+        self.np = np
+        self.token_map = token_map
+        self.names = [*names, UNCLASSIFIED]
+        category_ids = {name: i for i, name in enumerate(self.names)}
+        self.unclassified = category_ids[UNCLASSIFIED]
+        self.extra_id = category_ids.get(extra_category)
+        self.category_ids = category_ids
+        self._space = np.zeros(256, dtype=bool)
+        self._space[list(ASCII_WHITESPACE)] = True
+        self._syntax = np.zeros(256, dtype=bool)
+        self._syntax[list(SYNTAX_BYTES)] = True
+
+        keys = list(token_map)
+        data, starts, lengths = _pack_lines(np, keys)
+        hashes = hash_strings(np, data, starts, lengths)
+        owners = np.fromiter(
+            (category_ids[token_map[key][0]] for key in keys),
+            dtype=np.int32,
+            count=len(keys),
+        )
+        order = np.argsort(hashes, kind="stable")
+        self.hashes = hashes[order]
+        self.owners = owners[order]
+        self.key_data = data
+        self.key_starts = starts[order]
+        self.key_lengths = lengths[order]
+        # 词典内部的哈希碰撞：这些哈希值的查找回退到字典
+        duplicate = self.hashes[1:] == self.hashes[:-1]
+        self.ambiguous = np.unique(self.hashes[1:][duplicate])
+
+    def _lookup(self, data, starts, lengths):
+        """返回各核心词（data 中的字节串）的分类编号数组"""
+        np = self.np
+        ids = np.full(len(starts), self.unclassified, dtype=np.int32)
+        if not len(starts) or not len(self.hashes):
+            return ids
+        hashes = hash_strings(np, data, starts, lengths)
+        positions = np.searchsorted(self.hashes, hashes)
+        np.minimum(positions, len(self.hashes) - 1, out=positions)
+        hits = np.flatnonzero(self.hashes[positions] == hashes)
+        candidates = positions[hits]
+        # 碰撞校验：长度相同且逐字节相同才算命中
+        same = self.key_lengths[candidates] == lengths[hits]
+        hits, candidates = hits[same], candidates[same]
+        same = _bytes_equal(
+            np,
+            data,
+            starts[hits],
+            self.key_data,
+            self.key_starts[candidates],
+            lengths[hits],
+        )
+        ids[hits[same]] = self.owners[candidates[same]]
+
+        if len(self.ambiguous):
+            for i in np.flatnonzero(np.isin(hashes, self.ambiguous)).tolist():
+                key = data[starts[i] : starts[i] + lengths[i]].tobytes()
+                owner = self.token_map.get(key.decode("utf-8"))
+                ids[i] = self.category_ids[owner[0]] if owner else self.unclassified
+        return ids
+
+    def lookup(self, cores):
+        """返回各核心词的分类名列表，未命中的为"未分类" """
+        data, starts, lengths = _pack_lines(self.np, cores)
+        ids = self._lookup(data, starts, lengths).tolist() if cores else []
+        return [self.names[i] for i in ids]
+
+    def _split_plain(self, data):
+        """
+        在纯 ASCII 的字节数组 data 上按逗号/换行切块。不含 SYNTAX_BYTES 的块直接去掉
+        首尾空白、合并连续空白，返回 (原文列表, 原文起始偏移, 核心词字节串三元组,
+        含语法字符的块的 (起始偏移, 结束偏移))
+        """
+        np = self.np
+        separator = (data == ord(",")) | (data == ord("\n"))
+        content = ~separator
+        chunk_starts = np.flatnonzero(content & np.append(True, separator[:-1]))
+        chunk_ends = np.flatnonzero(content & np.append(separator[1:], True)) + 1
+        marked = np.zeros(len(chunk_starts), dtype=bool)
+        if len(chunk_starts):
+            marked = np.logical_or.reduceat(self._syntax[data], chunk_starts)
+        marked_chunks = (chunk_starts[marked], chunk_ends[marked])
+
+        # 每块第一个和最后一个非空白字节即 strip() 后的原文范围；全空白的块没有提示词
+        space = self._space[data]
+        solid = content & ~space
+        solid_positions = np.flatnonzero(solid)
+        chunk_starts, chunk_ends = chunk_starts[~marked], chunk_ends[~marked]
+        first = np.searchsorted(solid_positions, chunk_starts)
+        last = np.searchsorted(solid_positions, chunk_ends) - 1
+        nonempty = first <= last
+        raw_starts = solid_positions[first[nonempty]]
+        raw_ends = solid_positions[last[nonempty]] + 1
+
+        # 连续空白只保留第一个（替换为空格），去掉末尾空白，即 " ".join(core.split())
+        keep = solid | (content & np.append(False, solid[:-1]))
+        keep[raw_ends[raw_ends < len(data)]] = False
+        core_data = np.where(space, np.uint8(32), data)
+        kept_positions = np.flatnonzero(keep)
+        core_starts = np.searchsorted(kept_positions, raw_starts)
+        core_lengths = np.searchsorted(kept_positions, raw_ends) - core_starts
+        cores = (core_data[kept_positions], core_starts, core_lengths)
+
+        # 原文：取出各原文范围，每段后接一个换行，整体解码后切分，不逐个切片
+        selected = np.zeros(len(data) + 1, dtype=np.int8)
+        selected[raw_starts] = 1
+        selected[raw_ends] = -1
+        selected = np.cumsum(selected, dtype=np.int8) > 0
+        selected[raw_ends] = True
+        text = np.append(data, np.uint8(10))
+        text[raw_ends] = 10
+        raws = text[selected].tobytes().decode("ascii").split("\n")[:-1]
+        return raws, raw_starts, cores, marked_chunks
+
+    def _tokenize(self, tokens, raws, cores, extras):
+        """把可分类的 Token 追加到各列，返回追加的个数"""
+        count = 0
+        for token in tokens:
+            if token.kind == prompt_tokenizer.KIND_EXTRA_NETWORK:
+                if self.extra_id is None:
+                    continue
+                cores.append("")
+                extras.append(True)
+            elif token.kind in prompt_tokenizer.SYNTAX_KINDS:
+                continue
+            else:
+                core = token.core
+                # 同 main.match_token：词典中本身带反斜杠的提示词
+                if "\\" in token.raw and core not in self.token_map:
+                    core = prompt_tokenizer.literal_core(token.raw)
+                cores.append(core)
+                extras.append(False)
+            raws.append(token.raw)
+            count += 1
+        return count
+
+    def _resolve(self, raws, cores, extras):
+        """对核心词查表，额外网络直接归入 extra_category，返回 (分类编号, 是否为额外网络)"""
+        np = self.np
+        extras = np.asarray(extras, dtype=bool)
+        ids = self._lookup(*_pack_lines(np, cores)) if cores else np.zeros(0, np.int32)
+        if self.extra_id is not None:
+            ids[extras] = self.extra_id
+        return ids, extras
+
+    def _split_marked(self, joined, data, starts, ends):
+        """
+        含语法字符的块用 prompt_tokenizer 分词。相同的块（按字节哈希分组并逐字节校验）
+        只分词一次，再按出现次数展开。返回 (各列, 出现位置下标, 需要整条回退的块下标)：
+        各列为 [原文列表, 分类编号, 块内序号, 是否为额外网络]
+        """
+        np = self.np
+        lengths = ends - starts
+        hashes = hash_strings(np, data, starts, lengths)
+        _, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        representative = first[inverse]
+        # 哈希相同但内容不同（碰撞）的块不展开
+        same = lengths[representative] == lengths
+        same[same] = _bytes_equal(
+            np, data, starts[same], data, starts[representative[same]], lengths[same]
+        )
+
+        raws = []
+        cores = []
+        extras = []
+        counts = []
+        broken = []
+        for start, end in zip(starts[first].tolist(), ends[first].tolist()):
+            chunk = joined[start:end]
+            plain = prompt_tokenizer.is_plain(chunk)
+            # 括号未在块内闭合时片段会跨越逗号，由调用方整条回退
+            if not plain and not prompt_tokenizer.is_segment(chunk):
+                broken.append(True)
+                counts.append(0)
+                continue
+            tokens = prompt_tokenizer.tokenize_segment(chunk, plain)
+            broken.append(False)
+            counts.append(self._tokenize(tokens, raws, cores, extras))
+        ids, extras = self._resolve(raws, cores, extras)
+
+        unique_counts = np.asarray(counts, dtype=np.int64)
+        unique_offsets = np.cumsum(unique_counts) - unique_counts
+        fallback = ~same | np.asarray(broken, dtype=bool)[inverse]
+        counts = np.where(fallback, 0, unique_counts[inverse])
+        # 展开：第 k 次出现的块对应唯一块的第 offsets[k] 起 counts[k] 个提示词
+        occurrence = np.repeat(np.arange(len(starts)), counts)
+        within = np.arange(len(occurrence)) - (np.cumsum(counts) - counts)[occurrence]
+        index = unique_offsets[inverse][occurrence] + within
+        columns = [_take(raws, index.tolist()), ids[index], within, extras[index]]
+        return columns, occurrence, np.flatnonzero(fallback)
+
+    def classify_batch(self, texts):
+        """返回与 texts 一一对应的 {分类名: [提示词, ...], "未分类": [...]}"""
+        np = self.np
+        fast = []
+        slow = []
+        for i, text in enumerate(texts):
+            if (
+                text.isascii()
+                and "\\" not in text
+                and not (
+                    ("BREAK" in text or "AND" in text) and _KEYWORD_RE.search(text)
+                )
+            ):
+                fast.append(i)
+            else:
+                slow.append(i)
+
+        # 各来源的提示词：[原文列表, 所属提示, 分类编号, 位置, 是否为额外网络]，
+        # 位置只用于同一提示内排序
+        parts = []
+        fallback = set()
+        if fast:
+            joined = "\n".join(texts[i] for i in fast)
+            data = np.frombuffer(joined.encode("ascii"), dtype=np.uint8)
+            lengths = np.fromiter((len(texts[i]) for i in fast), np.int64, len(fast))
+            text_starts = np.append(0, np.cumsum(lengths + 1)[:-1])
+            fast_ids = np.asarray(fast, dtype=np.int64)
+
+            def prompt_of(offsets):
+                return fast_ids[np.searchsorted(text_starts, offsets, "right") - 1]
+
+            raws, raw_starts, cores, marked = self._split_plain(data)
+            parts.append(
+                [
+                    raws,
+                    prompt_of(raw_starts),
+                    self._lookup(*cores),
+                    raw_starts,
+                    np.zeros(len(raws), dtype=bool),
+                ]
+            )
+            marked_starts, marked_ends = marked
+            if len(marked_starts):
+                columns, occurrence, broken = self._split_marked(
+                    joined, data, marked_starts, marked_ends
+                )
+                raws, ids, within, extras = columns
+                marked_prompts = prompt_of(marked_starts)
+                parts.append(
+                    [
+                        raws,
+                        marked_prompts[occurrence],
+                        ids,
+                        marked_starts[occurrence] + within,
+                        extras,
+                    ]
+                )
+                fallback.update(marked_prompts[broken].tolist())
+
+        # 括号跨越逗号等情况：去掉已切出的提示词，整条提示交给 prompt_tokenizer
+        if fallback:
+            dropped = list(fallback)
+            for n, part in enumerate(parts):
+                keep = ~np.isin(part[1], dropped)
+                parts[n] = [
+                    _take(part[0], np.flatnonzero(keep).tolist()),
+                    *(column[keep] for column in part[1:]),
+                ]
+            slow.extend(sorted(fallback))
+        if slow:
+            raws = []
+            cores = []
+            extras = []
+            prompts = []
+            for i in slow:
+                tokens = prompt_tokenizer.tokenize(texts[i])
+                prompts += [i] * self._tokenize(tokens, raws, cores, extras)
+            ids, extras = self._resolve(raws, cores, extras)
+            parts.append(
+                [
+                    raws,
+                    np.asarray(prompts, dtype=np.int64),
+                    ids,
+                    np.arange(len(raws)),
+                    extras,
+                ]
+            )
+
+        results = [{name: [] for name in self.names} for _ in texts]
+        all_raws = list(itertools.chain.from_iterable(part[0] for part in parts))
+        if not all_raws:
+            return results
+        prompt_ids, category_ids, positions, extras = (
+            np.concatenate([part[n] for part in parts]) for n in range(1, 5)
+        )
+        # 同一提示、同一分类的提示词排在一起：额外网络在前，其余按出现位置
+        keys = prompt_ids * len(self.names) + category_ids
+        order = np.lexsort((positions, ~extras, keys))
+        keys = keys[order]
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        starts = np.append(0, bounds)
+        group_prompts, group_categories = np.divmod(keys[starts], len(self.names))
+        ordered = _take(all_raws, order.tolist())
+        for start, end, prompt, category in zip(
+            starts.tolist(),
+            np.append(bounds, len(keys)).tolist(),
+            group_prompts.tolist(),
+            group_categories.tolist(),
+        ):
+            # 去重（字典键保持插入顺序）
+            results[prompt][self.names[category]] = list(
+                dict.fromkeys(ordered[start:end])
+            )
+        return results